@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Query plan benchmark for the downloads database.
+
+Builds a throwaway database through DatabaseManager (so the real schema and
+migrations are applied), fills it with synthetic rows, then checks with
+EXPLAIN QUERY PLAN that every hot query uses its index and times each one.
+
+    python benchmarks/query_plans.py              # 1,000,000 rows
+    python benchmarks/query_plans.py --rows 5000000 --keep bench.db
+
+Exits with status 1 if any query falls back to a full table scan.
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import DatabaseManager  # noqa: E402
+
+FILE_TYPES = ('photo', 'video', 'document')
+
+# (name, sql, params, index expected in the plan)
+QUERIES = [
+    ('recent downloads',
+     "SELECT * FROM downloads ORDER BY download_date DESC LIMIT 100", (),
+     'idx_downloads_download_date'),
+    ('statistics by type',
+     "SELECT COUNT(*), SUM(file_size), COUNT(DISTINCT chat_id), file_type, COUNT(*) "
+     "FROM downloads GROUP BY file_type", (),
+     'idx_downloads_file_type'),
+    ('files of one chat',
+     "SELECT * FROM downloads WHERE chat_id = ? ORDER BY message_id", (1000042,),
+     'idx_downloads_chat_message'),
+    ('message lookup',
+     "SELECT * FROM downloads WHERE chat_id = ? AND message_id = ?", (1000042, 123),
+     'idx_downloads_chat_message'),
+    ('count by type',
+     "SELECT COUNT(*) FROM downloads WHERE file_type = ?", ('video',),
+     'idx_downloads_file_type'),
+    ('full-text search',
+     "SELECT d.* FROM downloads_fts JOIN downloads d ON d.id = downloads_fts.rowid "
+     "WHERE downloads_fts MATCH ? ORDER BY bm25(downloads_fts) LIMIT 20", ('"video_12345"',),
+     'VIRTUAL TABLE INDEX'),
+    ('folder media counts',
+     "SELECT media_type, files FROM stats_by_folder WHERE folder_path = ?", ('/downloads/1000042',),
+     'sqlite_autoindex_stats_by_folder_1'),
+    ('dedup check',
+     "SELECT 1 FROM downloads WHERE file_unique_id = ? LIMIT 1", ('123456',),
+     'sqlite_autoindex_downloads_1'),
+]
+
+
+def populate(db_path, rows, chats=500, batch=50000):
+    """Insert synthetic rows with a plain connection (much faster than record_download)."""
+    conn = sqlite3.connect(db_path)
+    start = datetime(2024, 1, 1)
+    rng = random.Random(42)
+    inserted = 0
+    while inserted < rows:
+        chunk = []
+        for i in range(inserted, min(inserted + batch, rows)):
+            chat_id = 1000000 + rng.randrange(chats)
+            file_type = rng.choice(FILE_TYPES)
+            chunk.append((
+                str(i), str(rng.getrandbits(63)), i, chat_id,
+                f'{file_type}_{i}', f'/downloads/{chat_id}/{file_type}_{i}',
+                rng.randrange(10_000, 2_000_000_000), file_type,
+                (start + timedelta(seconds=i * 30)).strftime('%Y-%m-%d %H:%M:%S'),
+                f'/downloads/{chat_id}',
+            ))
+        conn.executemany(
+            "INSERT INTO downloads (file_unique_id, file_id, message_id, chat_id, file_name, "
+            "file_path, file_size, file_type, download_date, folder_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            chunk)
+        conn.commit()
+        inserted += len(chunk)
+        print(f"\r  inserted {inserted:,}/{rows:,}", end='', flush=True)
+    print()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def time_query(conn, sql, params, runs=5):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='rows to insert (default: 1,000,000)')
+    parser.add_argument('--keep', metavar='DB', help='write the database here and keep it')
+    args = parser.parse_args()
+
+    db_path = args.keep or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    db = DatabaseManager(db_path)
+    print(f"Schema version {db.get_schema_version()} at {db_path}")
+    populate(db_path, args.rows)
+
+    conn = sqlite3.connect(db_path)
+    failures = 0
+    for name, sql, params, index in QUERIES:
+        plan = explain(conn, sql, params)
+        uses_index = any(index in step for step in plan)
+        full_scan = any(step.startswith('SCAN downloads') and 'INDEX' not in step for step in plan)
+        ok = uses_index and not full_scan
+        failures += not ok
+        print(f"\n[{'OK' if ok else 'FAIL'}] {name}: {time_query(conn, sql, params):.2f} ms (median of 5)")
+        for step in plan:
+            print(f"    {step}")
+    conn.close()
+    db.close()
+
+    if not args.keep:
+        os.remove(db_path)
+    print(f"\n{len(QUERIES) - failures}/{len(QUERIES)} queries use their index")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -57,6 +57,39 @@ DATABASE_PATH = get_database_path()
 MAX_FILE_SIZE_MB = 50  # Telegram bot file upload limit
 SESSION_NAME = 'bot_session'
 
+# Webhook Configuration (leave WEBHOOK_URL empty to use long polling)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Public HTTPS URL Telegram pushes updates to
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # X-Telegram-Bot-Api-Secret-Token
+
+# Metrics Configuration (leave METRICS_PORT empty to disable the /metrics endpoint)
+METRICS_PORT = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+
+# Background cleanup: seconds between checks of a small batch of download records (0 = disabled)
+CLEANUP_INTERVAL = int(os.getenv('CLEANUP_INTERVAL', '60'))
+
+# SQLite maintenance while idle: PRAGMA optimize, ANALYZE, incremental vacuum, WAL checkpoint (seconds, 0 = disabled)
+DB_MAINTENANCE_INTERVAL = int(os.getenv('DB_MAINTENANCE_INTERVAL', '3600'))
+# Online database backups (leave DB_BACKUP_DIR empty to disable)
+DB_BACKUP_DIR = os.getenv('DB_BACKUP_DIR')
+DB_BACKUP_INTERVAL = int(os.getenv('DB_BACKUP_INTERVAL', '86400'))
+DB_BACKUP_KEEP = int(os.getenv('DB_BACKUP_KEEP', '7'))
+
+# Seconds before an unfinished folder selection (no /ok) is discarded
+NAVIGATION_TTL = int(os.getenv('NAVIGATION_TTL', '3600'))
+
+# JSON routing rules that pick the download folder without /ok (leave empty for interactive selection only)
+ROUTING_RULES_FILE = os.getenv('ROUTING_RULES_FILE')
+
+# Start downloading into DOWNLOADS_PATH/.staging while the folder is being chosen; /ok moves the files
+SPECULATIVE_DOWNLOADS = os.getenv('SPECULATIVE_DOWNLOADS', 'true').lower() in ('1', 'true', 'yes')
+
+# Request Tracing (leave TRACE_FILE empty to disable; rotated at 10MB, 5 backups)
+TRACE_FILE = os.getenv('TRACE_FILE')
+
 # Create directories if they don't exist
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 os.makedirs(LOGS_DIR, exist_ok=True)
\ No newline at end of file
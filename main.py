@@ -30,7 +30,13 @@ fix_stdin_stdout()
 # Add the project root to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config.config import validate_config, API_ID, API_HASH, PHONE_NUMBER, BOT_TOKEN
+from config.config import (
+    validate_config, API_ID, API_HASH, PHONE_NUMBER, BOT_TOKEN,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    METRICS_PORT, METRICS_LISTEN, TRACE_FILE, LOGS_DIR, CLEANUP_INTERVAL,
+    DB_MAINTENANCE_INTERVAL, DB_BACKUP_DIR, DB_BACKUP_INTERVAL, DB_BACKUP_KEEP, NAVIGATION_TTL,
+    ROUTING_RULES_FILE, SPECULATIVE_DOWNLOADS
+)
 from src.bot import TelegramMediaBot
 
 async def main():
@@ -41,7 +47,25 @@ async def main():
         print("✅ Configuration validated successfully")
         
         # Create and run the bot
-        bot = TelegramMediaBot(API_ID, API_HASH, PHONE_NUMBER, BOT_TOKEN)
+        bot = TelegramMediaBot(
+            API_ID, API_HASH, PHONE_NUMBER, BOT_TOKEN,
+            webhook_url=WEBHOOK_URL,
+            webhook_listen=WEBHOOK_LISTEN,
+            webhook_port=WEBHOOK_PORT,
+            webhook_path=WEBHOOK_PATH,
+            webhook_secret=WEBHOOK_SECRET,
+            metrics_port=METRICS_PORT,
+            metrics_listen=METRICS_LISTEN,
+            trace_file=TRACE_FILE,
+            cleanup_interval=CLEANUP_INTERVAL,
+            maintenance_interval=DB_MAINTENANCE_INTERVAL,
+            backup_dir=DB_BACKUP_DIR,
+            backup_interval=DB_BACKUP_INTERVAL,
+            backup_keep=DB_BACKUP_KEEP,
+            navigation_ttl=NAVIGATION_TTL,
+            routing_rules_file=ROUTING_RULES_FILE,
+            speculative_downloads=SPECULATIVE_DOWNLOADS
+        )
         await bot.run()
         
     except ValueError as e:
@@ -53,6 +77,67 @@ async def main():
         print(f"❌ Unexpected error: {e}")
         sys.exit(1)
 
+async def archive(chat, download_dir=None):
+    """Incrementally archive a whole channel from the command line."""
+    try:
+        validate_config()
+        from src.archiver import ChannelArchiver
+
+        bot = TelegramMediaBot(API_ID, API_HASH, PHONE_NUMBER, BOT_TOKEN, trace_file=TRACE_FILE)
+        await bot.start_client()
+        try:
+            result = await bot.archive_chat(ChannelArchiver.parse_chat_reference(chat), download_dir)
+        finally:
+            await bot.client.disconnect()
+
+        print(
+            f"✅ Archived {result['scanned']} messages, "
+            f"{result['downloaded']} new files, {result['failed']} failed "
+            f"(checkpoint #{result['last_message_id']}) -> {result['download_dir']}"
+        )
+        if result['failed'] > 0:
+            sys.exit(2)
+
+    except ValueError as e:
+        print(f"❌ Configuration error: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n🛑 Archive stopped by user")
+
+def trace_summary(path=None):
+    """Print p50/p99 latency of each request phase from the trace file(s)."""
+    from src import tracing
+
+    path = path or TRACE_FILE or os.path.join(LOGS_DIR, 'trace.jsonl')
+    files = tracing.trace_files(path)
+    if not files:
+        print(f"❌ No trace file found at {path} (set TRACE_FILE to enable tracing)")
+        sys.exit(1)
+    print(f"📊 {len(files)} trace file(s): {path}")
+    print(tracing.format_summary(tracing.summarize(files)))
+
+def export(path, fmt=None, since=None, before=None, chat_id=None, file_type=None):
+    """Stream the download history to CSV/JSONL ('-' for stdout)."""
+    from src.database import DatabaseManager
+    from src.exporter import export_downloads
+
+    def progress(count):
+        print(f"  {count:,} rows...", file=sys.stderr, flush=True)
+
+    try:
+        count = export_downloads(
+            DatabaseManager(), path, fmt,
+            since=since, before=before, chat_id=chat_id, file_type=file_type,
+            progress_callback=progress
+        )
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n🛑 Export stopped by user", file=sys.stderr)
+        sys.exit(1)
+    print(f"✅ Exported {count:,} downloads -> {path}", file=sys.stderr)
+
 def run_gui():
     """Run the GUI application."""
     try:
@@ -76,12 +161,27 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Telegram Auto Download Bot")
     parser.add_argument("--gui", action="store_true", help="Run in GUI mode")
     parser.add_argument("--cli", action="store_true", help="Run in CLI mode (default)")
+    parser.add_argument("--archive", metavar="CHAT", help="Archive all media of a channel (@username, t.me link or ID) and exit")
+    parser.add_argument("--archive-dir", metavar="DIR", help="Base directory for --archive (default: <downloads>/archive)")
+    parser.add_argument("--trace-summary", nargs="?", const="", metavar="FILE", help="Print p50/p99 of each request phase from the trace file (default: TRACE_FILE) and exit")
+    parser.add_argument("--export", metavar="FILE", help="Export the download history to FILE ('-' for stdout) and exit")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="Export format (default: from the file extension, else csv)")
+    parser.add_argument("--since", metavar="DATE", help="Export downloads on or after DATE (YYYY-MM-DD[ HH:MM:SS], UTC)")
+    parser.add_argument("--before", metavar="DATE", help="Export downloads before DATE")
+    parser.add_argument("--chat", type=int, metavar="ID", help="Export only downloads from this chat ID")
+    parser.add_argument("--type", dest="file_type", metavar="TYPE", help="Export only this file type (photo/video/document/...)")
     
     args = parser.parse_args()
     
     # Default to GUI if no arguments provided and we're in a Windows environment
     # or if explicitly requested
-    if args.gui or (not args.cli and not sys.argv[1:] and os.name == 'nt'):
+    if args.trace_summary is not None:
+        trace_summary(args.trace_summary or None)
+    elif args.export:
+        export(args.export, args.format, args.since, args.before, args.chat, args.file_type)
+    elif args.archive:
+        asyncio.run(archive(args.archive, args.archive_dir))
+    elif args.gui or (not args.cli and not sys.argv[1:] and os.name == 'nt'):
         run_gui()
     else:
         asyncio.run(main())
\ No newline at end of file
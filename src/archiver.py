@@ -0,0 +1,108 @@
+import os
+import logging
+from telethon import TelegramClient
+
+from .downloader import MediaDownloader
+from .monitor import DownloadMonitor
+
+logger = logging.getLogger(__name__)
+
+INVALID_FOLDER_CHARS = ['/', '\\', ':', '*', '?', '"', '<', '>', '|']
+
+
+def get_chat_folder_name(entity):
+    """頻道備份資料夾名稱：標題 + ID，標題變更時仍可辨識"""
+    title = getattr(entity, 'title', None) or getattr(entity, 'username', None) or ''
+    for char in INVALID_FOLDER_CHARS:
+        title = title.replace(char, '_')
+    title = title.strip()
+    return f"{title}_{entity.id}" if title else str(entity.id)
+
+
+class ChannelArchiver:
+    """整個頻道的增量備份，以每個頻道的最高訊息 ID 作為檢查點"""
+
+    def __init__(self, client: TelegramClient, downloader: MediaDownloader, batch_size=100):
+        self.client = client
+        self.downloader = downloader
+        self.async_db = downloader.async_db
+        self.batch_size = batch_size
+
+    @staticmethod
+    def parse_chat_reference(text):
+        """將 /archive 參數轉為 get_entity 可接受的形式（數字 ID、@username 或 t.me 連結）"""
+        ref = text.strip()
+        if ref.lstrip('-').isdigit():
+            return int(ref)
+        return ref
+
+    async def archive(self, chat, base_dir, progress_callback=None):
+        """
+        從檢查點之後開始備份頻道中的所有媒體。
+        每批 batch_size 則訊息下載完成後才推進檢查點；若該批有下載失敗則停止，
+        下次執行會從同一批重新開始（已下載的文件會被資料庫去重跳過）。
+        Returns: dict(scanned, media, downloaded, failed, last_message_id, download_dir)
+        """
+        entity = await self.client.get_entity(chat)
+        chat_id = entity.id
+        download_dir = os.path.join(base_dir, get_chat_folder_name(entity))
+        last_message_id = await self.async_db.get_archive_cursor(chat_id)
+
+        result = {
+            'scanned': 0,
+            'media': 0,
+            'downloaded': 0,
+            'failed': 0,
+            'last_message_id': last_message_id,
+            'download_dir': download_dir
+        }
+        logger.info(f"開始備份頻道 {chat_id}，從訊息 ID {last_message_id} 之後開始")
+
+        batch = []
+        batch_last_id = last_message_id
+        # reverse=True 由舊到新遍歷，使檢查點可以單調遞增
+        async for message in self.client.iter_messages(entity, min_id=last_message_id, reverse=True):
+            result['scanned'] += 1
+            batch_last_id = message.id
+            if getattr(message, 'media', None):
+                batch.append(message)
+
+            if result['scanned'] % self.batch_size == 0:
+                if not await self._flush_batch(chat_id, batch, batch_last_id, download_dir, result):
+                    return result
+                batch = []
+                if progress_callback:
+                    await progress_callback(result)
+
+        if batch_last_id > result['last_message_id']:
+            await self._flush_batch(chat_id, batch, batch_last_id, download_dir, result)
+            if progress_callback:
+                await progress_callback(result)
+
+        logger.info(
+            f"頻道 {chat_id} 備份完成 - 掃描: {result['scanned']}, 媒體: {result['media']}, "
+            f"下載: {result['downloaded']}, 失敗: {result['failed']}, 檢查點: {result['last_message_id']}"
+        )
+        return result
+
+    async def _flush_batch(self, chat_id, batch, batch_last_id, download_dir, result):
+        """下載一批媒體並推進檢查點，全部成功時回傳 True"""
+        # 每批使用獨立的監控器：共用監控器也記錄即時監看的下載，失敗數會互相混淆
+        monitor = DownloadMonitor(max_slots=self.downloader.max_concurrent_downloads)
+        monitor.reset()
+
+        files = []
+        if batch:
+            result['media'] += len(batch)
+            files = await self.downloader.download_multiple_messages_concurrent(batch, download_dir, monitor=monitor)
+        result['downloaded'] += len(files)
+
+        failed = monitor.failed_files
+        if failed > 0:
+            result['failed'] += failed
+            logger.warning(f"頻道 {chat_id} 有 {failed} 個文件下載失敗，檢查點停在 {result['last_message_id']}")
+            return False
+
+        await self.async_db.update_archive_cursor(chat_id, batch_last_id)
+        result['last_message_id'] = batch_last_id
+        return True
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from .database import DatabaseManager, is_staging_folder
+from .metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AsyncDatabase:
+    """
+    DatabaseManager 的 async 介面。
+
+    所有請求放入佇列，由一個專用的資料庫線程依序執行，結果以 Future 回到事件迴圈。
+    磁碟緩慢時只有等待結果的協程會暫停，事件迴圈（Telethon 的網路 I/O）不受影響。
+    """
+
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+        self._requests = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # ---------------------- lifecycle ----------------------
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._serve, name='database', daemon=True)
+                self._thread.start()
+
+    def close(self, timeout: float = 5.0):
+        """處理完佇列中剩餘的請求後停止資料庫線程"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._requests.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+
+    def _serve(self):
+        while True:
+            request = self._requests.get()
+            if request is _STOP:
+                break
+            context, loop, future, func, args, kwargs = request
+            QUEUE_DEPTH.set(self._requests.qsize(), queue='database')
+            try:
+                # 在呼叫端的 context 中執行，追蹤 span 會接在原本的請求底下
+                result = context.run(func, *args, **kwargs)
+                callback, value = self._set_result, result
+            except BaseException as e:
+                callback, value = self._set_exception, e
+            try:
+                loop.call_soon_threadsafe(callback, future, value)
+            except RuntimeError:
+                # 事件迴圈已關閉，已無人等待結果
+                logger.debug("事件迴圈已關閉，丟棄資料庫請求結果")
+
+    @staticmethod
+    def _set_result(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future, exc):
+        if not future.done():
+            future.set_exception(exc)
+
+    # ---------------------- requests ----------------------
+    def call(self, func, *args, **kwargs) -> asyncio.Future:
+        """在資料庫線程中執行 func(*args, **kwargs)，回傳可 await 的 Future"""
+        self._ensure_thread()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._requests.put((contextvars.copy_context(), loop, future, func, args, kwargs))
+        QUEUE_DEPTH.set(self._requests.qsize(), queue='database')
+        return future
+
+    # 去重檢查先在事件迴圈上查 去重過濾器，確定沒有記錄時不進入資料庫佇列
+    async def is_file_downloaded(self, file_unique_id: str) -> bool:
+        if not self.db.might_be_downloaded(file_unique_id):
+            return False
+        return await self.call(self.db.is_file_downloaded, file_unique_id)
+
+    async def get_downloaded_file_info(self, file_unique_id: str) -> Optional[dict]:
+        if not self.db.might_be_downloaded(file_unique_id):
+            return None
+        return await self.call(self.db.get_downloaded_file_info, file_unique_id)
+
+    async def get_downloaded_files_info(self, file_unique_ids: Iterable[str]) -> Dict[str, dict]:
+        return await self.call(self.db.get_downloaded_files_info, list(file_unique_ids))
+
+    async def find_existing_downloads(self, file_unique_ids: Iterable[str]) -> Dict[str, dict]:
+        """
+        已下載且實體檔案仍存在的記錄；os.path.exists 也在資料庫線程中執行（網路磁碟可能很慢）。
+        先行下載到暫存資料夾的記錄不算：該工作可能被取消，文件與記錄會一起刪除。
+        """
+        def lookup(ids):
+            infos = self.db.get_downloaded_files_info(ids)
+            return {
+                fid: info for fid, info in infos.items()
+                if not is_staging_folder(info.get('folder_path')) and os.path.exists(info['file_path'])
+            }
+
+        candidates = [str(fid) for fid in file_unique_ids if self.db.might_be_downloaded(fid)]
+        if not candidates:
+            return {}
+        return await self.call(lookup, candidates)
+
+    async def record_download(self, **kwargs) -> bool:
+        return await self.call(self.db.record_download, **kwargs)
+
+    async def record_download_performance(self, **kwargs) -> bool:
+        return await self.call(self.db.record_download_performance, **kwargs)
+
+    async def search_downloads(self, query: str, limit: int = 20, offset: int = 0):
+        return await self.call(self.db.search_downloads, query, limit, offset)
+
+    async def get_archive_cursor(self, chat_id: int) -> int:
+        return await self.call(self.db.get_archive_cursor, chat_id)
+
+    async def update_archive_cursor(self, chat_id: int, last_message_id: int) -> bool:
+        return await self.call(self.db.update_archive_cursor, chat_id, last_message_id)
+
+    async def add_watch_subscription(self, chat_id: int, title: str, folder_name: str) -> bool:
+        return await self.call(self.db.add_watch_subscription, chat_id, title, folder_name)
+
+    async def remove_watch_subscription(self, chat_id: int) -> bool:
+        return await self.call(self.db.remove_watch_subscription, chat_id)
+
+    async def get_watch_subscriptions(self) -> List[dict]:
+        return await self.call(self.db.get_watch_subscriptions)
+
+    async def save_navigation_state(self, user_id: int, state: str, updated_at: float) -> bool:
+        return await self.call(self.db.save_navigation_state, user_id, state, updated_at)
+
+    async def delete_navigation_state(self, user_id: int) -> bool:
+        return await self.call(self.db.delete_navigation_state, user_id)
+
+    async def load_navigation_states(self, max_age: float = None):
+        return await self.call(self.db.load_navigation_states, max_age)
+
+    async def get_folder_media_counts(self, folder: str) -> Dict[str, int]:
+        return await self.call(self.db.get_folder_media_counts, folder)
+
+    async def reconcile_folder(self, folder: str) -> int:
+        return await self.call(self.db.reconcile_folder, folder)
+
+    async def get_folder_files(self, folder: str):
+        return await self.call(self.db.get_folder_files, folder)
+
+    async def update_download_paths(self, moves) -> bool:
+        return await self.call(self.db.update_download_paths, moves)
+
+    async def delete_folder_downloads(self, folder: str) -> int:
+        return await self.call(self.db.delete_folder_downloads, folder)
+
+    async def set_last_folder(self, user_id: int, folder: str) -> bool:
+        return await self.call(self.db.set_last_folder, user_id, folder)
+
+    async def get_last_folders(self):
+        return await self.call(self.db.get_last_folders)
+
+    async def cleanup_missing_files_step(self, batch_size: int = 500):
+        return await self.call(self.db.cleanup_missing_files_step, batch_size)
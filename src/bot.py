@@ -4,14 +4,25 @@ import sys
 import logging
 import time
 import queue
+import secrets
+import signal
 from telethon import TelegramClient
 from telethon.errors import RPCError
-from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters, ContextTypes
 
-from .monitor import DownloadMonitor
+from .monitor import DownloadMonitor, ProgressReporter
 from .downloader import MediaDownloader
-from .folder_navigator import FolderNavigator
+from .folder_navigator import CALLBACK_PREFIX, FolderNavigator, MediaRef, NavigationState
+from .destination_router import DestinationRouter, media_type_of
+from .archiver import ChannelArchiver
+from .watcher import ChatWatcher
+from .message_scheduler import MessageScheduler
+from .message_cache import SourceMessageCache
+from .maintenance import DatabaseMaintenance
+from .staging import StagingArea
+from . import metrics
+from . import tracing
 
 # 設定日誌
 log_queue = queue.Queue()
@@ -60,10 +71,18 @@ logging.getLogger('telethon.client.updates').setLevel(logging.WARNING)
 class TelegramMediaBot:
     """精簡重構版：合併重複邏輯並抽出共用方法"""
 
-    def __init__(self, api_id, api_hash, phone_number, bot_token):
+    def __init__(self, api_id, api_hash, phone_number, bot_token,
+                 webhook_url=None, webhook_listen='127.0.0.1', webhook_port=8443,
+                 webhook_path='telegram', webhook_secret=None,
+                 metrics_port=None, metrics_listen='127.0.0.1', trace_file=None,
+                 cleanup_interval=60, maintenance_interval=3600, backup_dir=None,
+                 backup_interval=86400, backup_keep=7, navigation_ttl=3600, routing_rules_file=None,
+                 speculative_downloads=True):
         # media group handling
         self.media_groups = {}
         self.group_timers = {}
+        # user_id -> (trace_id, 開始選擇資料夾的時間)
+        self.pending_traces = {}
 
         # Telethon client with GUI-friendly settings
         self.client = TelegramClient(
@@ -94,16 +113,63 @@ class TelegramMediaBot:
         downloads_path = os.getenv('DOWNLOADS_PATH', os.path.join(base_dir, 'downloads'))
         self.downloads_path = downloads_path
 
-        self.monitor = DownloadMonitor(self.loop)
+        self.message_scheduler = MessageScheduler()
+        self.progress_reporter = ProgressReporter(self.message_scheduler)
+        # 共用監控器：頻道備份與即時監看使用，轉發的下載工作各自建立監控器
+        self.monitor = DownloadMonitor(max_slots=5)
         self.downloader = MediaDownloader(self.client, max_concurrent_downloads=5, db_path=db_path)
         self.downloader.set_monitor(self.monitor)
-        self.folder_navigator = FolderNavigator(base_path=downloads_path)
+        self.source_cache = SourceMessageCache(maxsize=256, ttl=600)
+        self.downloader.set_file_reference_callback(self.source_cache.invalidate_message)
+        # 下載完成時讓資料夾索引失效（update_downloads_path 會換掉 folder_navigator，呼叫時才取用）
+        self.downloader.set_file_written_callback(lambda path: self.folder_navigator.directory_index.invalidate(path))
+        # 未送出 /ok 的資料夾選擇在 navigation_ttl 秒後清除
+        self.navigation_ttl = navigation_ttl
+        self.folder_navigator = self._create_folder_navigator(downloads_path)
+        # 符合路由規則的工作直接下載，不需互動選擇資料夾；user_id -> 上次 /ok 的相對路徑
+        self.router = DestinationRouter.from_file(routing_rules_file)
+        self.last_folders = {}
+        # 等待選擇資料夾時先下載到暫存資料夾，/ok 後移到選定的位置
+        self.staging = StagingArea(self.downloader, downloads_path) if speculative_downloads else None
+        self.archiver = ChannelArchiver(self.client, self.downloader)
+        self.archive_tasks = {}
+        self.watcher = ChatWatcher(self.client, self.downloader, os.path.join(downloads_path, 'archive'))
 
         self.phone_number = phone_number
         self.bot_token = bot_token
 
+        # webhook (None = long polling)
+        self.webhook_url = webhook_url
+        self.webhook_listen = webhook_listen
+        self.webhook_port = webhook_port
+        self.webhook_path = webhook_path
+        self.webhook_secret = webhook_secret
+        self._stop_event = None
+
+        # metrics endpoint (None = disabled)
+        self.metrics_port = metrics_port
+        self.metrics_listen = metrics_listen
+
+        # per-phase request tracing (None = disabled)
+        if trace_file:
+            tracing.configure(trace_file)
+
+        # 背景增量清理不存在文件的記錄 (秒，0 = 停用)
+        self.cleanup_interval = cleanup_interval
+        # 閒置時的資料庫維護與線上備份 (秒，0 = 停用；backup_dir 為 None 時不備份)
+        self.maintenance = DatabaseMaintenance(
+            self.downloader.async_db, self.is_idle,
+            interval=maintenance_interval, backup_dir=backup_dir,
+            backup_interval=backup_interval, backup_keep=backup_keep
+        )
+
         # Bot Application (python-telegram-bot)
         self.app = Application.builder().token(bot_token).build()
+        self.app.add_handler(CommandHandler('archive', self.handle_archive_command))
+        self.app.add_handler(CommandHandler('watch', self.handle_watch_command))
+        self.app.add_handler(CommandHandler('unwatch', self.handle_unwatch_command))
+        self.app.add_handler(CommandHandler('search', self.handle_search_command))
+        self.app.add_handler(CallbackQueryHandler(self.handle_folder_callback, pattern=f'^{CALLBACK_PREFIX}:'))
         self.app.add_handler(MessageHandler(filters.ALL, self.handle_message))
 
     # ---------------------- startup ----------------------
@@ -193,13 +259,15 @@ class TelegramMediaBot:
         Returns (original_message or None, list_of_replies)
         """
         try:
-            chat = await self.client.get_entity(chat_id)
+            with tracing.span('get_entity', chat_id=chat_id):
+                chat = await self.client.get_entity(chat_id)
         except Exception as e:
             logger.error(f'無法獲取聊天實體 {chat_id}: {e}')
             return None, []
 
         try:
-            original = await self.client.get_messages(chat, ids=message_id)
+            with tracing.span('get_messages', message_id=message_id):
+                original = await self.client.get_messages(chat, ids=message_id)
             if not original:
                 logger.warning(f'未找到訊息 ID {message_id} in {chat_id}')
                 return None, []
@@ -209,8 +277,10 @@ class TelegramMediaBot:
 
         replies = []
         try:
-            async for r in self.client.iter_messages(chat, reply_to=message_id):
-                replies.append(r)
+            with tracing.span('get_replies') as span:
+                async for r in self.client.iter_messages(chat, reply_to=message_id):
+                    replies.append(r)
+                span['count'] = len(replies)
         except Exception as e:
             logger.warning(f'獲取回覆失敗，但繼續處理: {e}')
 
@@ -302,34 +372,216 @@ class TelegramMediaBot:
             # fallback 保守處理
             return [original_message] if getattr(original_message, "media", None) else []
 
+    async def _resolve_messages_to_download(self, chat_id, original_message_id, collect_group, trace_id=None):
+        """
+        解析要下載的媒體訊息：原訊息（或其媒體組）加上有媒體的回覆。
+        結果放入 source_cache，重複轉發同一則訊息時直接使用快取，不需呼叫 API。
+        Returns: list of messages；無法取得原訊息時回傳 None
+        """
+        mode = 'group' if collect_group else 'single'
+        with tracing.span('resolve', trace_id=trace_id, chat_id=chat_id, mode=mode) as span:
+            cached = self.source_cache.get(chat_id, original_message_id, mode)
+            span['cache_hit'] = cached is not None
+            if cached is not None:
+                logger.info(f'使用快取的訊息解析結果 {chat_id}/{original_message_id} ({len(cached)} 個媒體)')
+                return cached
+
+            original_message, replies = await self.get_message_and_replies(chat_id, original_message_id)
+            if not original_message:
+                return None
+
+            if collect_group:
+                # collect all messages to download: prefer collecting media group from origin
+                with tracing.span('collect_media'):
+                    messages_to_download = await self._collect_media_from_original(chat_id, original_message)
+            else:
+                messages_to_download = [original_message] if getattr(original_message, 'media', None) else []
+            # also include replies with media
+            for r in replies:
+                if getattr(r, 'media', None):
+                    messages_to_download.append(r)
+
+            span['media'] = len(messages_to_download)
+            self.source_cache.put(chat_id, original_message_id, mode, messages_to_download)
+            return messages_to_download
+
+    _media_type = staticmethod(media_type_of)
+
     def _count_media_types(self, messages):
         counts = {'video': 0, 'photo': 0, 'document': 0}
         for m in messages:
-            if getattr(m, 'video', None):
-                counts['video'] += 1
-            elif getattr(m, 'photo', None):
-                counts['photo'] += 1
-            elif getattr(m, 'document', None):
-                counts['document'] += 1
+            media_type = self._media_type(m)
+            if media_type:
+                counts[media_type] += 1
         return counts
 
-    async def _prepare_folder_selection(self, user_id, messages_to_download, processing_msg):
-        """共用的：觸發 FolderNavigator 並編輯 processing_msg 顯示資訊"""
+    def _to_media_refs(self, messages):
+        """等待選擇資料夾期間只保留精簡參照，不持有 Message 物件"""
+        return [
+            MediaRef(m.chat_id, m.id, self.downloader.get_media_size(m), self._media_type(m) or 'document')
+            for m in messages
+        ]
+
+    async def _rehydrate_messages(self, refs, batch_size=100, trace_id=None):
+        """依 MediaRef 分批向 Telegram 取回訊息（同時取得新的 file reference），保持原順序"""
+        ids_by_chat = {}
+        for ref in refs:
+            ids_by_chat.setdefault(ref.chat_id, []).append(ref.message_id)
+
+        found = {}
+        with tracing.span('rehydrate', trace_id=trace_id, files=len(refs)):
+            for chat_id, ids in ids_by_chat.items():
+                for start in range(0, len(ids), batch_size):
+                    try:
+                        messages = await self.client.get_messages(chat_id, ids=ids[start:start + batch_size])
+                    except Exception as e:
+                        logger.error(f'取回聊天室 {chat_id} 的訊息時出錯: {e}')
+                        continue
+                    for m in messages:
+                        if m is not None and getattr(m, 'media', None):
+                            found[(chat_id, m.id)] = m
+
+        missing = len(refs) - len(found)
+        if missing:
+            logger.warning(f'{missing} 則待下載訊息已無法取得（可能已被刪除）')
+        return [found[(ref.chat_id, ref.message_id)] for ref in refs if (ref.chat_id, ref.message_id) in found]
+
+    def _create_folder_navigator(self, base_path):
+        return FolderNavigator(
+            base_path=base_path, async_db=self.downloader.async_db,
+            state_ttl=self.navigation_ttl, on_evict=self._on_navigation_evicted
+        )
+
+    def _on_navigation_evicted(self, user_id):
+        self.pending_traces.pop(user_id, None)
+        if self.staging:
+            self.staging.discard_later(user_id)
+
+    async def _save_navigation_state(self, user_id):
+        state = self.folder_navigator.user_states.get(user_id)
+        if state and state.awaiting_folder_selection:
+            await self.downloader.async_db.save_navigation_state(user_id, state.to_json(), state.updated_at)
+        else:
+            await self.downloader.async_db.delete_navigation_state(user_id)
+
+    async def _restore_navigation_states(self):
+        """重新啟動後恢復尚未選定資料夾的工作"""
+        try:
+            rows = await self.downloader.async_db.load_navigation_states(self.navigation_ttl)
+            states = [NavigationState.from_json(user_id, data, updated_at) for user_id, data, updated_at in rows]
+            self.folder_navigator.restore_states(states)
+            if self.router.enabled:
+                self.last_folders = await self.downloader.async_db.get_last_folders()
+        except Exception as e:
+            logger.error(f'恢復資料夾選擇狀態時出錯: {e}')
+
+    async def _route_automatically(self, user_id, messages_to_download, processing_msg, trace_id=None):
+        """依路由規則決定資料夾並直接開始下載；需要互動選擇時回傳 False"""
+        if not self.router.enabled:
+            return False
+        sizes = [self.downloader.get_media_size(m) for m in messages_to_download]
+        destination = self.router.route(messages_to_download, sizes, self.last_folders.get(user_id))
+        if destination is None:
+            return False
+
+        selected_folder = os.path.join(self.downloads_path, destination) if destination else self.downloads_path
+        logger.info(f'用戶 {user_id} 的 {len(messages_to_download)} 個媒體依規則存放到: {destination or "/"}')
+        self.message_scheduler.edit(
+            processing_msg,
+            f"📊 找到 {len(messages_to_download)} 個媒體文件\n📁 依路由規則存放到: /{destination}",
+            final=True
+        )
+        await self._start_download_with_selected_folder(
+            processing_msg, user_id, messages_to_download, trace_id=trace_id, selected_folder=selected_folder)
+        return True
+
+    async def _prepare_folder_selection(self, user_id, messages_to_download, processing_msg, trace_id=None):
+        """共用的：符合路由規則時直接下載，否則觸發 FolderNavigator 並編輯 processing_msg 顯示資訊"""
+        if await self._route_automatically(user_id, messages_to_download, processing_msg, trace_id=trace_id):
+            return
+        # 記錄開始等待選擇資料夾的時間，/ok 時寫入 folder_selection span
+        self.pending_traces[user_id] = (trace_id, time.time())
         counts = self._count_media_types(messages_to_download)
-        ui_text = self.folder_navigator.start_folder_selection(user_id, messages_to_download, {'video': 0, 'photo': 0, 'document': 0})
+        ui_text = await self.folder_navigator.start_folder_selection(
+            user_id, self._to_media_refs(messages_to_download), {'video': 0, 'photo': 0, 'document': 0})
+        await self._save_navigation_state(user_id)
+        if self.staging:
+            await self.staging.start(user_id, messages_to_download)
 
         info_text = f"📊 找到 {len(messages_to_download)} 個媒體文件\n"
-        info_text += f"影片: {counts['video']} 個, 照片: {counts['photo']} 個, 檔案: {counts['document']} 個\n\n"
+        info_text += f"影片: {counts['video']} 個, 照片: {counts['photo']} 個, 檔案: {counts['document']} 個\n"
+        if self.staging:
+            info_text += "⏬ 已在背景開始下載，確認後移到選定的資料夾\n"
+        info_text += "\n"
         info_text += ui_text + "\n\n"
         info_text += (
+            "點選下方按鈕瀏覽資料夾，輸入文字可篩選資料夾名稱。\n"
             "命令說明:\n"
             "• /cr <名稱> - 創建資料夾\n"
             "• /cd <名稱> - 進入資料夾\n"
             "• /cd.. - 返回上級\n"
+            "• /scan - 核對目前資料夾的記錄\n"
             "• /ok - 確認位置並開始下載"
         )
 
-        await processing_msg.edit_text(info_text)
+        self.message_scheduler.edit(processing_msg, info_text, final=True, reply_markup=self._folder_keyboard(user_id))
+
+    def _folder_keyboard(self, user_id):
+        rows = self.folder_navigator.build_keyboard(user_id)
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton(text, callback_data=data) for text, data in row] for row in rows
+        ])
+
+    async def _confirm_folder_selection(self, reply_to, user_id):
+        """使用者確認資料夾後：取回待下載訊息並開始下載，完成後清除狀態"""
+        trace_id, selection_started = self.pending_traces.pop(user_id, (None, None))
+        if trace_id and selection_started:
+            tracing.record('folder_selection', selection_started, time.time() - selection_started, trace_id=trace_id)
+        refs = self.folder_navigator.get_pending_refs(user_id)
+        await self.downloader.async_db.delete_navigation_state(user_id)
+        state = self.folder_navigator.user_states.get(user_id)
+        if state and state.pending_refs:
+            self.last_folders[user_id] = state.current_path
+            await self.downloader.async_db.set_last_folder(user_id, state.current_path)
+        if refs and self.staging and self.staging.get(user_id):
+            await self._commit_staged_download(reply_to, user_id, refs, trace_id=trace_id)
+        elif refs:
+            pending = await self._rehydrate_messages(refs, trace_id=trace_id)
+            if pending:
+                await self._start_download_with_selected_folder(reply_to, user_id, pending, trace_id=trace_id)
+            else:
+                await reply_to.reply_text('❌ 待下載的訊息已無法取得')
+        self.folder_navigator.clear_user_state(user_id)
+
+    async def handle_folder_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """資料夾選擇 inline keyboard：在原訊息上直接更新內容"""
+        query = update.callback_query
+        user_id = query.from_user.id
+        toast, result = self.folder_navigator.handle_callback(user_id, query.data)
+        # callback 回覆上限 200 字元；確認時的完整路徑可能更長，改放在編輯後的訊息中
+        try:
+            await query.answer('✅ 已確認存放位置' if result == 'confirm' else (toast or None))
+        except Exception as e:
+            # 回覆失敗（例如按鈕太久以前的 query 已過期）不影響資料夾選擇本身
+            logger.warning(f'回覆按鈕查詢失敗: {e}')
+        message = query.message
+        if result == 'noop' or message is None:
+            return
+
+        if result == 'cancel':
+            self.pending_traces.pop(user_id, None)
+            if self.staging:
+                await self.staging.discard(user_id)
+            self.folder_navigator.clear_user_state(user_id)
+            await self.downloader.async_db.delete_navigation_state(user_id)
+            self.message_scheduler.edit(message, '✖ 已取消下載', final=True)
+        elif result == 'confirm':
+            self.message_scheduler.edit(message, toast, final=True)
+            await self._confirm_folder_selection(message, user_id)
+        else:
+            ui_text, _ = await self.folder_navigator.render(user_id)
+            self.message_scheduler.edit(message, ui_text, final=True, reply_markup=self._folder_keyboard(user_id))
+            await self._save_navigation_state(user_id)
 
     # ---------------------- message handling ----------------------
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -338,16 +590,23 @@ class TelegramMediaBot:
 
         # folder commands
         if msg.text and self.folder_navigator.is_folder_command(msg.text):
-            response, confirmed = self.folder_navigator.process_folder_command(user_id, msg.text)
-            await msg.reply_text(response)
+            response, confirmed = await self.folder_navigator.process_folder_command(user_id, msg.text)
             if confirmed:
-                pending = self.folder_navigator.get_pending_messages(user_id)
-                if pending:
-                    await self._start_download_with_selected_folder(update, context, pending)
-                self.folder_navigator.clear_user_state(user_id)
+                await msg.reply_text(response)
+                await self._confirm_folder_selection(msg, user_id)
+            else:
+                awaiting = self.folder_navigator.is_awaiting_folder_selection(user_id)
+                await msg.reply_text(response, reply_markup=self._folder_keyboard(user_id) if awaiting else None)
+                await self._save_navigation_state(user_id)
             return
 
         if self.folder_navigator.is_awaiting_folder_selection(user_id):
+            # 一般文字作為資料夾名稱篩選
+            if msg.text and not msg.text.startswith('/'):
+                ui_text = await self.folder_navigator.set_folder_filter(user_id, msg.text)
+                await msg.reply_text(ui_text, reply_markup=self._folder_keyboard(user_id))
+                await self._save_navigation_state(user_id)
+                return
             await msg.reply_text('請使用資料夾命令: /cr 創建資料夾, /cd 進入資料夾, /cd.. 返回上級, /ok 確認位置')
             return
 
@@ -360,7 +619,13 @@ class TelegramMediaBot:
                 '• /cr <名稱> - 創建資料夾\n'
                 '• /cd <名稱> - 進入資料夾\n'
                 '• /cd.. - 返回上級目錄\n'
-                '• /ok - 確認當前位置並開始下載'
+                '• /ok - 確認當前位置並開始下載\n\n'
+                '頻道備份:\n'
+                '• /archive <頻道> - 備份整個頻道的媒體（增量）\n'
+                '• /watch <頻道> - 即時下載頻道的新媒體\n'
+                '• /unwatch <頻道> - 取消即時下載\n\n'
+                '搜尋:\n'
+                '• /search <關鍵字> [頁數] - 搜尋已下載的文件'
             )
             return
         
@@ -405,31 +670,25 @@ class TelegramMediaBot:
                 original_message_id = primary.forward_origin.message_id
                 chat_name = primary.forward_origin.sender_chat.title or primary.forward_origin.sender_chat.username
             else:
-                await processing_msg.edit_text('❌ 暫不支援來自私人聊天或隱藏用戶的轉發訊息')
+                self.message_scheduler.edit(processing_msg, '❌ 暫不支援來自私人聊天或隱藏用戶的轉發訊息', final=True)
                 return
 
-            await processing_msg.edit_text(f'📡 正在獲取來自 {chat_name} 的媒體組訊息...')
-            original_message, replies = await self.get_message_and_replies(chat_id, original_message_id)
-            if not original_message:
-                await processing_msg.edit_text('❌ 無法獲取原訊息，請確認 Bot 權限或訊息是否存在')
+            self.message_scheduler.edit(processing_msg, f'📡 正在獲取來自 {chat_name} 的媒體組訊息...')
+            trace_id = tracing.new_trace_id()
+            messages_to_download = await self._resolve_messages_to_download(chat_id, original_message_id, collect_group=True, trace_id=trace_id)
+            if messages_to_download is None:
+                self.message_scheduler.edit(processing_msg, '❌ 無法獲取原訊息，請確認 Bot 權限或訊息是否存在', final=True)
                 return
 
-            # collect all messages to download: prefer collecting media group from origin
-            messages_to_download = await self._collect_media_from_original(chat_id, original_message)
-            # also include replies with media
-            for r in replies:
-                if getattr(r, 'media', None):
-                    messages_to_download.append(r)
-
             if not messages_to_download:
-                await processing_msg.edit_text('ℹ️ 該媒體組及相關回覆中沒有找到任何媒體文件')
+                self.message_scheduler.edit(processing_msg, 'ℹ️ 該媒體組及相關回覆中沒有找到任何媒體文件', final=True)
                 return
 
-            await self._prepare_folder_selection(primary.from_user.id, messages_to_download, processing_msg)
+            await self._prepare_folder_selection(primary.from_user.id, messages_to_download, processing_msg, trace_id=trace_id)
 
         except Exception as e:
             logger.error(f'處理媒體組錯誤: {e}')
-            await processing_msg.edit_text(f'❌ 處理媒體組時出錯: {e}')
+            self.message_scheduler.edit(processing_msg, f'❌ 處理媒體組時出錯: {e}', final=True)
 
     async def _handle_forwarded_single(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         message = update.message
@@ -446,88 +705,232 @@ class TelegramMediaBot:
                 original_message_id = message.forward_origin.message_id
                 chat_name = message.forward_origin.sender_chat.title or message.forward_origin.sender_chat.username
             else:
-                await processing_msg.edit_text('❌ 暫不支援來自私人聊天或隱藏用戶的轉發訊息')
+                self.message_scheduler.edit(processing_msg, '❌ 暫不支援來自私人聊天或隱藏用戶的轉發訊息', final=True)
                 return
 
-            await processing_msg.edit_text(f'📡 正在獲取來自 {chat_name} 的訊息...')
-            original_message, replies = await self.get_message_and_replies(chat_id, original_message_id)
-            if not original_message:
-                await processing_msg.edit_text('❌ 無法獲取原訊息，請確認 Bot 權限或訊息是否存在')
+            self.message_scheduler.edit(processing_msg, f'📡 正在獲取來自 {chat_name} 的訊息...')
+            trace_id = tracing.new_trace_id()
+            messages_to_download = await self._resolve_messages_to_download(chat_id, original_message_id, collect_group=False, trace_id=trace_id)
+            if messages_to_download is None:
+                self.message_scheduler.edit(processing_msg, '❌ 無法獲取原訊息，請確認 Bot 權限或訊息是否存在', final=True)
                 return
 
-            messages_to_download = []
-            if getattr(original_message, 'media', None):
-                messages_to_download.append(original_message)
-            for r in replies:
-                if getattr(r, 'media', None):
-                    messages_to_download.append(r)
-
             if not messages_to_download:
-                await processing_msg.edit_text('ℹ️ 該訊息及其回覆中沒有找到任何媒體文件')
+                self.message_scheduler.edit(processing_msg, 'ℹ️ 該訊息及其回覆中沒有找到任何媒體文件', final=True)
                 return
 
-            await self._prepare_folder_selection(message.from_user.id, messages_to_download, processing_msg)
+            await self._prepare_folder_selection(message.from_user.id, messages_to_download, processing_msg, trace_id=trace_id)
 
         except Exception as e:
             logger.error(f'處理訊息時出錯: {e}')
-            await processing_msg.edit_text(f'❌ 處理時出錯: {e}')
+            self.message_scheduler.edit(processing_msg, f'❌ 處理時出錯: {e}', final=True)
+
+    # ---------------------- channel archive ----------------------
+    async def handle_archive_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        msg = update.message
+        if not context.args:
+            await msg.reply_text(
+                '用法: /archive <頻道>\n'
+                '頻道可以是 @username、t.me 連結或數字 ID\n'
+                '會備份該頻道所有媒體，之後再執行只會下載新的內容'
+            )
+            return
+
+        try:
+            entity = await self.client.get_entity(ChannelArchiver.parse_chat_reference(context.args[0]))
+        except Exception as e:
+            logger.error(f'解析備份頻道失敗: {e}')
+            await msg.reply_text(f'❌ 無法備份該頻道: {e}')
+            return
+
+        # 以頻道 ID 判斷是否正在備份：@username、t.me 連結與數字 ID 可能指向同一個頻道
+        if entity.id in self.archive_tasks and not self.archive_tasks[entity.id].done():
+            await msg.reply_text('⏳ 該頻道正在備份中，請稍候')
+            return
+
+        processing_msg = await msg.reply_text(f'🗄️ 開始備份頻道 {context.args[0]}...')
+        # 在背景執行，避免長時間備份阻塞其他更新的處理
+        self.archive_tasks[entity.id] = context.application.create_task(
+            self._run_archive(entity, processing_msg, entity.id))
+
+    async def _run_archive(self, chat, processing_msg, task_key):
+        async def report(progress):
+            self.message_scheduler.edit(
+                processing_msg,
+                f"🗄️ 頻道備份中...\n"
+                f"已掃描: {progress['scanned']} 則訊息\n"
+                f"媒體: {progress['media']} 個, 已下載: {progress['downloaded']} 個\n"
+                f"檢查點: #{progress['last_message_id']}"
+            )
+
+        try:
+            result = await self.archive_chat(chat, progress_callback=report)
+        except Exception as e:
+            logger.error(f'頻道備份出錯: {e}')
+            self.message_scheduler.edit(processing_msg, f'❌ 頻道備份出錯: {e}', final=True)
+            return
+        finally:
+            self.archive_tasks.pop(task_key, None)
+
+        text = (
+            f"✅ 頻道備份{'完成' if result['failed'] == 0 else '暫停（部分文件失敗，下次會重試）'}\n"
+            f"已掃描: {result['scanned']} 則訊息\n"
+            f"媒體: {result['media']} 個, 新下載: {result['downloaded']} 個\n"
+        )
+        if result['failed'] > 0:
+            text += f"失敗: {result['failed']} 個\n"
+        text += f"檢查點: #{result['last_message_id']}\n儲存位置: {result['download_dir']}"
+        self.message_scheduler.edit(processing_msg, text, final=True)
+
+    async def archive_chat(self, chat, download_dir=None, progress_callback=None):
+        """增量備份整個頻道，供 /archive 與命令列共用"""
+        base_dir = download_dir or os.path.join(self.downloads_path, 'archive')
+        return await self.archiver.archive(chat, base_dir, progress_callback=progress_callback)
+
+    # ---------------------- live watch ----------------------
+    async def handle_watch_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        msg = update.message
+        if not context.args:
+            subs = await self.watcher.get_subscriptions()
+            if not subs:
+                await msg.reply_text('目前沒有即時監看的頻道\n用法: /watch <頻道>')
+                return
+            lines = [f"• {sub['title'] or sub['chat_id']} ({sub['chat_id']})" for sub in subs]
+            await msg.reply_text('👁️ 即時監看中的頻道:\n' + '\n'.join(lines))
+            return
+
+        try:
+            entity = await self.watcher.subscribe(ChannelArchiver.parse_chat_reference(context.args[0]))
+        except Exception as e:
+            logger.error(f'新增即時監看失敗: {e}')
+            await msg.reply_text(f'❌ 無法監看該頻道: {e}')
+            return
+
+        title = getattr(entity, 'title', None) or context.args[0]
+        await msg.reply_text(f'👁️ 已開始即時監看 {title}，新媒體會自動下載')
+
+    async def handle_unwatch_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        msg = update.message
+        if not context.args:
+            await msg.reply_text('用法: /unwatch <頻道>')
+            return
+
+        try:
+            removed = await self.watcher.unsubscribe(ChannelArchiver.parse_chat_reference(context.args[0]))
+        except Exception as e:
+            logger.error(f'取消即時監看失敗: {e}')
+            await msg.reply_text(f'❌ 無法取消監看: {e}')
+            return
+
+        await msg.reply_text('✅ 已取消即時監看' if removed else 'ℹ️ 該頻道不在監看清單中')
+
+    # ---------------------- search ----------------------
+    SEARCH_PAGE_SIZE = 10
+
+    async def handle_search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/search <關鍵字> [頁數]：全文搜尋已下載的檔名、來源與說明"""
+        msg = update.message
+        args = list(context.args or [])
+        page = 1
+        if len(args) > 1 and args[-1].isdigit():
+            page = max(int(args.pop()), 1)
+        query = ' '.join(args)
+        if not query:
+            await msg.reply_text('用法: /search <關鍵字> [頁數]\n搜尋檔名、原始檔名、來源頻道與訊息說明')
+            return
+
+        offset = (page - 1) * self.SEARCH_PAGE_SIZE
+        rows, total = await self.downloader.async_db.search_downloads(query, self.SEARCH_PAGE_SIZE, offset)
+        if total == 0:
+            await msg.reply_text(f'🔍 找不到符合「{query}」的文件')
+            return
+
+        pages = (total + self.SEARCH_PAGE_SIZE - 1) // self.SEARCH_PAGE_SIZE
+        if not rows:
+            await msg.reply_text(f'🔍 「{query}」只有 {pages} 頁結果')
+            return
+
+        lines = [f'🔍 「{query}」共 {total} 個結果（第 {page}/{pages} 頁）']
+        for i, row in enumerate(rows, start=offset + 1):
+            size = f"{(row['file_size'] or 0) / (1024**2):.1f}MB"
+            source = row.get('chat_title') or row['chat_id']
+            date = str(row['download_date'] or '')[:10]
+            lines.append(f"{i}. {row['file_name']}\n   {source} · {size} · {date}\n   {row['file_path']}")
+        if page < pages:
+            lines.append(f'\n下一頁: /search {query} {page + 1}')
+
+        text = '\n'.join(lines)
+        await msg.reply_text(text[:4096])
 
     # ---------------------- download flow ----------------------
-    async def _start_download_with_selected_folder(self, update: Update, context: ContextTypes.DEFAULT_TYPE, messages_to_download: list):
-        message = update.message
-        user_id = message.from_user.id
-        selected_folder = self.folder_navigator.get_selected_path(user_id)
-        processing_msg = await message.reply_text('🚀 開始下載到選定的資料夾...')
+    async def _start_download_with_selected_folder(self, reply_to, user_id, messages_to_download: list, trace_id=None,
+                                                   selected_folder=None):
+        selected_folder = selected_folder or self.folder_navigator.get_selected_path(user_id)
+        processing_msg = await reply_to.reply_text('🚀 開始下載到選定的資料夾...')
 
         try:
             os.makedirs(selected_folder, exist_ok=True)
+            self.folder_navigator.directory_index.invalidate(selected_folder)
             original_message_id = messages_to_download[0].id if messages_to_download else 0
             chat_name = 'Telegram'
-            await self._download_and_monitor(processing_msg, messages_to_download, selected_folder, original_message_id, chat_name)
+            with tracing.span('download_job', trace_id=trace_id, files=len(messages_to_download)):
+                await self._download_and_monitor(processing_msg, messages_to_download, selected_folder, original_message_id, chat_name)
         except Exception as e:
             logger.error(f'開始下載時出錯: {e}')
-            await processing_msg.edit_text(f'❌ 開始下載時出錯: {e}')
+            self.message_scheduler.edit(processing_msg, f'❌ 開始下載時出錯: {e}', final=True)
+
+    async def _commit_staged_download(self, reply_to, user_id, refs, trace_id=None):
+        """已先行下載的工作：移到選定的資料夾，再等待仍在下載的文件完成"""
+        selected_folder = self.folder_navigator.get_selected_path(user_id)
+        processing_msg = await reply_to.reply_text('🚀 移動已先行下載的文件到選定的資料夾...')
+
+        try:
+            job = await self.staging.commit(user_id, selected_folder)
+            self.folder_navigator.directory_index.invalidate(selected_folder)
+            with tracing.span('download_job', trace_id=trace_id, files=len(refs), staged=True):
+                self.progress_reporter.register(job.monitor, selected_folder, processing_msg)
+                try:
+                    await job.task
+                finally:
+                    self.progress_reporter.unregister(job.monitor)
+            await self._report_download_result(processing_msg, job.monitor, selected_folder, refs[0].message_id, 'Telegram')
+        except Exception as e:
+            logger.error(f'開始下載時出錯: {e}')
+            self.message_scheduler.edit(processing_msg, f'❌ 開始下載時出錯: {e}', final=True)
 
     async def _download_and_monitor(self, processing_msg, messages_to_download, download_dir, original_message_id, chat_name):
-        # init stats
-        self.monitor.update_stats({
-            'total_files': 0,
-            'completed_files': 0,
-            'failed_files': 0,
-            'total_size': 0,
-            'downloaded_size': 0,
-            'start_time': time.time()
-        })
-
-        self.monitor.start_monitoring_thread(download_dir, processing_msg)
+        # 每個工作使用獨立的監控器，由共用的 ProgressReporter 回報進度
+        monitor = DownloadMonitor(max_slots=self.downloader.max_concurrent_downloads)
+        monitor.reset()
+        self.progress_reporter.register(monitor, download_dir, processing_msg)
 
         try:
-            await processing_msg.edit_text('📊 正在分析媒體文件...')
+            self.message_scheduler.edit(processing_msg, '📊 正在分析媒體文件...')
             total_size = 0
             for m in messages_to_download:
                 if getattr(m, 'media', None):
                     total_size += self.downloader.get_media_size(m)
 
             total_size_mb = total_size / (1024**2)
-            await processing_msg.edit_text(f'🚀 開始下載 {len(messages_to_download)} 個媒體文件，總大小: {total_size_mb:.1f}MB...')
+            self.message_scheduler.edit(processing_msg, f'🚀 開始下載 {len(messages_to_download)} 個媒體文件，總大小: {total_size_mb:.1f}MB...')
 
-            # 設定訊息回調函數，讓下載器可以發送新訊息
+            # 訊息回調只用於這次下載，讓下載器可以通知發起的用戶
             async def send_message_to_user(text):
-                try:
-                    await processing_msg.reply_text(text)
-                except Exception as e:
-                    logger.warning(f"發送訊息失敗: {e}")
+                self.message_scheduler.notify(processing_msg, text)
             
-            self.downloader.set_message_callback(send_message_to_user)
-            all_files = await self.downloader.download_multiple_messages_concurrent(messages_to_download, download_dir)
+            all_files = await self.downloader.download_multiple_messages_concurrent(
+                messages_to_download, download_dir, monitor=monitor, message_callback=send_message_to_user)
 
         finally:
-            self.monitor.stop_monitoring()
+            self.progress_reporter.unregister(monitor)
+
+        await self._report_download_result(processing_msg, monitor, download_dir, original_message_id, chat_name)
 
-        stats = self.monitor.get_stats()
+    async def _report_download_result(self, processing_msg, monitor, download_dir, original_message_id, chat_name):
+        stats = monitor.get_stats()
         elapsed = time.time() - stats['start_time']
         avg_speed = (stats['downloaded_size'] / (1024**2)) / max(elapsed, 1)
-        disk = self.monitor.get_disk_usage(download_dir)
+        disk = await asyncio.to_thread(monitor.get_disk_usage, download_dir)
 
         result = (
             f"✅ 下載完成！\n原訊息 ID: {original_message_id}\n來源: {chat_name}\n"
@@ -544,15 +947,36 @@ class TelegramMediaBot:
 
         result += f"平均速度: {avg_speed:.1f}MB/s\n耗時: {elapsed:.1f}秒\n剩餘空間: {disk['free_gb']:.1f}GB\n儲存位置: {download_dir}"
 
-        await processing_msg.edit_text(result)
+        self.message_scheduler.edit(processing_msg, result, final=True)
         logger.info(f"下載完成 - 成功: {stats['completed_files']}, 失敗: {stats['failed_files']}, 大小: {stats['downloaded_size']/(1024**2):.1f}MB, 速度: {avg_speed:.1f}MB/s")
 
     # ---------------------- utilities ----------------------
     def get_download_statistics(self):
         return self.downloader.get_download_statistics()
 
-    def cleanup_missing_files(self):
-        return self.downloader.cleanup_missing_files()
+    def cleanup_missing_files(self, progress_callback=None):
+        return self.downloader.cleanup_missing_files(progress_callback)
+
+    async def _background_cleanup(self, batch_size=500):
+        """定期檢查一小批下載記錄，在線程中執行以免阻塞事件迴圈"""
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                # 下載根目錄不存在（例如網路磁碟未掛載）時不檢查，避免誤刪記錄
+                if not await asyncio.to_thread(os.path.isdir, self.downloads_path):
+                    logger.debug(f'下載資料夾 {self.downloads_path} 不存在，略過背景清理')
+                    continue
+                await self.downloader.async_db.cleanup_missing_files_step(batch_size)
+            except Exception as e:
+                logger.error(f'背景清理出錯: {e}')
+
+    def is_idle(self):
+        """沒有正在傳輸的文件、頻道備份或待處理的監看下載"""
+        return (
+            self.downloader.active_downloads == 0
+            and self.watcher.queue.empty()
+            and not any(not task.done() for task in self.archive_tasks.values())
+        )
 
     def get_recent_downloads(self, limit=10):
         return self.downloader.get_recent_downloads(limit)
@@ -560,24 +984,101 @@ class TelegramMediaBot:
     def update_downloads_path(self, new_path):
         """Update the downloads path and reinitialize folder navigator"""
         self.downloads_path = new_path
-        self.folder_navigator = FolderNavigator(base_path=new_path)
+        self.folder_navigator = self._create_folder_navigator(new_path)
+        if self.staging:
+            self.staging.set_base_path(new_path)
+        self.watcher.base_dir = os.path.join(new_path, 'archive')
         os.makedirs(new_path, exist_ok=True)
 
+    async def _start_updater(self):
+        """啟動更新來源：設定了 webhook_url 時使用 webhook，否則使用 long polling"""
+        if not self.webhook_url:
+            await self.app.updater.start_polling()
+            logger.info('使用 long polling 接收更新')
+            return
+
+        if not self.webhook_secret:
+            # Telegram 會在每個推送中帶上此 token，用於拒絕偽造的請求
+            self.webhook_secret = secrets.token_urlsafe(32)
+            logger.warning('未設定 WEBHOOK_SECRET，已產生臨時密鑰（重啟後會變更）')
+
+        await self.app.updater.start_webhook(
+            listen=self.webhook_listen,
+            port=self.webhook_port,
+            url_path=self.webhook_path,
+            webhook_url=self.webhook_url,
+            secret_token=self.webhook_secret,
+        )
+        logger.info(f'使用 webhook 接收更新: {self.webhook_listen}:{self.webhook_port}/{self.webhook_path}')
+
+    def _install_signal_handlers(self):
+        """SIGINT/SIGTERM 觸發正常關閉（僅主線程且非 Windows 時可用）"""
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self._stop_event.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Windows 或在 GUI 的背景線程中運行
+                return
+
+    def stop(self):
+        """請求停止 Bot，可從任何線程呼叫"""
+        if self._stop_event is not None:
+            self.loop.call_soon_threadsafe(self._stop_event.set)
+
     async def run(self):
+        self._stop_event = asyncio.Event()
+        metrics_server = None
+        lag_task = None
+        cleanup_task = None
         try:
+            if self.metrics_port:
+                metrics_server = metrics.start_http_server(self.metrics_port, self.metrics_listen)
+                lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+
             await self.start_client()
+            await self._restore_navigation_states()
+            if self.staging:
+                # 重新啟動前的先行下載已無法接續，刪除暫存文件與記錄；恢復的工作在 /ok 時重新下載
+                await self.staging.cleanup()
+            self.watcher.start()
+            if self.cleanup_interval:
+                cleanup_task = asyncio.create_task(self._background_cleanup())
+            self.maintenance.start()
             logger.info('正在啟動 Telegram Bot...')
             await self.app.initialize()
             await self.app.start()
+            self.message_scheduler.start()
+            self.progress_reporter.start()
+            await self._start_updater()
             logger.info('Bot 已啟動！可以開始轉發訊息了')
-            await self.app.updater.start_polling()
 
-            while True:
-                await asyncio.sleep(1)
+            self._install_signal_handlers()
+            await self._stop_event.wait()
+            logger.info('收到停止請求，正在關閉 Bot...')
 
         except Exception as e:
             logger.error(f'Bot 運行出錯: {e}')
         finally:
-            await self.app.stop()
+            if cleanup_task:
+                cleanup_task.cancel()
+            await self.maintenance.stop()
+            if self.staging:
+                await self.staging.stop()
+            if self.watcher.workers:
+                await self.watcher.stop()
+            if self.app.updater and self.app.updater.running:
+                await self.app.updater.stop()
+            await self.progress_reporter.stop()
+            await self.message_scheduler.stop()
+            if self.app.running:
+                await self.app.stop()
             await self.app.shutdown()
             await self.client.disconnect()
+            # 寫完佇列中剩餘的下載記錄
+            await asyncio.to_thread(self.downloader.async_db.close)
+            if lag_task:
+                lag_task.cancel()
+            if metrics_server:
+                # shutdown() 會等待 serve_forever 結束，放到線程執行以免阻塞事件迴圈
+                await asyncio.to_thread(metrics_server.shutdown)
+                metrics_server.server_close()
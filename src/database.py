@@ -1,13 +1,230 @@
 import sqlite3
 import os
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, Tuple, List
+from functools import partial
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple, List
+
+from .dedup_filter import DedupFilter
+from .metrics import timed_query
+from .tracing import traced
 
 logger = logging.getLogger(__name__)
 
+# 由觸發器維護的統計摘要表：(表名, 鍵欄位, 由 downloads 列計算鍵值的運算式)
+# 統計查詢只需讀取這些小表，成本與歷史記錄數量無關
+STATS_TABLES = [
+    ('stats_by_type', 'file_type', "COALESCE({row}.file_type, '')"),
+    ('stats_by_chat', 'chat_id', '{row}.chat_id'),
+    ('stats_by_day', 'day', "COALESCE(date({row}.download_date), '')"),
+]
+
+
+def _stats_add_sql(table, key, expr, row='NEW'):
+    return (
+        f"INSERT INTO {table} ({key}, files, total_size) "
+        f"VALUES ({expr.format(row=row)}, 1, COALESCE({row}.file_size, 0)) "
+        f"ON CONFLICT({key}) DO UPDATE SET files = files + 1, total_size = total_size + excluded.total_size;"
+    )
+
+
+def _stats_remove_sql(table, key, expr, row='OLD'):
+    value = expr.format(row=row)
+    return (
+        f"UPDATE {table} SET files = files - 1, total_size = total_size - COALESCE({row}.file_size, 0) "
+        f"WHERE ({key}) = ({value});"
+        f"DELETE FROM {table} WHERE ({key}) = ({value}) AND files <= 0;"
+    )
+
+
+def _stats_migration():
+    statements = []
+    for table, key, expr in STATS_TABLES:
+        statements.append(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"{key} {'INTEGER' if key == 'chat_id' else 'TEXT'} PRIMARY KEY, "
+            f"files INTEGER NOT NULL DEFAULT 0, total_size INTEGER NOT NULL DEFAULT 0)"
+        )
+        # 以現有資料回填
+        statements.append(f"DELETE FROM {table}")
+        statements.append(
+            f"INSERT INTO {table} ({key}, files, total_size) "
+            f"SELECT {expr.format(row='downloads')}, COUNT(*), COALESCE(SUM(file_size), 0) "
+            f"FROM downloads GROUP BY 1"
+        )
+
+    add = ' '.join(_stats_add_sql(*t) for t in STATS_TABLES)
+    remove = ' '.join(_stats_remove_sql(*t) for t in STATS_TABLES)
+    # INSERT OR REPLACE 刪除舊列時，需要 recursive_triggers 才會觸發 DELETE 觸發器
+    statements += [
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_stats_insert AFTER INSERT ON downloads BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_stats_delete AFTER DELETE ON downloads BEGIN {remove} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_stats_update "
+        f"AFTER UPDATE OF file_type, file_size, chat_id, download_date ON downloads BEGIN {remove} {add} END",
+    ]
+    return statements
+
+
+def _list_directory(directory: str, missing_dir_empty: bool = False) -> Optional[Set[str]]:
+    """
+    以 os.scandir 列出目錄中的檔名；無法判斷（權限、網路錯誤）回傳 None。
+    目錄不存在時預設也回傳 None（網路磁碟未掛載時不應視為文件全部被刪除），
+    只有手動清理指定 missing_dir_empty 時才回傳空集合。
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return {os.path.normcase(entry.name) for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return set() if missing_dir_empty else None
+    except OSError as e:
+        logger.warning(f"無法列出目錄 {directory}，略過其中的記錄: {e}")
+        return None
+
+
+def find_missing_paths(paths, executor: ThreadPoolExecutor, listings: Dict[str, Optional[Set[str]]] = None,
+                       missing_dir_empty: bool = False) -> Set[str]:
+    """
+    找出不存在的檔案路徑。每個目錄只列出一次（在線程池中並行），
+    而不是每個檔案各呼叫一次 os.path.exists；listings 可跨批次重用目錄列表。
+    missing_dir_empty 時不存在的目錄中所有文件都視為遺失。
+    """
+    listings = {} if listings is None else listings
+    by_directory: Dict[str, List[str]] = {}
+    for path in paths:
+        by_directory.setdefault(os.path.dirname(path), []).append(path)
+
+    pending = [d for d in by_directory if d not in listings]
+    list_directory = partial(_list_directory, missing_dir_empty=missing_dir_empty)
+    for directory, names in zip(pending, executor.map(list_directory, pending)):
+        listings[directory] = names
+
+    missing = set()
+    for directory, directory_paths in by_directory.items():
+        names = listings[directory]
+        if names is None:
+            continue  # 無法判斷時保留記錄
+        for path in directory_paths:
+            if os.path.normcase(os.path.basename(path)) not in names:
+                missing.add(path)
+    return missing
+
+
+def folder_key(file_path: str) -> str:
+    """downloads.folder_path 的值：文件所在資料夾的絕對路徑（Windows 不分大小寫）"""
+    return os.path.normcase(os.path.abspath(os.path.dirname(file_path)))
+
+
+# 下載根目錄下的暫存資料夾（. 開頭，資料夾瀏覽不會列出），每個先行下載工作一個子資料夾
+STAGING_DIR_NAME = '.staging'
+
+
+def is_staging_folder(folder_path: Optional[str]) -> bool:
+    """folder_path 是否為先行下載的暫存資料夾（尚未確認，可能被捨棄）"""
+    if not folder_path:
+        return False
+    return os.path.basename(os.path.dirname(folder_path)) == os.path.normcase(STAGING_DIR_NAME)
+
+
+# 資料夾導航顯示的媒體類型；影片以 document 記錄，依 MIME 類型區分
+MEDIA_CATEGORY_SQL = (
+    "CASE WHEN {row}.file_type = 'photo' THEN 'photo' "
+    "WHEN {row}.mime_type LIKE 'video/%' THEN 'video' ELSE 'document' END"
+)
+FOLDER_STATS = ('stats_by_folder', 'folder_path, media_type',
+                "COALESCE({row}.folder_path, ''), " + MEDIA_CATEGORY_SQL)
+
+
+def _folder_stats_migration():
+    """
+    每個資料夾各媒體類型的文件數，資料夾導航只需一次主鍵查詢。
+    folder_path 由 record_download 以 folder_key() 計算；既有記錄以同名 SQL 函數回填
+    （只在遷移時使用，觸發器不依賴自訂函數）
+    """
+    table, key, expr = FOLDER_STATS
+    add = _stats_add_sql(*FOLDER_STATS)
+    remove = _stats_remove_sql(*FOLDER_STATS)
+    return [
+        "ALTER TABLE downloads ADD COLUMN folder_path TEXT",
+        "UPDATE downloads SET folder_path = folder_key(file_path)",
+        "CREATE INDEX IF NOT EXISTS idx_downloads_folder ON downloads(folder_path)",
+        f"CREATE TABLE IF NOT EXISTS {table} (folder_path TEXT NOT NULL, media_type TEXT NOT NULL, "
+        f"files INTEGER NOT NULL DEFAULT 0, total_size INTEGER NOT NULL DEFAULT 0, PRIMARY KEY ({key}))",
+        f"DELETE FROM {table}",
+        f"INSERT INTO {table} ({key}, files, total_size) "
+        f"SELECT {expr.format(row='downloads')}, COUNT(*), COALESCE(SUM(file_size), 0) FROM downloads GROUP BY 1, 2",
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_folder_stats_insert AFTER INSERT ON downloads BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_folder_stats_delete AFTER DELETE ON downloads BEGIN {remove} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_folder_stats_update "
+        f"AFTER UPDATE OF folder_path, file_type, mime_type, file_size ON downloads BEGIN {remove} {add} END",
+    ]
+
+
+FTS_COLUMNS = ('file_name', 'original_file_name', 'chat_title', 'caption')
+# trigram 分詞（SQLite 3.34+）支援中文與子字串搜尋，但關鍵字至少需要 3 個字元
+FTS_TOKENIZER = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61 remove_diacritics 2'
+FTS_MIN_TERM = 3 if FTS_TOKENIZER == 'trigram' else 1
+
+
+def _fts_migration():
+    columns = ', '.join(FTS_COLUMNS)
+    new_values = ', '.join(f'new.{c}' for c in FTS_COLUMNS)
+    old_values = ', '.join(f'old.{c}' for c in FTS_COLUMNS)
+    delete_old = (f"INSERT INTO downloads_fts(downloads_fts, rowid, {columns}) "
+                  f"VALUES ('delete', old.id, {old_values});")
+    insert_new = f"INSERT INTO downloads_fts(rowid, {columns}) VALUES (new.id, {new_values});"
+    return [
+        "ALTER TABLE downloads ADD COLUMN chat_title TEXT",
+        "ALTER TABLE downloads ADD COLUMN caption TEXT",
+        # external content：索引本身不重複儲存文字
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS downloads_fts USING fts5({columns}, "
+        f"content='downloads', content_rowid='id', tokenize='{FTS_TOKENIZER}')",
+        "INSERT INTO downloads_fts(downloads_fts) VALUES ('rebuild')",
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_fts_insert AFTER INSERT ON downloads BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_fts_delete AFTER DELETE ON downloads BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_downloads_fts_update AFTER UPDATE OF {columns} ON downloads "
+        f"BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+# 版本化的結構遷移：(版本, SQL 列表)，依序套用並記錄在 PRAGMA user_version
+MIGRATIONS = [
+    (1, [
+        # get_recent_downloads: ORDER BY download_date DESC LIMIT ?
+        "CREATE INDEX IF NOT EXISTS idx_downloads_download_date ON downloads(download_date)",
+        # 依聊天室查詢；chat_id 單欄查詢由複合索引的最左欄位涵蓋
+        "CREATE INDEX IF NOT EXISTS idx_downloads_chat_message ON downloads(chat_id, message_id)",
+        # 依類型統計：涵蓋索引讓 GROUP BY file_type 只需掃描索引而不讀取整列
+        "CREATE INDEX IF NOT EXISTS idx_downloads_file_type ON downloads(file_type, file_size, chat_id)",
+        "CREATE INDEX IF NOT EXISTS idx_performance_completed_at ON download_performance(completed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_performance_chat ON download_performance(chat_id)",
+    ]),
+    (2, _stats_migration()),
+    (3, _fts_migration()),
+    (4, _folder_stats_migration()),
+    (5, [
+        # 等待選擇資料夾的工作（精簡的媒體參照），重新啟動後可繼續
+        "CREATE TABLE IF NOT EXISTS navigation_states ("
+        "user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)",
+    ]),
+    (6, [
+        # 每個用戶上次以 /ok 確認的資料夾（相對路徑），供路由規則未符合時使用
+        "CREATE TABLE IF NOT EXISTS user_preferences ("
+        "user_id INTEGER PRIMARY KEY, last_folder TEXT, updated_at REAL NOT NULL)",
+    ]),
+]
+
+
 class DatabaseManager:
-    """SQLite 單例資料庫管理類"""
+    """
+    SQLite 單例資料庫管理類
+
+    使用 WAL 模式：單一寫入連線（以鎖序列化，事件迴圈與其他線程共用），
+    每個線程另有自己的唯讀連線。讀取不會阻塞寫入，也不共用 cursor 狀態。
+    """
 
     _instance = None
     _connection = None
@@ -21,15 +238,56 @@ class DatabaseManager:
             else:
                 cls._instance.db_path = db_path
 
-            # 建立單一連線
-            cls._instance._connection = sqlite3.connect(cls._instance.db_path, check_same_thread=False)
+            # 寫入連線：所有寫入都經由 _writer() 取得鎖後使用
+            cls._instance._connection = sqlite3.connect(cls._instance.db_path, check_same_thread=False, timeout=30)
             cls._instance._connection.row_factory = sqlite3.Row
+            cls._instance._write_lock = threading.RLock()
+            # 每個線程的唯讀連線
+            cls._instance._local = threading.local()
+            cls._instance._reader_uri = 'file:' + os.path.abspath(cls._instance.db_path).replace('?', '%3f').replace('#', '%23') + '?mode=ro'
+            cls._instance._readers = []
+            cls._instance._readers_lock = threading.Lock()
+            # 背景增量清理的進度（downloads.id）
+            cls._instance._cleanup_cursor = 0
+            # 已下載 file_unique_id 的記憶體過濾器，未命中時不需查詢資料庫
+            cls._instance._dedup = None
             cls._instance._init_database()
         return cls._instance
 
+    def _reader(self) -> sqlite3.Connection:
+        """取得目前線程的唯讀連線（第一次使用時建立）"""
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            # autocommit：每次查詢都看到最新已提交的資料
+            conn = sqlite3.connect(self._reader_uri, uri=True, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA query_only = ON")
+            self._local.connection = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def _writer(self):
+        """序列化的寫入交易：成功時 commit，例外時 rollback"""
+        with self._write_lock:
+            try:
+                yield self._connection
+                self._connection.commit()
+            except Exception:
+                self._connection.rollback()
+                raise
+
     def _init_database(self):
         """初始化資料庫"""
         try:
+            # WAL：讀取與寫入可同時進行；NORMAL 在 WAL 下仍保證資料庫一致
+            # 必須在建立第一個資料表前設定才會生效；既有資料庫由 enable_incremental_vacuum 轉換
+            self._connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+            # 讓 INSERT OR REPLACE 的隱含刪除觸發 DELETE 觸發器（統計摘要表）
+            self._connection.execute("PRAGMA recursive_triggers = ON")
             self._connection.execute("""
                CREATE TABLE IF NOT EXISTS downloads (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -55,16 +313,98 @@ class DatabaseManager:
                         UNIQUE(file_unique_id)
                     )
                 """)
+            # 整個頻道備份的檢查點：每個頻道已處理到的最高訊息 ID
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS archive_cursors (
+                        chat_id INTEGER PRIMARY KEY,            -- 頻道 ID
+                        last_message_id INTEGER NOT NULL,       -- 已完成備份的最高訊息 ID
+                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            # 即時監看的頻道訂閱清單
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS watch_subscriptions (
+                        chat_id INTEGER PRIMARY KEY,            -- 頻道 ID (Telethon marked ID)
+                        title TEXT,                             -- 頻道名稱
+                        folder_name TEXT NOT NULL,              -- 下載資料夾名稱
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            # 每次完成下載的效能記錄，用於調整併發數與容量規劃
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS download_performance (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        file_unique_id TEXT NOT NULL,           -- 對應 downloads.file_unique_id
+                        chat_id INTEGER NOT NULL,               -- 聊天室 ID
+                        message_id INTEGER NOT NULL,            -- 訊息 ID
+                        file_type TEXT,                         -- photo/video/document
+                        file_size INTEGER,                      -- 檔案大小 (bytes)
+                        dc_id INTEGER,                          -- 檔案所在的 Telegram 資料中心
+                        queue_wait REAL,                        -- 等待併發名額 (秒)
+                        duration REAL,                          -- 取得名額到完成，含重試與限流等待 (秒)
+                        transfer_time REAL,                     -- 成功那次傳輸的耗時 (秒)
+                        retries INTEGER DEFAULT 0,              -- 重試次數
+                        flood_wait REAL DEFAULT 0,              -- FloodWait 等待 (秒)
+                        bytes_per_sec REAL,                     -- file_size / transfer_time
+                        completed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
             self._connection.commit()
+            # 遷移回填 folder_path 時使用
+            self._connection.create_function('folder_key', 1, folder_key, deterministic=True)
+            self._migrate()
+            self._load_dedup_filter()
             logger.info("資料庫初始化完成")
         except Exception as e:
             logger.error(f"資料庫初始化失敗: {e}")
             raise
 
+    def _migrate(self):
+        """套用尚未執行的遷移，每個版本在單一交易中完成"""
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        for target, statements in MIGRATIONS:
+            if target <= version:
+                continue
+            with self._writer() as conn:
+                # DDL 不會自動開始交易，明確 BEGIN 讓整個版本可回滾
+                conn.execute("BEGIN")
+                for sql in statements:
+                    conn.execute(sql)
+                # PRAGMA 不支援參數綁定；target 來自上方常數
+                conn.execute(f"PRAGMA user_version = {int(target)}")
+            logger.info(f"資料庫結構已升級到版本 {target}")
+            version = target
+
+    def get_schema_version(self) -> int:
+        return self._reader().execute("PRAGMA user_version").fetchone()[0]
+
+    def _load_dedup_filter(self):
+        """
+        以 file_unique_id 唯一索引（覆蓋索引，不讀資料表）建立去重過濾器。
+        只在啟動時呼叫；之後的新記錄由 record_download 加入。
+        """
+        try:
+            started = time.perf_counter()
+            cursor = self._reader().execute("SELECT file_unique_id FROM downloads")
+            self._dedup = DedupFilter(row[0] for row in cursor)
+            logger.info(f"已載入 {len(self._dedup)} 筆下載記錄到去重過濾器，耗時 {time.perf_counter() - started:.2f} 秒")
+        except Exception as e:
+            # 沒有過濾器時每次都查詢資料庫
+            self._dedup = None
+            logger.error(f"載入去重過濾器時出錯: {e}")
+
+    def might_be_downloaded(self, file_unique_id: str) -> bool:
+        """不查詢資料庫的快速檢查：False 表示一定沒有下載記錄，True 需再查資料庫確認"""
+        dedup = self._dedup
+        return dedup is None or dedup.might_contain(str(file_unique_id))
+
+    @timed_query('is_file_downloaded')
     def is_file_downloaded(self, file_unique_id: str) -> bool:
         """檢查文件是否已經下載過"""
+        if not self.might_be_downloaded(file_unique_id):
+            return False
         try:
-            cursor = self._connection.execute(
+            cursor = self._reader().execute(
                 "SELECT 1 FROM downloads WHERE file_unique_id = ? LIMIT 1",
                 (file_unique_id,)
             )
@@ -73,10 +413,13 @@ class DatabaseManager:
             logger.error(f"檢查文件是否下載過時出錯: {e}")
             return False
 
+    @timed_query('get_downloaded_file_info')
     def get_downloaded_file_info(self, file_unique_id: str) -> Optional[dict]:
         """獲取已下載文件的詳細信息"""
+        if not self.might_be_downloaded(file_unique_id):
+            return None
         try:
-            cursor = self._connection.execute(
+            cursor = self._reader().execute(
                 "SELECT * FROM downloads WHERE file_unique_id = ? LIMIT 1",
                 (file_unique_id,)
             )
@@ -86,54 +429,68 @@ class DatabaseManager:
             logger.error(f"獲取文件信息時出錯: {e}")
             return None
 
+    @timed_query('get_downloaded_files_info')
+    def get_downloaded_files_info(self, file_unique_ids: List[str], chunk_size: int = 500) -> Dict[str, dict]:
+        """批次查詢多個文件的下載記錄，回傳 {file_unique_id: 記錄}"""
+        result = {}
+        try:
+            ids = [str(fid) for fid in file_unique_ids if self.might_be_downloaded(fid)]
+            if not ids:
+                return result
+            conn = self._reader()
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(
+                    f"SELECT * FROM downloads WHERE file_unique_id IN ({placeholders})", chunk
+                )
+                for row in cursor.fetchall():
+                    result[row["file_unique_id"]] = dict(row)
+        except Exception as e:
+            logger.error(f"批次獲取文件信息時出錯: {e}")
+        return result
+
+    @timed_query('record_download')
+    @traced('record_download')
     def record_download(self, file_unique_id: str, file_id: str, message_id: int,
                        chat_id: int, file_name: str, file_path: str,
                        original_file_name: str = None, file_size: int = None,
                        file_type: str = None, mime_type: str = None,
-                       message_date: datetime = None) -> bool:
+                       message_date: datetime = None, chat_title: str = None,
+                       caption: str = None) -> bool:
         try:
-            self._connection.execute("""
-                INSERT OR REPLACE INTO downloads 
-                (file_unique_id, file_id, message_id, chat_id, file_name, 
-                 original_file_name, file_path, file_size, file_type, 
-                 mime_type, message_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (file_unique_id, file_id, message_id, chat_id, file_name,
-                  original_file_name, file_path, file_size, file_type,
-                  mime_type, message_date))
-            self._connection.commit()
+            with self._writer() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO downloads 
+                    (file_unique_id, file_id, message_id, chat_id, file_name, 
+                     original_file_name, file_path, file_size, file_type, 
+                     mime_type, message_date, chat_title, caption, folder_path)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (file_unique_id, file_id, message_id, chat_id, file_name,
+                      original_file_name, file_path, file_size, file_type,
+                      mime_type, message_date, chat_title, caption, folder_key(file_path)))
+                if self._dedup is not None:
+                    self._dedup.add(file_unique_id)
             logger.debug(f"記錄文件下載: {file_name}")
             return True
         except Exception as e:
             logger.error(f"記錄下載信息時出錯: {e}")
             return False
 
+    @timed_query('get_download_statistics')
     def get_download_statistics(self) -> dict:
-        """獲取下載統計信息"""
-        try:
-            cursor = self._connection.execute("""
-                SELECT 
-                    COUNT(*) as total_files,
-                    SUM(file_size) as total_size,
-                    COUNT(DISTINCT chat_id) as unique_chats,
-                    file_type,
-                    COUNT(*) as count_by_type
-                FROM downloads
-                GROUP BY file_type
-            """)
-
+        """獲取下載統計信息（讀取觸發器維護的摘要表）"""
+        try:
+            conn = self._reader()
             stats_by_type = {}
             total_files = 0
             total_size = 0
-            unique_chats = 0
-
-            for row in cursor.fetchall():
+            for row in conn.execute("SELECT file_type, files, total_size FROM stats_by_type"):
                 if row["file_type"]:
-                    stats_by_type[row["file_type"]] = row["count_by_type"]
-                if not total_files:
-                    total_files = row["total_files"]
-                    total_size = row["total_size"] or 0
-                    unique_chats = row["unique_chats"]
+                    stats_by_type[row["file_type"]] = row["files"]
+                total_files += row["files"]
+                total_size += row["total_size"]
+            unique_chats = conn.execute("SELECT COUNT(*) FROM stats_by_chat").fetchone()[0]
 
             return {
                 'total_files': total_files,
@@ -146,32 +503,186 @@ class DatabaseManager:
             logger.error(f"獲取統計信息時出錯: {e}")
             return {'total_files': 0, 'total_size_bytes': 0, 'total_size_mb': 0, 'unique_chats': 0, 'files_by_type': {}}
 
-    def cleanup_missing_files(self) -> Tuple[int, int]:
-        """清理資料庫中指向不存在文件的記錄"""
+    @timed_query('get_folder_media_counts')
+    def get_folder_media_counts(self, folder: str) -> Dict[str, int]:
+        """資料夾內已下載的影片、照片、檔案數（讀取觸發器維護的 stats_by_folder，不掃描檔案系統）"""
+        counts = {'video': 0, 'photo': 0, 'document': 0}
+        try:
+            cursor = self._reader().execute(
+                "SELECT media_type, files FROM stats_by_folder WHERE folder_path = ?",
+                (os.path.normcase(os.path.abspath(folder)),)
+            )
+            for row in cursor:
+                counts[row["media_type"]] = row["files"]
+        except Exception as e:
+            logger.error(f"獲取資料夾媒體數量時出錯: {e}")
+        return counts
+
+    @timed_query('reconcile_folder')
+    def reconcile_folder(self, folder: str, max_workers: int = 4) -> int:
+        """掃描資料夾一次，刪除文件已不存在的記錄，回傳刪除數"""
         try:
-            cursor = self._connection.execute("SELECT id, file_path FROM downloads")
-            records = cursor.fetchall()
+            rows = self._reader().execute(
+                "SELECT id, file_path FROM downloads WHERE folder_path = ?",
+                (os.path.normcase(os.path.abspath(folder)),)
+            ).fetchall()
+            if not rows:
+                return 0
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                removed = self._remove_missing_rows(rows, executor)
+            if removed:
+                logger.info(f"資料夾 {folder}: 刪除了 {removed} 個不存在文件的記錄")
+            return removed
+        except Exception as e:
+            logger.error(f"核對資料夾記錄時出錯: {e}")
+            return 0
+
+    def get_folder_files(self, folder: str) -> List[Tuple[int, str]]:
+        """資料夾中所有下載記錄的 (id, file_path)"""
+        try:
+            rows = self._reader().execute(
+                "SELECT id, file_path FROM downloads WHERE folder_path = ?",
+                (os.path.normcase(os.path.abspath(folder)),)
+            ).fetchall()
+            return [(row["id"], row["file_path"]) for row in rows]
+        except Exception as e:
+            logger.error(f"獲取資料夾記錄時出錯: {e}")
+            return []
+
+    def update_download_paths(self, moves: List[Tuple[int, str]]) -> bool:
+        """文件被移動後更新記錄的路徑 [(id, 新路徑)]，資料夾統計由觸發器同步"""
+        try:
+            with self._writer() as conn:
+                conn.executemany(
+                    "UPDATE downloads SET file_path = ?, folder_path = ? WHERE id = ?",
+                    [(path, folder_key(path), download_id) for download_id, path in moves]
+                )
+            return True
+        except Exception as e:
+            logger.error(f"更新文件路徑時出錯: {e}")
+            return False
+
+    def delete_folder_downloads(self, folder: str) -> int:
+        """刪除資料夾中所有下載記錄（用於捨棄暫存下載），回傳刪除數"""
+        try:
+            with self._writer() as conn:
+                cursor = conn.execute(
+                    "DELETE FROM downloads WHERE folder_path = ?",
+                    (os.path.normcase(os.path.abspath(folder)),)
+                )
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"刪除資料夾記錄時出錯: {e}")
+            return 0
 
+    @timed_query('get_statistics_by_chat')
+    def get_statistics_by_chat(self, limit: int = 20) -> List[dict]:
+        """各聊天室的檔案數與總大小（依總大小排序）"""
+        try:
+            cursor = self._reader().execute(
+                "SELECT chat_id, files, total_size FROM stats_by_chat ORDER BY total_size DESC LIMIT ?",
+                (limit,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"獲取各聊天室統計時出錯: {e}")
+            return []
+
+    @timed_query('get_statistics_by_day')
+    def get_statistics_by_day(self, days: int = 30) -> List[dict]:
+        """最近 days 天每天的檔案數與總大小 (UTC 日期)"""
+        try:
+            cursor = self._reader().execute(
+                "SELECT day, files, total_size FROM stats_by_day WHERE day >= date('now', ?) ORDER BY day",
+                (f'-{int(days)} days',)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"獲取每日統計時出錯: {e}")
+            return []
+
+    @timed_query('cleanup_missing_files')
+    def cleanup_missing_files(self, progress_callback: Callable[[int, int, int], None] = None,
+                              batch_size: int = 5000, max_workers: int = 8) -> Tuple[int, int]:
+        """
+        清理資料庫中指向不存在文件的記錄
+        以 id 分批讀取，每個目錄 scandir 一次；progress_callback(已檢查, 總數, 已刪除)
+        """
+        try:
+            total_count = self._reader().execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+            checked = 0
             missing_count = 0
-            total_count = len(records)
+            last_id = 0
+            listings = {}
 
-            for record in records:
-                if not os.path.exists(record["file_path"]):
-                    self._connection.execute("DELETE FROM downloads WHERE id = ?", (record["id"],))
-                    missing_count += 1
-                    logger.debug(f"刪除不存在文件的記錄: {record['file_path']}")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                while True:
+                    rows = self._fetch_paths_after(last_id, batch_size)
+                    if not rows:
+                        break
+                    last_id = rows[-1]["id"]
+                    missing_count += self._remove_missing_rows(rows, executor, listings, missing_dir_empty=True)
+                    checked += len(rows)
+                    if progress_callback:
+                        progress_callback(checked, total_count, missing_count)
 
-            self._connection.commit()
             logger.info(f"清理完成: 刪除了 {missing_count} 個不存在文件的記錄")
             return missing_count, total_count
         except Exception as e:
             logger.error(f"清理資料庫時出錯: {e}")
             return 0, 0
 
+    def cleanup_missing_files_step(self, batch_size: int = 500, max_workers: int = 4) -> Tuple[int, int]:
+        """
+        增量清理：從上次停下的 id 繼續檢查 batch_size 筆記錄，到表尾後從頭開始。
+        供背景任務定期呼叫，回傳 (已檢查, 已刪除)
+        """
+        try:
+            rows = self._fetch_paths_after(self._cleanup_cursor, batch_size)
+            if not rows:
+                self._cleanup_cursor = 0
+                return 0, 0
+            self._cleanup_cursor = rows[-1]["id"]
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                removed = self._remove_missing_rows(rows, executor)
+            if removed:
+                logger.info(f"背景清理: 刪除了 {removed} 個不存在文件的記錄")
+            return len(rows), removed
+        except Exception as e:
+            logger.error(f"背景清理資料庫時出錯: {e}")
+            return 0, 0
+
+    def _fetch_paths_after(self, last_id: int, limit: int) -> List[sqlite3.Row]:
+        return self._reader().execute(
+            "SELECT id, file_path FROM downloads WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, limit)
+        ).fetchall()
+
+    def _remove_missing_rows(self, rows, executor, listings=None, chunk_size: int = 500,
+                             missing_dir_empty: bool = False) -> int:
+        """刪除檔案已不存在的記錄，每 chunk_size 筆一個交易，避免長時間持有寫入鎖"""
+        missing = find_missing_paths([row["file_path"] for row in rows], executor, listings, missing_dir_empty)
+        if not missing:
+            return 0
+        # 目錄列表可能是之前批次留下的，列出後才下載的文件不在其中；刪除前逐一再確認
+        candidates = list(missing)
+        missing = {path for path, exists in zip(candidates, executor.map(os.path.exists, candidates)) if not exists}
+        if not missing:
+            return 0
+
+        missing_ids = [(row["id"],) for row in rows if row["file_path"] in missing]
+        for start in range(0, len(missing_ids), chunk_size):
+            with self._writer() as conn:
+                conn.executemany("DELETE FROM downloads WHERE id = ?", missing_ids[start:start + chunk_size])
+        logger.debug(f"刪除 {len(missing_ids)} 個不存在文件的記錄")
+        return len(missing_ids)
+
+    @timed_query('get_recent_downloads')
     def get_recent_downloads(self, limit: int = 10) -> List[dict]:
         """獲取最近下載的文件列表"""
         try:
-            cursor = self._connection.execute("""
+            cursor = self._reader().execute("""
                 SELECT * FROM downloads 
                 ORDER BY download_date DESC 
                 LIMIT ?
@@ -181,8 +692,438 @@ class DatabaseManager:
             logger.error(f"獲取最近下載列表時出錯: {e}")
             return []
 
+    def iter_downloads(self, since: str = None, before: str = None, chat_id: int = None,
+                       file_type: str = None, batch_size: int = 1000) -> Iterator[dict]:
+        """
+        依 id 順序逐筆產生下載記錄，以 fetchmany 分批讀取，記憶體用量與記錄數無關。
+        since / before 比對 download_date（'YYYY-MM-DD' 或 'YYYY-MM-DD HH:MM:SS'，UTC），before 不含。
+        整個匯出在同一個讀取交易中，看到的是開始時的快照；唯讀連線不阻塞寫入。
+        """
+        conditions = []
+        params = []
+        if since:
+            conditions.append("download_date >= ?")
+            params.append(since)
+        if before:
+            conditions.append("download_date < ?")
+            params.append(before)
+        if chat_id is not None:
+            conditions.append("chat_id = ?")
+            params.append(chat_id)
+        if file_type:
+            conditions.append("file_type = ?")
+            params.append(file_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        # 獨立連線：匯出期間目前線程的其他查詢不受影響，結束後立即關閉
+        conn = sqlite3.connect(self._reader_uri, uri=True, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute(f"SELECT * FROM downloads {where} ORDER BY id", params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+
+    @timed_query('search_downloads')
+    def search_downloads(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[dict], int]:
+        """
+        全文搜尋檔名、原始檔名、來源聊天室與訊息說明，回傳 (該頁結果, 符合總數)。
+        以空白分隔的多個關鍵字需全部符合；結果依相關度排序。
+        """
+        try:
+            terms = [t for t in query.split() if t]
+            if not terms:
+                return [], 0
+
+            # 每個關鍵字以 FTS 字串引用，避免被解讀為運算子
+            long_terms = [t for t in terms if len(t) >= FTS_MIN_TERM]
+            short_terms = [t for t in terms if len(t) < FTS_MIN_TERM]
+
+            where = []
+            params = []
+            if long_terms:
+                where.append("downloads_fts MATCH ?")
+                params.append(' '.join('"' + t.replace('"', '""') + '"' for t in long_terms))
+            for term in short_terms:
+                # 太短的關鍵字無法使用 trigram 索引，改以 LIKE 過濾
+                pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                where.append("(" + " OR ".join(f"d.{c} LIKE ? ESCAPE '\\'" for c in FTS_COLUMNS) + ")")
+                params.extend([pattern] * len(FTS_COLUMNS))
+
+            join = "FROM downloads_fts JOIN downloads d ON d.id = downloads_fts.rowid" if long_terms else "FROM downloads d"
+            where_sql = " AND ".join(where)
+            order = "bm25(downloads_fts), d.download_date DESC" if long_terms else "d.download_date DESC"
+
+            conn = self._reader()
+            total = conn.execute(f"SELECT COUNT(*) {join} WHERE {where_sql}", params).fetchone()[0]
+            cursor = conn.execute(
+                f"SELECT d.* {join} WHERE {where_sql} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            )
+            return [dict(row) for row in cursor.fetchall()], total
+        except Exception as e:
+            logger.error(f"搜尋下載記錄時出錯: {e}")
+            return [], 0
+
+    @timed_query('get_archive_cursor')
+    def get_archive_cursor(self, chat_id: int) -> int:
+        """獲取頻道備份檢查點，未備份過則回傳 0"""
+        try:
+            cursor = self._reader().execute(
+                "SELECT last_message_id FROM archive_cursors WHERE chat_id = ?",
+                (chat_id,)
+            )
+            row = cursor.fetchone()
+            return row["last_message_id"] if row else 0
+        except Exception as e:
+            logger.error(f"獲取備份檢查點時出錯: {e}")
+            return 0
+
+    @timed_query('update_archive_cursor')
+    def update_archive_cursor(self, chat_id: int, last_message_id: int) -> bool:
+        """更新頻道備份檢查點（只會往前推進）"""
+        try:
+            with self._writer() as conn:
+                conn.execute("""
+                    INSERT INTO archive_cursors (chat_id, last_message_id, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        last_message_id = MAX(last_message_id, excluded.last_message_id),
+                        updated_at = CURRENT_TIMESTAMP
+                """, (chat_id, last_message_id))
+            return True
+        except Exception as e:
+            logger.error(f"更新備份檢查點時出錯: {e}")
+            return False
+
+    @timed_query('add_watch_subscription')
+    def add_watch_subscription(self, chat_id: int, title: str, folder_name: str) -> bool:
+        """新增或更新即時監看訂閱"""
+        try:
+            with self._writer() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO watch_subscriptions (chat_id, title, folder_name)
+                    VALUES (?, ?, ?)
+                """, (chat_id, title, folder_name))
+            return True
+        except Exception as e:
+            logger.error(f"新增監看訂閱時出錯: {e}")
+            return False
+
+    @timed_query('remove_watch_subscription')
+    def remove_watch_subscription(self, chat_id: int) -> bool:
+        """移除即時監看訂閱，回傳是否有刪除"""
+        try:
+            with self._writer() as conn:
+                cursor = conn.execute(
+                    "DELETE FROM watch_subscriptions WHERE chat_id = ?", (chat_id,)
+                )
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"移除監看訂閱時出錯: {e}")
+            return False
+
+    @timed_query('get_watch_subscriptions')
+    def get_watch_subscriptions(self) -> List[dict]:
+        """獲取所有即時監看訂閱"""
+        try:
+            cursor = self._reader().execute(
+                "SELECT * FROM watch_subscriptions ORDER BY created_at"
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"獲取監看訂閱時出錯: {e}")
+            return []
+
+    @timed_query('record_download_performance')
+    def record_download_performance(self, file_unique_id: str, chat_id: int, message_id: int,
+                                    file_type: str = None, file_size: int = None, dc_id: int = None,
+                                    queue_wait: float = None, duration: float = None,
+                                    transfer_time: float = None, retries: int = 0,
+                                    flood_wait: float = 0) -> bool:
+        """記錄一次完成下載的耗時與重試資料"""
+        try:
+            bytes_per_sec = file_size / transfer_time if file_size and transfer_time else None
+            with self._writer() as conn:
+                conn.execute("""
+                    INSERT INTO download_performance
+                    (file_unique_id, chat_id, message_id, file_type, file_size, dc_id,
+                     queue_wait, duration, transfer_time, retries, flood_wait, bytes_per_sec)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (file_unique_id, chat_id, message_id, file_type, file_size, dc_id,
+                      queue_wait, duration, transfer_time, retries, flood_wait, bytes_per_sec))
+            return True
+        except Exception as e:
+            logger.error(f"記錄下載效能時出錯: {e}")
+            return False
+
+    # 聚合欄位：吞吐量以總位元組 / 總傳輸時間計算（依檔案大小加權）
+    _PERFORMANCE_COLUMNS = """
+        COUNT(*) AS files,
+        COALESCE(SUM(file_size), 0) AS total_bytes,
+        SUM(file_size) / NULLIF(SUM(transfer_time), 0) AS bytes_per_sec,
+        AVG(transfer_time) AS avg_transfer_time,
+        AVG(queue_wait) AS avg_queue_wait,
+        AVG(retries) AS avg_retries,
+        COALESCE(SUM(flood_wait), 0) AS total_flood_wait
+    """
+
+    _SIZE_CLASS = """
+        CASE
+            WHEN file_size < 1048576 THEN '< 1MB'
+            WHEN file_size < 10485760 THEN '1-10MB'
+            WHEN file_size < 104857600 THEN '10-100MB'
+            WHEN file_size < 1073741824 THEN '100MB-1GB'
+            ELSE '>= 1GB'
+        END
+    """
+
+    def _query_performance(self, group_expr: str, where: str = '', params: tuple = (),
+                           order_by: str = 'grp', limit: int = None) -> List[dict]:
+        sql = f"SELECT {group_expr} AS grp, {self._PERFORMANCE_COLUMNS} FROM download_performance"
+        if where:
+            sql += f" WHERE {where}"
+        sql += f" GROUP BY grp ORDER BY {order_by}"
+        if limit:
+            sql += " LIMIT ?"
+            params = params + (limit,)
+        cursor = self._reader().execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    @timed_query('get_throughput_by_hour')
+    def get_throughput_by_hour(self, days: int = 30) -> List[dict]:
+        """最近 days 天依一天中的小時 (本地時間 00-23) 聚合的吞吐量"""
+        try:
+            return self._query_performance(
+                "strftime('%H', completed_at, 'localtime')",
+                "completed_at >= datetime('now', ?)", (f'-{int(days)} days',))
+        except Exception as e:
+            logger.error(f"獲取每小時吞吐量時出錯: {e}")
+            return []
+
+    @timed_query('get_throughput_by_chat')
+    def get_throughput_by_chat(self, limit: int = 20) -> List[dict]:
+        """依來源聊天室聚合的吞吐量（依總位元組排序）"""
+        try:
+            return self._query_performance('chat_id', order_by='total_bytes DESC', limit=limit)
+        except Exception as e:
+            logger.error(f"獲取各聊天室吞吐量時出錯: {e}")
+            return []
+
+    @timed_query('get_throughput_by_size_class')
+    def get_throughput_by_size_class(self) -> List[dict]:
+        """依檔案大小級距聚合的吞吐量"""
+        try:
+            return self._query_performance(self._SIZE_CLASS, order_by='MIN(file_size)')
+        except Exception as e:
+            logger.error(f"獲取各大小級距吞吐量時出錯: {e}")
+            return []
+
+    @timed_query('get_throughput_by_dc')
+    def get_throughput_by_dc(self) -> List[dict]:
+        """依 Telegram 資料中心聚合的吞吐量"""
+        try:
+            return self._query_performance('dc_id')
+        except Exception as e:
+            logger.error(f"獲取各資料中心吞吐量時出錯: {e}")
+            return []
+
+    def save_navigation_state(self, user_id: int, state: str, updated_at: float) -> bool:
+        """保存用戶的資料夾選擇狀態（NavigationState.to_json）"""
+        try:
+            with self._writer() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO navigation_states (user_id, state, updated_at) VALUES (?, ?, ?)",
+                    (user_id, state, updated_at)
+                )
+            return True
+        except Exception as e:
+            logger.error(f"保存導航狀態時出錯: {e}")
+            return False
+
+    def delete_navigation_state(self, user_id: int) -> bool:
+        try:
+            with self._writer() as conn:
+                conn.execute("DELETE FROM navigation_states WHERE user_id = ?", (user_id,))
+            return True
+        except Exception as e:
+            logger.error(f"刪除導航狀態時出錯: {e}")
+            return False
+
+    def load_navigation_states(self, max_age: float = None) -> List[Tuple[int, str, float]]:
+        """讀取保存的導航狀態 (user_id, state, updated_at)；先刪除超過 max_age 秒的記錄"""
+        try:
+            if max_age:
+                with self._writer() as conn:
+                    conn.execute("DELETE FROM navigation_states WHERE updated_at < ?", (time.time() - max_age,))
+            cursor = self._reader().execute("SELECT user_id, state, updated_at FROM navigation_states")
+            return [(row["user_id"], row["state"], row["updated_at"]) for row in cursor]
+        except Exception as e:
+            logger.error(f"讀取導航狀態時出錯: {e}")
+            return []
+
+    def set_last_folder(self, user_id: int, folder: str) -> bool:
+        """記錄用戶上次確認的資料夾（相對於下載根目錄）"""
+        try:
+            with self._writer() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO user_preferences (user_id, last_folder, updated_at) VALUES (?, ?, ?)",
+                    (user_id, folder, time.time())
+                )
+            return True
+        except Exception as e:
+            logger.error(f"保存上次使用的資料夾時出錯: {e}")
+            return False
+
+    def get_last_folders(self) -> Dict[int, str]:
+        """所有用戶上次確認的資料夾 {user_id: 相對路徑}"""
+        try:
+            cursor = self._reader().execute(
+                "SELECT user_id, last_folder FROM user_preferences WHERE last_folder IS NOT NULL")
+            return {row["user_id"]: row["last_folder"] for row in cursor}
+        except Exception as e:
+            logger.error(f"讀取上次使用的資料夾時出錯: {e}")
+            return {}
+
+    # ---------------------- maintenance ----------------------
+    def get_maintenance_status(self) -> dict:
+        """資料庫檔案狀態：頁數、空閒頁、頁大小與 auto_vacuum 模式（0 關閉、1 完整、2 增量）"""
+        conn = self._reader()
+        return {
+            'page_count': conn.execute("PRAGMA page_count").fetchone()[0],
+            'freelist_count': conn.execute("PRAGMA freelist_count").fetchone()[0],
+            'page_size': conn.execute("PRAGMA page_size").fetchone()[0],
+            'auto_vacuum': conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        }
+
+    @timed_query('optimize')
+    def optimize(self) -> bool:
+        """PRAGMA optimize：只重新分析統計資料已過時的資料表"""
+        try:
+            with self._writer() as conn:
+                conn.execute("PRAGMA optimize")
+            return True
+        except Exception as e:
+            logger.error(f"最佳化資料庫時出錯: {e}")
+            return False
+
+    @timed_query('analyze')
+    def analyze(self, analysis_limit: int = 1000) -> bool:
+        """重新收集查詢規劃統計；analysis_limit 限制每個索引的取樣列數，大型資料庫也只需很短的寫入鎖"""
+        try:
+            with self._writer() as conn:
+                conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+                conn.execute("ANALYZE")
+            logger.info("資料庫統計資料已更新")
+            return True
+        except Exception as e:
+            logger.error(f"分析資料庫時出錯: {e}")
+            return False
+
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        將既有資料庫轉為 auto_vacuum = INCREMENTAL。需要完整 VACUUM 一次，
+        期間持有寫入鎖（讀取不受影響），只在第一次維護時執行。
+        """
+        try:
+            with self._write_lock:
+                mode = self._connection.execute("PRAGMA auto_vacuum").fetchone()[0]
+                if mode == 2:
+                    return True
+                started = time.perf_counter()
+                self._connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                self._connection.execute("VACUUM")
+            logger.info(f"資料庫已轉換為增量清理模式，耗時 {time.perf_counter() - started:.1f} 秒")
+            return True
+        except Exception as e:
+            logger.error(f"轉換資料庫清理模式時出錯: {e}")
+            return False
+
+    @timed_query('incremental_vacuum')
+    def incremental_vacuum(self, max_pages: int = 10000, chunk_pages: int = 500) -> int:
+        """歸還空閒頁給檔案系統，每 chunk_pages 頁一個交易，回傳釋放的頁數"""
+        freed = 0
+        try:
+            while freed < max_pages:
+                before = self._reader().execute("PRAGMA freelist_count").fetchone()[0]
+                if before == 0:
+                    break
+                step = min(chunk_pages, max_pages - freed)
+                with self._writer() as conn:
+                    # 每頁回傳一列，必須讀完才會全部執行
+                    conn.execute(f"PRAGMA incremental_vacuum({int(step)})").fetchall()
+                after = self._reader().execute("PRAGMA freelist_count").fetchone()[0]
+                if after >= before:
+                    break
+                freed += before - after
+            if freed:
+                logger.info(f"增量清理釋放了 {freed} 個空閒頁")
+        except Exception as e:
+            logger.error(f"增量清理資料庫時出錯: {e}")
+        return freed
+
+    @timed_query('wal_checkpoint')
+    def checkpoint(self, mode: str = 'PASSIVE') -> Optional[Tuple[int, int, int]]:
+        """
+        WAL checkpoint，回傳 (busy, WAL 頁數, 已寫回頁數)。
+        TRUNCATE 會等待讀取結束並截斷 WAL 檔；PASSIVE 不等待任何連線
+        """
+        mode = mode.upper()
+        if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError(f"不支援的 checkpoint 模式: {mode}")
+        try:
+            with self._write_lock:
+                return tuple(self._connection.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+        except Exception as e:
+            logger.error(f"WAL checkpoint 時出錯: {e}")
+            return None
+
+    @timed_query('backup')
+    def backup(self, dest_path: str) -> bool:
+        """
+        以 sqlite3 backup API 線上備份。來源是獨立的唯讀連線，一次複製所有頁：
+        在 WAL 模式下只持有讀取快照，寫入可同時進行，備份內容一致。
+        先寫入暫存檔，完成後才改名。
+        """
+        tmp_path = f"{dest_path}.part"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            source = sqlite3.connect(self._reader_uri, uri=True, timeout=30)
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            os.replace(tmp_path, dest_path)
+            logger.info(f"資料庫已備份到 {dest_path}")
+            return True
+        except Exception as e:
+            logger.error(f"備份資料庫時出錯: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
     def close(self):
+        with self._readers_lock:
+            for conn in self._readers:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._readers = []
+        self._local = threading.local()
         if self._connection:
-            self._connection.close()
-            self._connection = None
+            with self._write_lock:
+                self._connection.close()
+                self._connection = None
             logger.info("資料庫連線已關閉")
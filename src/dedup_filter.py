@@ -0,0 +1,47 @@
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class DedupFilter:
+    """
+    已下載 file_unique_id 的記憶體過濾器。
+    以排序好的 64 位元雜湊陣列保存（每筆 8 bytes，100 萬筆約 8 MB），
+    啟動時的雜湊與排序都在 C 中完成；之後新增的記錄放在小的 set 中，累積過多時併入陣列。
+
+    might_contain() 回傳 False 時一定沒有下載記錄，可直接略過資料庫查詢；
+    回傳 True 時才需要查資料庫確認（雜湊碰撞或記錄已被清理）。
+    使用 Python 內建 hash()：每次啟動的值不同，但過濾器本來就在啟動時重建。
+    """
+
+    def __init__(self, file_unique_ids: Iterable[str] = (), merge_threshold: int = 50_000):
+        self._sorted = array('q', sorted(map(hash, map(str, file_unique_ids))))
+        self._recent = set()
+        self._lock = threading.Lock()
+        self.merge_threshold = merge_threshold
+
+    def add(self, item: str):
+        with self._lock:
+            self._recent.add(hash(str(item)))
+            if len(self._recent) >= self.merge_threshold:
+                merged = array('q', sorted(self._sorted.tolist() + list(self._recent)))
+                # 先替換陣列再清空 set，讀取端不會看到兩邊都沒有的狀態
+                self._sorted = merged
+                self._recent = set()
+
+    def might_contain(self, item: str) -> bool:
+        h = hash(str(item))
+        if h in self._recent:
+            return True
+        values = self._sorted
+        i = bisect_left(values, h)
+        return i < len(values) and values[i] == h
+
+    __contains__ = might_contain
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
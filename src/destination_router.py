@@ -0,0 +1,213 @@
+import json
+import logging
+import re
+import string
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .archiver import INVALID_FOLDER_CHARS
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_FIELDS = ('chat', 'chat_id', 'type', 'yyyy', 'mm', 'dd')
+MEDIA_TYPES = ('video', 'photo', 'document')
+
+_SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+_SIZE_PATTERN = re.compile(r'^\s*([\d.]+)\s*([KMG]?B?)\s*$', re.IGNORECASE)
+
+
+def media_type_of(message) -> Optional[str]:
+    """訊息的媒體類型：video / photo / document，沒有媒體時回傳 None"""
+    if getattr(message, 'video', None):
+        return 'video'
+    if getattr(message, 'photo', None):
+        return 'photo'
+    if getattr(message, 'document', None):
+        return 'document'
+    return None
+
+
+def parse_size(value) -> Optional[int]:
+    """將 1048576、"500KB"、"1.5GB" 轉為 bytes"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = _SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"無效的大小: {value}")
+    number, unit = match.groups()
+    unit = unit.upper()
+    if unit and not unit.endswith('B'):
+        unit += 'B'
+    return int(float(number) * _SIZE_UNITS[unit])
+
+
+def parse_date(value) -> Optional[datetime]:
+    """將 "2024-01-01" 或 ISO 時間轉為 UTC datetime（未帶時區時視為 UTC）"""
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(str(value))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _safe_segment(value: str) -> str:
+    for char in INVALID_FOLDER_CHARS:
+        value = value.replace(char, '_')
+    return value.strip()
+
+
+@dataclass
+class RoutingRule:
+    """單一路由規則：所有設定的條件都符合時，工作存放到 path 樣板展開後的資料夾"""
+    path: str
+    chats: Tuple = ()
+    media_types: Tuple[str, ...] = ()
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    since: Optional[datetime] = None
+    before: Optional[datetime] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RoutingRule":
+        path = data.get('path')
+        if not path or not isinstance(path, str):
+            raise ValueError("缺少 path")
+        for _, field_name, _, _ in string.Formatter().parse(path):
+            if field_name is not None and field_name not in TEMPLATE_FIELDS:
+                raise ValueError(f"未知的樣板欄位 {{{field_name}}}（可用: {', '.join(TEMPLATE_FIELDS)}）")
+
+        chats = data.get('chat', ())
+        chats = tuple(chats) if isinstance(chats, list) else ((chats,) if chats not in (None, ()) else ())
+        media_types = data.get('type', ())
+        media_types = tuple(media_types) if isinstance(media_types, list) else ((media_types,) if media_types else ())
+        for media_type in media_types:
+            if media_type not in MEDIA_TYPES:
+                raise ValueError(f"未知的媒體類型: {media_type}")
+
+        return cls(
+            path=path,
+            chats=tuple(c.lower() if isinstance(c, str) else int(c) for c in chats),
+            media_types=media_types,
+            min_size=parse_size(data.get('min_size')),
+            max_size=parse_size(data.get('max_size')),
+            since=parse_date(data.get('since')),
+            before=parse_date(data.get('before')),
+        )
+
+    def matches_chat(self, message) -> bool:
+        if not self.chats:
+            return True
+        chat = getattr(message, 'chat', None)
+        peer = getattr(message, 'peer_id', None)
+        ids = {getattr(message, 'chat_id', None), getattr(peer, 'channel_id', None)}
+        username = (getattr(chat, 'username', None) or '').lower()
+        title = (getattr(chat, 'title', None) or '').lower()
+        for wanted in self.chats:
+            if isinstance(wanted, int):
+                if wanted in ids:
+                    return True
+            elif wanted.startswith('@'):
+                if username and wanted[1:] == username:
+                    return True
+            elif title and wanted == title:
+                return True
+        return False
+
+    def matches(self, message, size: int) -> bool:
+        if self.media_types and media_type_of(message) not in self.media_types:
+            return False
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        date = getattr(message, 'date', None)
+        if (self.since or self.before) and date is None:
+            return False
+        if self.since and date < self.since:
+            return False
+        if self.before and date >= self.before:
+            return False
+        return self.matches_chat(message)
+
+
+class DestinationRouter:
+    """
+    依宣告式規則自動決定下載資料夾，符合規則的工作不需互動選擇資料夾。
+    規則檔為 JSON：
+        {
+          "fallback": "last_used",
+          "rules": [
+            {"chat": "@news", "type": "video", "min_size": "100MB", "path": "{chat}/{yyyy}/{mm}"},
+            {"chat": [-1001234567890], "since": "2024-01-01", "path": "archive/{chat_id}"}
+          ]
+        }
+    - 規則由上而下比對，工作中的每個媒體都符合時才採用；樣板以第一個媒體展開
+    - 沒有規則符合且 fallback 為 "last_used" 時，使用該用戶上次以 /ok 確認的資料夾
+    回傳相對於下載根目錄、以 / 分隔的路徑，與 NavigationState.current_path 相同格式。
+    """
+
+    def __init__(self, rules: Sequence[RoutingRule] = (), fallback_last_used: bool = False):
+        self.rules = list(rules)
+        self.fallback_last_used = fallback_last_used
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rules) or self.fallback_last_used
+
+    @classmethod
+    def from_file(cls, path: Optional[str]) -> "DestinationRouter":
+        """讀取規則檔；檔案不存在或格式錯誤時回傳不啟用的路由器，個別錯誤的規則會被略過"""
+        if not path:
+            return cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"讀取路由規則檔 {path} 時出錯: {e}")
+            return cls()
+
+        if isinstance(data, list):
+            data = {'rules': data}
+        rules = []
+        for index, item in enumerate(data.get('rules', []), 1):
+            try:
+                rules.append(RoutingRule.from_dict(item))
+            except Exception as e:
+                logger.error(f"略過第 {index} 條路由規則: {e}")
+        router = cls(rules, fallback_last_used=data.get('fallback') == 'last_used')
+        logger.info(f"已載入 {len(rules)} 條路由規則" + ("，未符合時使用上次的資料夾" if router.fallback_last_used else ""))
+        return router
+
+    def route(self, messages: List, sizes: List[int], last_used: Optional[str] = None) -> Optional[str]:
+        """回傳工作的目標資料夾（相對路徑，根目錄為空字串）；需要互動選擇時回傳 None"""
+        if not messages:
+            return None
+        for rule in self.rules:
+            if all(rule.matches(m, size) for m, size in zip(messages, sizes)):
+                return self.render(rule.path, messages[0])
+        if self.fallback_last_used and last_used is not None:
+            return last_used
+        return None
+
+    @staticmethod
+    def render(template: str, message) -> str:
+        """展開樣板；代入的值會替換掉路徑字元，並移除 . 與 .. 片段，結果不會離開下載根目錄"""
+        chat = getattr(message, 'chat', None)
+        chat_id = getattr(message, 'chat_id', None) or 0
+        date = getattr(message, 'date', None) or datetime.now(timezone.utc)
+        chat_name = getattr(chat, 'title', None) or getattr(chat, 'username', None) or str(chat_id)
+        values: Dict[str, str] = {
+            'chat': _safe_segment(chat_name) or str(chat_id),
+            'chat_id': str(chat_id),
+            'type': media_type_of(message) or 'document',
+            'yyyy': f"{date.year:04d}",
+            'mm': f"{date.month:02d}",
+            'dd': f"{date.day:02d}",
+        }
+        expanded = template.format(**values)
+        segments = [_safe_segment(s) for s in re.split(r'[\\/]', expanded)]
+        return '/'.join(s for s in segments if s and s not in ('.', '..'))
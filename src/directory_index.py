@@ -0,0 +1,97 @@
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 副檔名 -> 媒體類型，分類只需一次 dict 查詢
+MEDIA_EXTENSIONS: Dict[str, str] = {
+    **dict.fromkeys(('.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm'), 'video'),
+    **dict.fromkeys(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'), 'photo'),
+    **dict.fromkeys(('.pdf', '.doc', '.docx', '.txt', '.zip', '.rar', '.7z'), 'document'),
+}
+
+
+def classify_file(name: str) -> Optional[str]:
+    """依副檔名回傳 video / photo / document，其他檔案回傳 None"""
+    return MEDIA_EXTENSIONS.get(os.path.splitext(name)[1].lower())
+
+
+@dataclass(frozen=True)
+class DirectoryListing:
+    """單一資料夾的子資料夾（已排序）與媒體文件數量"""
+    folders: Tuple[str, ...] = ()
+    media_counts: Dict[str, int] = field(default_factory=lambda: {'video': 0, 'photo': 0, 'document': 0})
+    mtime_ns: int = 0
+
+
+class DirectoryIndex:
+    """
+    以 os.scandir 建立的資料夾索引，快取每個資料夾的子資料夾與媒體數量。
+    - scandir 的 DirEntry 在多數平台不需額外 stat 就能判斷檔案或資料夾
+    - 資料夾 mtime 改變（新增、刪除、改名）時重新掃描
+    - 網路磁碟的 mtime 精度可能只有秒級，bot 自己寫入文件或建立資料夾時呼叫 invalidate
+    - . 開頭的隱藏資料夾（例如預先下載的 .staging）不列出
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, DirectoryListing]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> DirectoryListing:
+        """取得資料夾內容；資料夾不存在或無法讀取時回傳空內容"""
+        key = os.path.abspath(path)
+        try:
+            mtime_ns = os.stat(key).st_mtime_ns
+        except OSError:
+            self._entries.pop(key, None)
+            return DirectoryListing()
+
+        cached = self._entries.get(key)
+        if cached is not None and cached.mtime_ns == mtime_ns:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        listing = self._scan(key, mtime_ns)
+        self._entries[key] = listing
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return listing
+
+    def invalidate(self, path: str):
+        """移除資料夾及其上層資料夾的快取（新增子資料夾會改變上層的列表）"""
+        key = os.path.abspath(path)
+        self._entries.pop(key, None)
+        self._entries.pop(os.path.dirname(key), None)
+
+    def clear(self):
+        self._entries.clear()
+
+    @staticmethod
+    def _scan(path: str, mtime_ns: int) -> DirectoryListing:
+        folders = []
+        counts = {'video': 0, 'photo': 0, 'document': 0}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if not entry.name.startswith('.'):
+                                folders.append(entry.name)
+                        elif entry.is_file():
+                            media_type = classify_file(entry.name)
+                            if media_type:
+                                counts[media_type] += 1
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"讀取資料夾列表失敗: {e}")
+        folders.sort()
+        return DirectoryListing(tuple(folders), counts, mtime_ns)
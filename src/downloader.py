@@ -1,12 +1,19 @@
 import asyncio
 import os
 import logging
+import shutil
 import time
 import json
 from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
-from telethon.errors import FloodWaitError, RPCError
+from telethon.errors import FloodWaitError, RPCError, FileReferenceExpiredError
 from telethon import TelegramClient
 from .database import DatabaseManager
+from .async_database import AsyncDatabase
+from . import tracing
+from .metrics import (
+    ACTIVE_DOWNLOADS, DOWNLOAD_BYTES, DOWNLOAD_DURATION, DOWNLOAD_FILES,
+    DOWNLOAD_RETRIES, FLOOD_WAIT_SECONDS, QUEUE_DEPTH
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,18 +25,53 @@ class MediaDownloader:
         self.client = client
         self.max_concurrent_downloads = max_concurrent_downloads
         self.download_semaphore = asyncio.Semaphore(max_concurrent_downloads)
+        # 正在傳輸的文件數（資料庫維護等背景工作只在為 0 時進行）
+        self.active_downloads = 0
         self.monitor = None
         self.db = DatabaseManager(db_path)
-        self.message_callback = None
+        # 事件迴圈中的資料庫存取都經由 async_db，在專用線程中執行
+        self.async_db = AsyncDatabase(self.db)
+        self.file_reference_callback = None
+        self.file_written_callback = None
+        # 暫存資料夾 -> 目標資料夾：之後在暫存資料夾完成的文件直接移到目標資料夾
+        self.directory_redirects = {}
     
     def set_monitor(self, monitor):
         """設定監控器"""
         self.monitor = monitor
     
-    def set_message_callback(self, callback):
-        """設定訊息回調函數，用於發送訊息給用戶"""
-        self.message_callback = callback
+    def set_file_reference_callback(self, callback):
+        """設定 file reference 過期時的回調函數，用於讓快取失效"""
+        self.file_reference_callback = callback
+
+    def set_file_written_callback(self, callback):
+        """設定文件寫入下載資料夾後的回調函數 callback(download_dir)，用於讓資料夾索引失效"""
+        self.file_written_callback = callback
     
+    def redirect_directory(self, source_dir, target_dir):
+        """之後在 source_dir 下載完成的文件改為移動到 target_dir 並以新路徑記錄"""
+        self.directory_redirects[os.path.abspath(source_dir)] = target_dir
+
+    def clear_redirect(self, source_dir):
+        self.directory_redirects.pop(os.path.abspath(source_dir), None)
+
+    def _apply_redirect(self, file_path, download_dir):
+        """下載資料夾已被重新導向時移動剛完成的文件，回傳實際的 (file_path, download_dir)"""
+        target_dir = self.directory_redirects.get(os.path.abspath(download_dir))
+        if target_dir is None:
+            return file_path, download_dir
+        target_path = os.path.join(target_dir, os.path.basename(file_path))
+        try:
+            try:
+                os.replace(file_path, target_path)
+            except OSError:
+                # 跨磁碟時無法 rename，改為複製後刪除
+                shutil.move(file_path, target_path)
+        except OSError as e:
+            logger.error(f"移動文件到 {target_dir} 時出錯: {e}")
+            return file_path, download_dir
+        return target_path, target_dir
+
     def get_media_size(self, message):
         """獲取媒體文件大小"""
         try:
@@ -52,89 +94,149 @@ class MediaDownloader:
         
         return 0
 
-    async def download_media_with_retry(self, message, file_path, max_retries=3):
-        """下載媒體文件，包含重試機制和進度追蹤"""
-        async with self.download_semaphore:  # 控制併發數量
-            for attempt in range(max_retries):
-                try:
-                    # 初始化進度統計
-                    if self.monitor:
-                        stats = self.monitor.get_stats()
-                        stats['start_time'] = time.time()
-                        stats['_last_progress'] = 0  # 用於追蹤進度差
-                        self.monitor.update_stats(stats)
-                        
-                    # 使用進度回調來追蹤下載進度
-                    def progress_callback(current, total):
-                        if self.monitor:
-                            stats = self.monitor.get_stats()
-                            # 更新已下載大小（粗略估算）
-                            downloaded = current - stats.get('_last_progress', 0)
-                            stats['downloaded_size'] += max(downloaded, 0)
-                            stats['_last_progress'] = current
-                            self.monitor.update_stats(stats)
-                    
-                    await self.client.download_media(
-                        message, 
-                        file_path,
-                        progress_callback=progress_callback
-                    )
-                    
-                    # 更新統計
-                    if os.path.exists(file_path) and self.monitor:
-                        file_size = os.path.getsize(file_path)
-                        stats = self.monitor.get_stats()
-                        stats['completed_files'] += 1
-                        self.monitor.update_stats(stats)
-                    
-                    return True
-                    
-                except (ConnectionError, OSError, asyncio.TimeoutError, RPCError) as e:
-                    if attempt == max_retries - 1:
-                        logger.error(f"下載失敗，已嘗試 {max_retries} 次: {e}")
-                        if self.monitor:
-                            stats = self.monitor.get_stats()
-                            stats['failed_files'] += 1
-                            self.monitor.update_stats(stats)
+    async def download_media_with_retry(self, message, file_path, max_retries=3, monitor=None):
+        """
+        下載媒體文件，包含重試機制和進度追蹤
+        成功時回傳效能記錄 dict（queue_wait、duration、transfer_time、retries、flood_wait、dc_id），失敗回傳 False
+        """
+        file_type = self._get_media_type(message)
+        chat = self._get_chat_id(message)
+
+        # 控制併發數量
+        QUEUE_DEPTH.inc(queue='download')
+        queued = time.monotonic()
+        try:
+            with tracing.span('download_wait'):
+                await self.download_semaphore.acquire()
+        finally:
+            QUEUE_DEPTH.dec(queue='download')
+
+        ACTIVE_DOWNLOADS.inc()
+        self.active_downloads += 1
+        started = time.monotonic()
+        retries = 0
+        flood_wait = 0
+        monitor = monitor or self.monitor
+        slot = monitor.acquire_slot(self.get_media_size(message)) if monitor else None
+        try:
+            with tracing.span('download', message_id=message.id, file_type=file_type, result='failed') as span:
+                for attempt in range(max_retries):
+                    span['attempts'] = attempt + 1
+                    attempt_started = time.monotonic()
+                    try:
+                        # 使用綁定 slot 的進度回調來追蹤下載進度
+                        progress_callback = monitor.make_progress_callback(slot) if monitor else None
+
+                        await self.client.download_media(
+                            message,
+                            file_path,
+                            progress_callback=progress_callback
+                        )
+
+                        # 更新統計
+                        if os.path.exists(file_path):
+                            if monitor:
+                                monitor.add_completed()
+                            span['bytes'] = os.path.getsize(file_path)
+                            DOWNLOAD_BYTES.inc(span['bytes'], file_type=file_type, chat=chat)
+                        DOWNLOAD_FILES.inc(file_type=file_type, chat=chat, status='completed')
+                        finished = time.monotonic()
+                        DOWNLOAD_DURATION.observe(finished - started, file_type=file_type)
+
+                        span['result'] = 'completed'
+                        return {
+                            'queue_wait': started - queued,
+                            'duration': finished - started,
+                            'transfer_time': finished - attempt_started,
+                            'retries': retries,
+                            'flood_wait': flood_wait,
+                            'dc_id': self._get_dc_id(message),
+                        }
+
+                    except FileReferenceExpiredError:
+                        # 快取或長時間等待的訊息 file reference 已失效，重新取得訊息後重試
+                        logger.warning(f"文件引用已過期，重新獲取訊息 {message.id} (嘗試 {attempt + 1}/{max_retries})")
+                        if self.file_reference_callback:
+                            self.file_reference_callback(message)
+                        if monitor:
+                            monitor.reset_slot(slot)
+                        if attempt == max_retries - 1:
+                            logger.error(f"下載失敗，文件引用持續過期: {message.id}")
+                            self._count_failure(monitor, file_type, chat)
+                            return False
+                        DOWNLOAD_RETRIES.inc(reason='file_reference')
+                        retries += 1
+                        try:
+                            fresh = await self.client.get_messages(message.peer_id, ids=message.id)
+                            if fresh and fresh.media:
+                                message = fresh
+                        except Exception as e:
+                            logger.warning(f"重新獲取訊息失敗: {e}")
+
+                    except FloodWaitError as e:
+                        # FloodWaitError 是 RPCError 的子類，必須先於一般重試分支處理
+                        if monitor:
+                            monitor.reset_slot(slot)
+                        logger.warning(f"觸發限流，等待 {e.seconds} 秒")
+                        DOWNLOAD_RETRIES.inc(reason='flood_wait')
+                        FLOOD_WAIT_SECONDS.inc(e.seconds)
+                        retries += 1
+                        flood_wait += e.seconds
+                        await asyncio.sleep(e.seconds)
+
+                    except (ConnectionError, OSError, asyncio.TimeoutError, RPCError) as e:
+                        if monitor:
+                            monitor.reset_slot(slot)
+                        if attempt == max_retries - 1:
+                            logger.error(f"下載失敗，已嘗試 {max_retries} 次: {e}")
+                            self._count_failure(monitor, file_type, chat)
+                            return False
+
+                        wait_time = (2 ** attempt) + 1  # 指數退避：2, 3, 5 秒
+                        logger.warning(f"下載失敗 (嘗試 {attempt + 1}/{max_retries})，{wait_time} 秒後重試: {e}")
+                        DOWNLOAD_RETRIES.inc(reason='error')
+                        retries += 1
+                        await asyncio.sleep(wait_time)
+
+                    except Exception as e:
+                        logger.error(f"下載時發生未知錯誤: {e}")
+                        if monitor:
+                            monitor.reset_slot(slot)
+                        self._count_failure(monitor, file_type, chat)
                         return False
-                    
-                    wait_time = (2 ** attempt) + 1  # 指數退避：2, 3, 5 秒
-                    logger.warning(f"下載失敗 (嘗試 {attempt + 1}/{max_retries})，{wait_time} 秒後重試: {e}")
-                    await asyncio.sleep(wait_time)
-                    
-                except FloodWaitError as e:
-                    logger.warning(f"觸發限流，等待 {e.seconds} 秒")
-                    await asyncio.sleep(e.seconds)
-                    
-                except Exception as e:
-                    logger.error(f"下載時發生未知錯誤: {e}")
-                    if self.monitor:
-                        stats = self.monitor.get_stats()
-                        stats['failed_files'] += 1
-                        self.monitor.update_stats(stats)
-                    return False
-        
-        return False
 
-    async def download_media_from_message(self, message, download_dir):
+                self._count_failure(monitor, file_type, chat)
+                return False
+        finally:
+            if monitor:
+                monitor.release_slot(slot)
+            ACTIVE_DOWNLOADS.dec()
+            self.active_downloads -= 1
+            self.download_semaphore.release()
+
+    def _count_failure(self, monitor, file_type, chat):
+        if monitor:
+            monitor.add_failed()
+        DOWNLOAD_FILES.inc(file_type=file_type, chat=chat, status='failed')
+
+    async def download_media_from_message(self, message, download_dir, monitor=None):
         """從訊息中下載媒體文件"""
         if not message.media:
             return []
+        monitor = monitor or self.monitor
         
         # 檢查是否已經下載過這個文件
         file_unique_id = self._get_file_unique_id(message)
-        if file_unique_id and self.db.is_file_downloaded(file_unique_id):
-            existing_info = self.db.get_downloaded_file_info(file_unique_id)
-            if existing_info and os.path.exists(existing_info['file_path']):
+        if file_unique_id:
+            existing = await self.async_db.find_existing_downloads([file_unique_id])
+            existing_info = existing.get(str(file_unique_id))
+            if existing_info:
                 logger.info(f"文件已存在，跳過下載: {existing_info['file_name']}")
                 # 更新統計信息 - 標記為跳過
-                if self.monitor:
-                    stats = self.monitor.get_stats()
-                    stats['completed_files'] += 1
-                    self.monitor.update_stats(stats)
+                if monitor:
+                    monitor.add_completed()
+                DOWNLOAD_FILES.inc(file_type=self._get_media_type(message), chat=self._get_chat_id(message), status='skipped')
                 return [existing_info['file_name']]
-            else:
-                logger.debug(f"檔案記錄存在但實體檔案不存在，將重新下載: {file_unique_id}")
         
         try:
             os.makedirs(download_dir, exist_ok=True)
@@ -145,11 +247,12 @@ class MediaDownloader:
                 file_name = f"photo_{message.id}_{message.date.strftime('%Y%m%d_%H%M%S')}.jpg"
                 file_path = os.path.join(download_dir, file_name)
                 
-                if await self.download_media_with_retry(message, file_path):
+                perf = await self.download_media_with_retry(message, file_path, monitor=monitor)
+                if perf:
                     downloaded_files.append(file_name)
                     logger.info(f"下載照片: {file_name}")
                     # 記錄到資料庫
-                    self._record_download_to_db(message, file_name, file_path, "photo", download_dir)
+                    await self._record_download_to_db(message, file_name, file_path, "photo", download_dir, perf=perf)
                 else:
                     logger.error(f"照片下載失敗: {file_name}")
                 
@@ -187,12 +290,13 @@ class MediaDownloader:
                 
                 file_path = os.path.join(download_dir, file_name)
                 
-                if await self.download_media_with_retry(message, file_path):
+                perf = await self.download_media_with_retry(message, file_path, monitor=monitor)
+                if perf:
                     downloaded_files.append(file_name)
                     logger.info(f"下載文檔: {file_name}")
                     # 記錄到資料庫
                     mime_type = document.mime_type if document else None
-                    self._record_download_to_db(message, file_name, file_path, "document", download_dir, original_name, mime_type)
+                    await self._record_download_to_db(message, file_name, file_path, "document", download_dir, original_name, mime_type, perf=perf)
                 else:
                     logger.error(f"文檔下載失敗: {file_name}")
             
@@ -202,35 +306,39 @@ class MediaDownloader:
             logger.error(f"下載媒體時出錯: {e}")
             return []
 
-    async def download_multiple_messages_concurrent(self, messages, download_dir):
-        """並發下載多個消息的媒體文件"""
+    async def download_multiple_messages_concurrent(self, messages, download_dir, monitor=None, message_callback=None):
+        """
+        並發下載多個消息的媒體文件，monitor 未指定時使用共用的監控器。
+        message_callback(text) 用於通知發起這次下載的用戶；背景工作（監看、頻道備份、先行下載）不傳入。
+        """
         if not messages:
             return []
+        monitor = monitor or self.monitor
         
-        # 過濾已下載的文件
+        # 過濾已下載的文件（一次批次查詢）
         messages_to_download = []
         skipped_count = 0
         
-        for message in messages:
-            if not message.media:
+        media_messages = [m for m in messages if m.media]
+        unique_ids = [self._get_file_unique_id(m) for m in media_messages]
+        existing = await self.async_db.find_existing_downloads(fid for fid in unique_ids if fid)
+        
+        for message, file_unique_id in zip(media_messages, unique_ids):
+            existing_info = existing.get(str(file_unique_id)) if file_unique_id else None
+            if existing_info:
+                logger.debug(f"跳過已下載的文件: {existing_info['file_name']}")
+                skipped_count += 1
+                DOWNLOAD_FILES.inc(file_type=self._get_media_type(message), chat=self._get_chat_id(message), status='skipped')
                 continue
-                
-            file_unique_id = self._get_file_unique_id(message)
-            if file_unique_id and self.db.is_file_downloaded(file_unique_id):
-                existing_info = self.db.get_downloaded_file_info(file_unique_id)
-                if existing_info and os.path.exists(existing_info['file_path']):
-                    logger.debug(f"跳過已下載的文件: {existing_info['file_name']}")
-                    skipped_count += 1
-                    continue
             
             messages_to_download.append(message)
         
         if skipped_count > 0:
             logger.info(f"跳過 {skipped_count} 個已下載的文件")
             # 發送訊息到 Telegram
-            if self.message_callback:
+            if message_callback:
                 try:
-                    await self.message_callback(f"⏭️ 跳過 {skipped_count} 個已下載的文件")
+                    await message_callback(f"⏭️ 跳過 {skipped_count} 個已下載的文件")
                 except Exception as e:
                     logger.warning(f"發送跳過文件訊息失敗: {e}")
         
@@ -247,15 +355,9 @@ class MediaDownloader:
         messages_to_download = sorted(messages_to_download, key=self.get_media_size)
         
         # 更新監控器統計
-        if self.monitor:
-            stats = self.monitor.get_stats()
-            stats.update({
-                'total_files': total_media_count,
-                'total_size': total_size,
-                'start_time': time.time(),
-                'completed_files': stats.get('completed_files', 0) + skipped_count  # 將跳過的文件算作已完成
-            })
-            self.monitor.update_stats(stats)
+        if monitor:
+            monitor.set_totals(total_media_count, total_size)
+            monitor.add_completed(skipped_count)  # 將跳過的文件算作已完成
         
         if total_media_count == 0:
             return []
@@ -266,7 +368,7 @@ class MediaDownloader:
         download_tasks = []
         for message in messages_to_download:
             if message.media:
-                task = self.download_media_from_message(message, download_dir)
+                task = self.download_media_from_message(message, download_dir, monitor=monitor)
                 download_tasks.append(task)
         
         # 並發執行所有下載任務
@@ -280,10 +382,8 @@ class MediaDownloader:
                     all_files.extend(result)
                 elif isinstance(result, Exception):
                     logger.error(f"下載任務異常: {result}")
-                    if self.monitor:
-                        stats = self.monitor.get_stats()
-                        stats['failed_files'] += 1
-                        self.monitor.update_stats(stats)
+                    if monitor:
+                        monitor.add_failed()
             
             return all_files
             
@@ -325,8 +425,40 @@ class MediaDownloader:
             logger.debug(f"獲取文件唯一 ID 時出錯: {e}")
         return None
     
-    def _record_download_to_db(self, message, file_name, file_path, file_type, download_dir, original_file_name=None, mime_type=None):
-        """記錄下載信息到資料庫"""
+    def _get_chat_id(self, message):
+        """獲取來源頻道 ID（與資料庫 chat_id 欄位一致）"""
+        return message.peer_id.channel_id if hasattr(message.peer_id, 'channel_id') else 0
+
+    def _get_chat_title(self, message):
+        """來源聊天室名稱（Telethon 已快取實體時才有，不發出額外請求）"""
+        chat = getattr(message, 'chat', None)
+        return getattr(chat, 'title', None) or getattr(chat, 'username', None)
+
+    def _get_dc_id(self, message):
+        """獲取媒體所在的資料中心 ID"""
+        media = message.media
+        if isinstance(media, MessageMediaPhoto) and media.photo:
+            return getattr(media.photo, 'dc_id', None)
+        if isinstance(media, MessageMediaDocument) and media.document:
+            return getattr(media.document, 'dc_id', None)
+        return None
+
+    def _get_media_type(self, message):
+        """媒體類型：photo / video / document"""
+        if isinstance(message.media, MessageMediaPhoto):
+            return 'photo'
+        document = getattr(message.media, 'document', None)
+        mime_type = getattr(document, 'mime_type', None) or ''
+        if mime_type.startswith('video/'):
+            return 'video'
+        return 'document'
+    
+    async def _record_download_to_db(self, message, file_name, file_path, file_type, download_dir, original_file_name=None, mime_type=None, perf=None):
+        """記錄下載信息到資料庫，perf 為 download_media_with_retry 回傳的效能記錄"""
+        # 移動與寫入資料庫之間沒有 await，搬移暫存資料夾時不會漏掉剛完成的文件
+        file_path, download_dir = self._apply_redirect(file_path, download_dir)
+        if self.file_written_callback:
+            self.file_written_callback(download_dir)
         try:
             file_unique_id = self._get_file_unique_id(message)
             if not file_unique_id:
@@ -340,20 +472,32 @@ class MediaDownloader:
             
             file_size = os.path.getsize(file_path) if os.path.exists(file_path) else None
             
-            success = self.db.record_download(
+            success = await self.async_db.record_download(
                 file_unique_id=str(file_unique_id),
                 file_id=str(file_id),
                 message_id=message.id,
-                chat_id=message.peer_id.channel_id if hasattr(message.peer_id, 'channel_id') else 0,
+                chat_id=self._get_chat_id(message),
                 file_name=file_name,
                 file_path=file_path,
                 original_file_name=original_file_name,
                 file_size=file_size,
                 file_type=file_type,
                 mime_type=mime_type,
-                message_date=message.date
+                message_date=message.date,
+                chat_title=self._get_chat_title(message),
+                caption=getattr(message, 'message', None) or None
             )
             
+            if success and perf:
+                await self.async_db.record_download_performance(
+                    file_unique_id=str(file_unique_id),
+                    chat_id=self._get_chat_id(message),
+                    message_id=message.id,
+                    file_type=self._get_media_type(message),
+                    file_size=file_size,
+                    **perf
+                )
+
             if success:
                 logger.debug(f"成功記錄下載信息到資料庫: {file_name}")
             else:
@@ -368,9 +512,9 @@ class MediaDownloader:
         """獲取下載統計信息"""
         return self.db.get_download_statistics()
     
-    def cleanup_missing_files(self):
+    def cleanup_missing_files(self, progress_callback=None):
         """清理資料庫中指向不存在文件的記錄"""
-        return self.db.cleanup_missing_files()
+        return self.db.cleanup_missing_files(progress_callback)
     
     def get_recent_downloads(self, limit=10):
         """獲取最近下載的文件列表"""
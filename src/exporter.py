@@ -0,0 +1,87 @@
+"""
+下載記錄匯出
+
+以 DatabaseManager.iter_downloads 逐批讀取，逐筆寫入 CSV 或 JSONL，
+記憶體用量固定，可安全匯出完整歷史。寫入暫存檔，完成後才改名為目標檔案，
+中斷時不會留下不完整的報表。
+
+    count = export_downloads(db, 'history.csv', since='2024-01-01', chat_id=-100123)
+"""
+
+import csv
+import json
+import logging
+import os
+import sys
+from typing import Callable, Optional
+
+from .database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def detect_format(path: str) -> str:
+    """由副檔名判斷格式（.jsonl / .ndjson / .json 為 JSONL，其餘為 CSV）"""
+    ext = os.path.splitext(path)[1].lower()
+    return 'jsonl' if ext in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+def _write_csv(rows, out, progress_callback, progress_every):
+    writer = None
+    count = 0
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(out, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+        count += 1
+        if progress_callback and count % progress_every == 0:
+            progress_callback(count)
+    return count
+
+
+def _write_jsonl(rows, out, progress_callback, progress_every):
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row, ensure_ascii=False, default=str))
+        out.write('\n')
+        count += 1
+        if progress_callback and count % progress_every == 0:
+            progress_callback(count)
+    return count
+
+
+def export_downloads(db: DatabaseManager, path: str, fmt: Optional[str] = None,
+                     since: str = None, before: str = None, chat_id: int = None, file_type: str = None,
+                     batch_size: int = 1000, progress_callback: Callable[[int], None] = None,
+                     progress_every: int = 10000) -> int:
+    """
+    匯出符合條件的下載記錄，回傳匯出筆數。path 為 '-' 時寫到 stdout。
+    progress_callback(已匯出筆數) 每 progress_every 筆呼叫一次。
+    """
+    fmt = fmt or detect_format(path)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支援的匯出格式: {fmt}（可用: {', '.join(EXPORT_FORMATS)}）")
+    write = _write_csv if fmt == 'csv' else _write_jsonl
+    rows = db.iter_downloads(since=since, before=before, chat_id=chat_id,
+                             file_type=file_type, batch_size=batch_size)
+
+    if path == '-':
+        return write(rows, sys.stdout, progress_callback, progress_every)
+
+    tmp_path = f"{path}.part"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as out:
+            count = write(rows, out, progress_callback, progress_every)
+        os.replace(tmp_path, path)
+    except BaseException:
+        rows.close()
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    logger.info(f"已匯出 {count} 筆下載記錄到 {path}")
+    return count
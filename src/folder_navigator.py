@@ -1,33 +1,91 @@
 import os
+import json
+import time
+import zlib
 import logging
-from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass
+from typing import Callable, Dict, List, NamedTuple, Tuple, Optional
+from dataclasses import dataclass, field
+
+from .directory_index import DirectoryIndex
 
 logger = logging.getLogger(__name__)
 
+# inline keyboard：每頁資料夾按鈕數、每列按鈕數，callback_data 前綴（上限 64 bytes，資料夾以索引表示）
+FOLDER_PAGE_SIZE = 10
+FOLDER_BUTTONS_PER_ROW = 2
+CALLBACK_PREFIX = 'nav'
+# 文字界面最多列出的資料夾名稱數，避免超過 Telegram 訊息長度上限
+MAX_LISTED_FOLDERS = 30
+
+
+class MediaRef(NamedTuple):
+    """待下載媒體的精簡參照，取代完整的 Telethon Message；下載時再分批向 Telegram 取回"""
+    chat_id: int
+    message_id: int
+    size: int
+    media_type: str
+
 
 @dataclass
 class NavigationState:
     """用戶資料夾導航狀態"""
     user_id: int
     current_path: str = ""  # 相對於 ./downloads/ 的路徑
-    pending_messages: List = None  # 等待下載的消息
+    pending_refs: List[MediaRef] = None  # 等待下載的媒體參照
     media_counts: Dict[str, int] = None  # 媒體統計
     awaiting_folder_selection: bool = False
+    updated_at: float = field(default_factory=time.time)  # 最後操作時間，用於過期清除
+    page: int = 0  # inline keyboard 目前頁數
+    folder_filter: str = ""  # 以文字篩選資料夾（不分大小寫的子字串）
     
     def __post_init__(self):
-        if self.pending_messages is None:
-            self.pending_messages = []
+        if self.pending_refs is None:
+            self.pending_refs = []
         if self.media_counts is None:
             self.media_counts = {'video': 0, 'photo': 0, 'document': 0}
 
+    def to_json(self) -> str:
+        """持久化格式；參照以 [chat_id, message_id, size, type] 陣列儲存"""
+        return json.dumps({
+            'current_path': self.current_path,
+            'pending_refs': [list(ref) for ref in self.pending_refs],
+            'media_counts': self.media_counts,
+            'awaiting_folder_selection': self.awaiting_folder_selection,
+            'page': self.page,
+            'folder_filter': self.folder_filter,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, user_id: int, data: str, updated_at: float) -> "NavigationState":
+        values = json.loads(data)
+        return cls(
+            user_id=user_id,
+            current_path=values.get('current_path', ''),
+            pending_refs=[MediaRef(*ref) for ref in values.get('pending_refs', [])],
+            media_counts=values.get('media_counts'),
+            awaiting_folder_selection=values.get('awaiting_folder_selection', False),
+            updated_at=updated_at,
+            page=values.get('page', 0),
+            folder_filter=values.get('folder_filter', ''),
+        )
+
 
 class FolderNavigator:
     """資料夾導航管理器"""
     
-    def __init__(self, base_path: str = "./downloads"):
+    def __init__(self, base_path: str = "./downloads", directory_index: Optional[DirectoryIndex] = None, async_db=None,
+                 state_ttl: float = 3600, on_evict: Optional[Callable[[int], None]] = None):
         self.base_path = os.path.abspath(base_path)
         self.user_states: Dict[int, NavigationState] = {}
+        # 超過 state_ttl 秒沒有操作（未送出 /ok 就離開）的狀態會被清除，on_evict(user_id) 通知呼叫端
+        self.state_ttl = state_ttl
+        self.on_evict = on_evict
+        self._last_eviction = 0.0
+        # 資料夾內容快取，下載器寫入文件時也會讓對應資料夾失效
+        self.directory_index = directory_index or DirectoryIndex()
+        # AsyncDatabase：媒體數量讀取資料庫的 stats_by_folder（單次主鍵查詢），/scan 的核對也在資料庫線程執行，
+        # 不阻塞事件迴圈；未提供時退回以檔案系統掃描的副檔名統計
+        self.async_db = async_db
         
         # 資料夾命令映射
         self.folder_commands = {
@@ -35,10 +93,12 @@ class FolderNavigator:
             '/cd': 'change_directory', 
             '/cd..': 'parent_directory',
             '/ok': 'confirm_folder',
+            '/scan': 'reconcile_folder',
             '/創建': 'create_folder',
             '/進入': 'change_directory',
             '/退出': 'parent_directory',
-            '/確定': 'confirm_folder'
+            '/確定': 'confirm_folder',
+            '/掃描': 'reconcile_folder'
         }
         
         # 確保基礎目錄存在
@@ -46,19 +106,52 @@ class FolderNavigator:
     
     def get_user_state(self, user_id: int) -> NavigationState:
         """獲取或創建用戶狀態"""
+        self._evict_expired_throttled()
         if user_id not in self.user_states:
             self.user_states[user_id] = NavigationState(user_id=user_id)
         return self.user_states[user_id]
+
+    def evict_expired(self, now: float = None) -> List[int]:
+        """清除過期的導航狀態，回傳被清除的用戶 ID"""
+        if not self.state_ttl:
+            return []
+        cutoff = (now or time.time()) - self.state_ttl
+        expired = [uid for uid, state in self.user_states.items() if state.updated_at < cutoff]
+        for uid in expired:
+            state = self.user_states.pop(uid)
+            logger.info(f"用戶 {uid} 的導航狀態已過期，捨棄 {len(state.pending_refs)} 個待下載媒體")
+            if self.on_evict:
+                self.on_evict(uid)
+        return expired
+
+    def _evict_expired_throttled(self, interval: float = 60):
+        now = time.time()
+        if now - self._last_eviction >= interval:
+            self._last_eviction = now
+            self.evict_expired(now)
+
+    def restore_states(self, states: List[NavigationState]) -> int:
+        """載入持久化的導航狀態（例如重新啟動後），已過期的略過，回傳載入數"""
+        cutoff = time.time() - self.state_ttl if self.state_ttl else 0
+        restored = 0
+        for state in states:
+            if state.updated_at >= cutoff and state.awaiting_folder_selection:
+                self.user_states[state.user_id] = state
+                restored += 1
+        if restored:
+            logger.info(f"已恢復 {restored} 個用戶的資料夾選擇狀態")
+        return restored
     
-    def start_folder_selection(self, user_id: int, messages: List, media_counts: Dict[str, int]) -> str:
+    async def start_folder_selection(self, user_id: int, refs: List[MediaRef], media_counts: Dict[str, int]) -> str:
         """開始資料夾選擇流程"""
         state = self.get_user_state(user_id)
-        state.pending_messages = messages
+        state.pending_refs = list(refs)
         state.media_counts = media_counts
         state.awaiting_folder_selection = True
-        state.current_path = ""  # 重置到根目錄
+        self._enter(state, "")  # 重置到根目錄
+        state.updated_at = time.time()
         
-        return self._generate_folder_ui(state)
+        return await self._generate_folder_ui(state)
     
     def is_folder_command(self, text: str) -> bool:
         """檢查是否為資料夾命令"""
@@ -70,7 +163,7 @@ class FolderNavigator:
         command = command_parts[0]
         return command in self.folder_commands
     
-    def process_folder_command(self, user_id: int, text: str) -> Tuple[str, bool]:
+    async def process_folder_command(self, user_id: int, text: str) -> Tuple[str, bool]:
         """
         處理資料夾命令
         Returns: (response_message, is_confirmed)
@@ -79,6 +172,7 @@ class FolderNavigator:
         
         if not state.awaiting_folder_selection:
             return "請先發送媒體文件開始下載流程", False
+        state.updated_at = time.time()
         
         command_parts = text.split(' ', 1)
         command = command_parts[0]
@@ -90,13 +184,15 @@ class FolderNavigator:
         
         try:
             if action == 'create_folder':
-                return self._handle_create_folder(state, command_parts)
+                return await self._handle_create_folder(state, command_parts)
             elif action == 'change_directory':
-                return self._handle_change_directory(state, command_parts)
+                return await self._handle_change_directory(state, command_parts)
             elif action == 'parent_directory':
-                return self._handle_parent_directory(state)
+                return await self._handle_parent_directory(state)
             elif action == 'confirm_folder':
                 return self._handle_confirm_folder(state)
+            elif action == 'reconcile_folder':
+                return await self._handle_reconcile_folder(state)
                 
         except Exception as e:
             logger.error(f"處理資料夾命令時出錯: {e}")
@@ -104,7 +200,7 @@ class FolderNavigator:
         
         return "未知錯誤", False
     
-    def _handle_create_folder(self, state: NavigationState, command_parts: List[str]) -> Tuple[str, bool]:
+    async def _handle_create_folder(self, state: NavigationState, command_parts: List[str]) -> Tuple[str, bool]:
         """處理創建資料夾命令"""
         if len(command_parts) < 2:
             return "請提供資料夾名稱，例如: /cr 我的資料夾", False
@@ -123,21 +219,18 @@ class FolderNavigator:
         
         try:
             os.makedirs(new_folder_path, exist_ok=True)
+            self.directory_index.invalidate(new_folder_path)
             # 切換到新建的資料夾
-            if state.current_path:
-                state.current_path = f"{state.current_path}/{folder_name}"
-            else:
-                state.current_path = folder_name
-                
+            self._enter(state, f"{state.current_path}/{folder_name}" if state.current_path else folder_name)
             logger.info(f"用戶 {state.user_id} 創建並進入資料夾: {state.current_path}")
             
         except Exception as e:
             logger.error(f"創建資料夾失敗: {e}")
             return f"創建資料夾失敗: {str(e)}", False
         
-        return self._generate_folder_ui(state), False
+        return await self._generate_folder_ui(state), False
     
-    def _handle_change_directory(self, state: NavigationState, command_parts: List[str]) -> Tuple[str, bool]:
+    async def _handle_change_directory(self, state: NavigationState, command_parts: List[str]) -> Tuple[str, bool]:
         """處理切換目錄命令"""
         if len(command_parts) < 2:
             return "請提供資料夾名稱，例如: /cd 我的資料夾", False
@@ -160,26 +253,23 @@ class FolderNavigator:
         if not os.path.isdir(target_full_path):
             return f"'{folder_name}' 不是一個資料夾", False
         
-        state.current_path = target_path
+        self._enter(state, target_path)
         logger.info(f"用戶 {state.user_id} 切換到資料夾: {state.current_path}")
         
-        return self._generate_folder_ui(state), False
+        return await self._generate_folder_ui(state), False
     
-    def _handle_parent_directory(self, state: NavigationState) -> Tuple[str, bool]:
+    async def _handle_parent_directory(self, state: NavigationState) -> Tuple[str, bool]:
         """處理返回上級目錄命令"""
         if not state.current_path:
             return "已經在根目錄了", False
         
-        # 移除最後一個資料夾
-        path_parts = state.current_path.split('/')
-        if len(path_parts) > 1:
-            state.current_path = '/'.join(path_parts[:-1])
-        else:
-            state.current_path = ""
-            
+        self._go_up(state)
+        return await self._generate_folder_ui(state), False
+
+    def _go_up(self, state: NavigationState):
+        """移除最後一個資料夾"""
+        self._enter(state, state.current_path.rpartition('/')[0])
         logger.info(f"用戶 {state.user_id} 返回上級目錄: {state.current_path}")
-        
-        return self._generate_folder_ui(state), False
     
     def _handle_confirm_folder(self, state: NavigationState) -> Tuple[str, bool]:
         """處理確認資料夾命令"""
@@ -192,38 +282,159 @@ class FolderNavigator:
         
         return f"📁 已確認存放位置: {display_path}", True
     
-    def _generate_folder_ui(self, state: NavigationState) -> str:
+    async def _handle_reconcile_folder(self, state: NavigationState) -> Tuple[str, bool]:
+        """處理掃描命令：核對目前資料夾的下載記錄與實際文件"""
+        current_full_path = os.path.join(self.base_path, state.current_path) if state.current_path else self.base_path
+        self.directory_index.invalidate(current_full_path)
+        if self.async_db is None:
+            return await self._generate_folder_ui(state), False
+
+        removed = await self.async_db.reconcile_folder(current_full_path)
+        header = f"🔄 已移除 {removed} 筆文件已不存在的記錄\n\n" if removed else "🔄 記錄與文件一致\n\n"
+        return header + await self._generate_folder_ui(state), False
+
+    async def get_folder_media_counts(self, full_path: str) -> Dict[str, int]:
+        """資料夾中的影片、照片、檔案數"""
+        if self.async_db is not None:
+            return await self.async_db.get_folder_media_counts(full_path)
+        return self.directory_index.get(full_path).media_counts
+
+    @staticmethod
+    def _enter(state: NavigationState, path: str):
+        """切換目前路徑，並重置頁數與篩選"""
+        state.current_path = path
+        state.page = 0
+        state.folder_filter = ""
+
+    def _current_full_path(self, state: NavigationState) -> str:
+        return os.path.join(self.base_path, state.current_path) if state.current_path else self.base_path
+
+    def _visible_folders(self, state: NavigationState) -> Tuple[Tuple[str, ...], str]:
+        """
+        目前資料夾（套用篩選後）的子資料夾與版本碼。
+        版本碼放在 callback_data 中，資料夾內容或篩選改變後，舊按鈕的索引不會指到錯誤的資料夾
+        """
+        listing = self.directory_index.get(self._current_full_path(state))
+        folders = listing.folders
+        if state.folder_filter:
+            needle = state.folder_filter.lower()
+            folders = tuple(f for f in folders if needle in f.lower())
+        version = zlib.crc32(f"{state.current_path}\0{state.folder_filter}\0{listing.mtime_ns}".encode('utf-8'))
+        return folders, format(version, 'x')
+
+    async def set_folder_filter(self, user_id: int, text: str) -> str:
+        """設定資料夾篩選文字（空字串清除），回傳新的界面文字"""
+        state = self.get_user_state(user_id)
+        state.folder_filter = text.strip()
+        state.page = 0
+        state.updated_at = time.time()
+        return await self._generate_folder_ui(state)
+
+    def build_keyboard(self, user_id: int) -> List[List[Tuple[str, str]]]:
+        """
+        目前頁面的 inline keyboard，回傳 [[(按鈕文字, callback_data), ...], ...]
+        （不依賴 telegram 套件，由 bot 轉換為 InlineKeyboardMarkup）
+        """
+        state = self.get_user_state(user_id)
+        folders, version = self._visible_folders(state)
+        pages = max((len(folders) + FOLDER_PAGE_SIZE - 1) // FOLDER_PAGE_SIZE, 1)
+        state.page = min(max(state.page, 0), pages - 1)
+
+        rows = []
+        start = state.page * FOLDER_PAGE_SIZE
+        buttons = [
+            (f"📁 {name[:30]}", f"{CALLBACK_PREFIX}:o:{index}:{version}")
+            for index, name in enumerate(folders[start:start + FOLDER_PAGE_SIZE], start)
+        ]
+        for i in range(0, len(buttons), FOLDER_BUTTONS_PER_ROW):
+            rows.append(buttons[i:i + FOLDER_BUTTONS_PER_ROW])
+
+        if pages > 1:
+            rows.append([
+                ("⏮", f"{CALLBACK_PREFIX}:p:0"),
+                ("◀", f"{CALLBACK_PREFIX}:p:{max(state.page - 1, 0)}"),
+                (f"{state.page + 1}/{pages}", f"{CALLBACK_PREFIX}:n"),
+                ("▶", f"{CALLBACK_PREFIX}:p:{min(state.page + 1, pages - 1)}"),
+                ("⏭", f"{CALLBACK_PREFIX}:p:{pages - 1}"),
+            ])
+        if state.folder_filter:
+            rows.append([(f"🔍 清除篩選「{state.folder_filter[:20]}」", f"{CALLBACK_PREFIX}:f")])
+
+        actions = []
+        if state.current_path:
+            actions.append(("⬆ 上一層", f"{CALLBACK_PREFIX}:u"))
+        actions.append(("✅ 存到這裡", f"{CALLBACK_PREFIX}:k"))
+        actions.append(("✖ 取消", f"{CALLBACK_PREFIX}:c"))
+        rows.append(actions)
+        return rows
+
+    async def render(self, user_id: int) -> Tuple[str, List[List[Tuple[str, str]]]]:
+        """界面文字與 inline keyboard"""
+        state = self.get_user_state(user_id)
+        keyboard = self.build_keyboard(user_id)
+        return await self._generate_folder_ui(state), keyboard
+
+    def handle_callback(self, user_id: int, data: str) -> Tuple[str, str]:
+        """
+        處理 inline keyboard 按鈕
+        Returns: (提示文字, 結果) — 結果為 'render'（重新顯示）、'confirm'、'cancel' 或 'noop'
+        """
+        state = self.user_states.get(user_id)
+        if not state or not state.awaiting_folder_selection:
+            return "此資料夾選擇已結束", 'noop'
+        state.updated_at = time.time()
+
+        parts = data.split(':')
+        action = parts[1] if len(parts) > 1 else ''
+        try:
+            if action == 'o':
+                folders, version = self._visible_folders(state)
+                index = int(parts[2])
+                if parts[3] != version or not 0 <= index < len(folders):
+                    return "資料夾內容已變更，請重新選擇", 'render'
+                name = folders[index]
+                self._enter(state, f"{state.current_path}/{name}" if state.current_path else name)
+                logger.info(f"用戶 {state.user_id} 切換到資料夾: {state.current_path}")
+                return "", 'render'
+            if action == 'p':
+                state.page = int(parts[2])
+                return "", 'render'
+            if action == 'u':
+                if not state.current_path:
+                    return "已經在根目錄了", 'noop'
+                self._go_up(state)
+                return "", 'render'
+            if action == 'f':
+                state.folder_filter = ""
+                state.page = 0
+                return "", 'render'
+            if action == 'k':
+                return self._handle_confirm_folder(state)[0], 'confirm'
+            if action == 'c':
+                state.awaiting_folder_selection = False
+                logger.info(f"用戶 {state.user_id} 取消了資料夾選擇")
+                return "已取消", 'cancel'
+        except (IndexError, ValueError):
+            pass
+        return "", 'noop'
+
+    async def _generate_folder_ui(self, state: NavigationState) -> str:
         """生成資料夾選擇界面"""
         display_path = f"/{state.current_path}" if state.current_path else "/"
         
         # 獲取當前目錄下的資料夾和文件列表
-        current_full_path = os.path.join(self.base_path, state.current_path) if state.current_path else self.base_path
-        folders = []
-        current_folder_media_counts = {'video': 0, 'photo': 0, 'document': 0}
-        
-        try:
-            if os.path.exists(current_full_path):
-                for item in os.listdir(current_full_path):
-                    item_path = os.path.join(current_full_path, item)
-                    if os.path.isdir(item_path):
-                        folders.append(item)
-                    elif os.path.isfile(item_path):
-                        # 統計當前資料夾中的媒體文件
-                        item_lower = item.lower()
-                        if any(item_lower.endswith(ext) for ext in ['.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm']):
-                            current_folder_media_counts['video'] += 1
-                        elif any(item_lower.endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']):
-                            current_folder_media_counts['photo'] += 1
-                        elif any(item_lower.endswith(ext) for ext in ['.pdf', '.doc', '.docx', '.txt', '.zip', '.rar', '.7z']):
-                            current_folder_media_counts['document'] += 1
-                folders.sort()
-        except Exception as e:
-            logger.warning(f"讀取資料夾列表失敗: {e}")
+        current_full_path = self._current_full_path(state)
+        folders, _ = self._visible_folders(state)
+        current_folder_media_counts = await self.get_folder_media_counts(current_full_path)
         
         # 構建界面文字
         ui_text = f"📂 請選擇存放位置\n目前在: {display_path}\n"
+        if state.folder_filter:
+            ui_text += f"篩選: {state.folder_filter}\n"
         
-        if folders:
+        if len(folders) > MAX_LISTED_FOLDERS:
+            ui_text += f"資料夾: {', '.join(folders[:MAX_LISTED_FOLDERS])} …（共 {len(folders)} 個，可用下方按鈕翻頁或輸入文字篩選）\n"
+        elif folders:
             ui_text += f"資料夾: {', '.join(folders)}\n"
         else:
             ui_text += "資料夾: (無)\n"
@@ -242,10 +453,10 @@ class FolderNavigator:
             return os.path.join(self.base_path, state.current_path)
         return self.base_path
     
-    def get_pending_messages(self, user_id: int) -> List:
-        """獲取待處理的消息"""
-        state = self.get_user_state(user_id)
-        return state.pending_messages
+    def get_pending_refs(self, user_id: int) -> List[MediaRef]:
+        """獲取待下載的媒體參照"""
+        state = self.user_states.get(user_id)
+        return list(state.pending_refs) if state else []
     
     def clear_user_state(self, user_id: int):
         """清除用戶狀態"""
@@ -254,6 +465,7 @@ class FolderNavigator:
             logger.info(f"已清除用戶 {user_id} 的導航狀態")
     
     def is_awaiting_folder_selection(self, user_id: int) -> bool:
-        """檢查用戶是否正在選擇資料夾"""
-        state = self.get_user_state(user_id)
-        return state.awaiting_folder_selection
\ No newline at end of file
+        """檢查用戶是否正在選擇資料夾（不為未使用過的用戶建立狀態）"""
+        self._evict_expired_throttled()
+        state = self.user_states.get(user_id)
+        return bool(state and state.awaiting_folder_selection)
\ No newline at end of file
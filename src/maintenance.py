@@ -0,0 +1,121 @@
+import asyncio
+import glob
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from .async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseMaintenance:
+    """
+    背景資料庫維護：在沒有下載進行時定期執行
+    - PRAGMA optimize 與 WAL checkpoint（每 interval 秒）
+    - ANALYZE（每 analyze_interval 秒）
+    - 增量清理，歸還刪除記錄留下的空閒頁
+    - 線上備份到 backup_dir（每 backup_interval 秒，保留最新 backup_keep 份）
+    每個步驟都經由 AsyncDatabase 在資料庫線程中執行，不阻塞事件迴圈。
+    """
+
+    def __init__(self, async_db: AsyncDatabase, is_idle: Callable[[], bool],
+                 interval: float = 3600, analyze_interval: float = 86400,
+                 backup_dir: Optional[str] = None, backup_interval: float = 86400, backup_keep: int = 7,
+                 idle_poll: float = 30, min_free_pages: int = 100):
+        self.async_db = async_db
+        self.db = async_db.db
+        self.is_idle = is_idle
+        self.interval = interval
+        self.analyze_interval = analyze_interval
+        self.backup_dir = backup_dir
+        self.backup_interval = backup_interval
+        self.backup_keep = backup_keep
+        self.idle_poll = idle_poll
+        self.min_free_pages = min_free_pages
+
+        self._last_analyze = 0.0
+        self._last_backup = self._latest_backup_time()
+        self._vacuum_mode_checked = False
+        self._task = None
+
+    # ---------------------- lifecycle ----------------------
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"資料庫維護已啟動，每 {self.interval:g} 秒檢查一次")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # 等到沒有下載進行時才維護，避免與下載搶寫入鎖
+            while not self.is_idle():
+                await asyncio.sleep(self.idle_poll)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"資料庫維護出錯: {e}")
+
+    # ---------------------- steps ----------------------
+    async def run_once(self, force: bool = False):
+        """執行一輪維護；force 時不論間隔一律執行 ANALYZE 與備份（若有設定備份目錄）"""
+        now = time.time()
+        call = self.async_db.call
+
+        if not self._vacuum_mode_checked:
+            await call(self.db.enable_incremental_vacuum)
+            self._vacuum_mode_checked = True
+
+        await call(self.db.optimize)
+        if force or now - self._last_analyze >= self.analyze_interval:
+            if await call(self.db.analyze):
+                self._last_analyze = now
+
+        status = await call(self.db.get_maintenance_status)
+        if status['freelist_count'] >= self.min_free_pages:
+            await call(self.db.incremental_vacuum)
+
+        # 閒置時嘗試截斷 WAL；有讀取進行時 TRUNCATE 會回報 busy，下一輪再試
+        result = await call(self.db.checkpoint, 'TRUNCATE')
+        if result and result[0]:
+            logger.debug(f"WAL checkpoint 未完成 (busy): {result}")
+
+        if self.backup_dir and (force or now - self._last_backup >= self.backup_interval):
+            if await call(self.backup_now):
+                self._last_backup = now
+
+    def backup_now(self) -> bool:
+        """備份到 backup_dir/downloads-YYYYmmdd-HHMMSS.db 並刪除超過 backup_keep 份的舊備份"""
+        name = f"downloads-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+        if not self.db.backup(os.path.join(self.backup_dir, name)):
+            return False
+        if self.backup_keep <= 0:
+            return True
+        for old in self._list_backups()[:-self.backup_keep]:
+            try:
+                os.remove(old)
+                logger.info(f"刪除舊備份: {old}")
+            except OSError as e:
+                logger.error(f"刪除舊備份 {old} 時出錯: {e}")
+        return True
+
+    def _list_backups(self):
+        """舊到新排列的備份檔（檔名含時間，可直接排序）"""
+        if not self.backup_dir:
+            return []
+        return sorted(glob.glob(os.path.join(glob.escape(self.backup_dir), 'downloads-*.db')))
+
+    def _latest_backup_time(self) -> float:
+        backups = self._list_backups()
+        try:
+            return os.path.getmtime(backups[-1]) if backups else 0.0
+        except OSError:
+            return 0.0
@@ -0,0 +1,95 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SourceMessageCache:
+    """
+    以 (chat_id, message_id) 為鍵的 LRU 快取，保存已解析完成的待下載媒體訊息列表。
+    重複轉發同一則訊息時不需再向 Telegram 查詢。
+    - 超過 ttl 秒的項目視為過期（file reference 會失效）
+    - 下載時遇到 file reference 錯誤，可用 invalidate_message 移除包含該訊息的項目
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires_at, mode, messages)
+        self._entries: "OrderedDict[Tuple[int, int], tuple]" = OrderedDict()
+        # (chat_id, message_id) of each cached media message -> keys containing it
+        self._members: Dict[Tuple[int, int], Set[Tuple[int, int]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int, message_id: int, mode: str) -> Optional[List]:
+        """取得快取的訊息列表；mode 不同（單則/媒體組）視為未命中"""
+        key = (chat_id, message_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, entry_mode, messages = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        if entry_mode != mode:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list(messages)
+
+    def put(self, chat_id: int, message_id: int, mode: str, messages: List):
+        key = (chat_id, message_id)
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, mode, tuple(messages))
+        for m in messages:
+            self._members.setdefault(self._member_key(m), set()).add(key)
+
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def invalidate(self, chat_id: int, message_id: int):
+        """移除以 (chat_id, message_id) 為鍵的項目"""
+        self._remove((chat_id, message_id))
+
+    def invalidate_message(self, message):
+        """移除所有包含該 Telethon 訊息的項目（例如 file reference 過期時）"""
+        keys = self._members.get(self._member_key(message))
+        if not keys:
+            return
+        for key in list(keys):
+            self._remove(key)
+        logger.debug(f"已移除包含訊息 {message.id} 的快取項目")
+
+    def clear(self):
+        self._entries.clear()
+        self._members.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _member_key(message) -> Tuple[int, int]:
+        return (message.chat_id, message.id)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for m in entry[2]:
+            member_key = self._member_key(m)
+            keys = self._members.get(member_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._members[member_key]
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram 單則訊息長度上限
+MAX_MESSAGE_LENGTH = 4096
+
+
+class _Outbound:
+    """一個待發送的訊息操作（編輯或通知）"""
+
+    __slots__ = ('key', 'kind', 'message', 'texts', 'priority', 'seq', 'futures', 'reply_markup')
+
+    def __init__(self, key, kind, message, text, priority, seq, reply_markup=None):
+        self.key = key
+        self.kind = kind
+        self.message = message
+        self.texts = [text]
+        self.priority = priority
+        self.seq = seq
+        self.futures = []
+        self.reply_markup = reply_markup
+
+    @property
+    def chat_id(self):
+        return self.message.chat_id
+
+    @property
+    def text(self):
+        return '\n'.join(self.texts)
+
+
+class MessageScheduler:
+    """
+    所有 Bot API 外送訊息的統一排程器：
+    - 同一則訊息的多次編輯只送出最新內容，與上次送出內容相同時直接略過
+    - 回覆同一則訊息的通知會合併成一則
+    - 遵守全域與每個聊天室的發送頻率，收到 RetryAfter 時暫停
+    - 最終結果優先於中間進度
+    """
+
+    PRIORITY_FINAL = 0
+    PRIORITY_NOTIFY = 1
+    PRIORITY_PROGRESS = 2
+
+    def __init__(self, global_rate=25, private_chat_interval=1.0, group_chat_interval=3.0, history_size=1000):
+        self.global_rate = global_rate  # 每秒最多發送數（Bot API 上限約 30）
+        self.private_chat_interval = private_chat_interval
+        self.group_chat_interval = group_chat_interval
+        self.history_size = history_size
+
+        self._pending = {}
+        self._seq = 0
+        self._sent_times = deque()
+        self._chat_next = {}
+        self._global_next = 0.0
+        # (chat_id, message_id) -> 最後送出的文字 / 已送出最終結果的訊息
+        self._last_text = OrderedDict()
+        self._finalized = OrderedDict()
+
+        self._wakeup = None
+        self._task = None
+
+    # ---------------------- lifecycle ----------------------
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("訊息排程器已啟動")
+
+    async def stop(self, timeout=5.0):
+        """等待最終結果送出（最多 timeout 秒）後停止"""
+        if not self._task:
+            return
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and any(
+                item.priority == self.PRIORITY_FINAL for item in self._pending.values()):
+            await asyncio.sleep(0.1)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        for item in self._pending.values():
+            self._resolve(item, False)
+        self._pending.clear()
+        logger.info("訊息排程器已停止")
+
+    # ---------------------- public API ----------------------
+    def edit(self, message, text, final=False, reply_markup=None):
+        """
+        排程編輯 message 的內容。必須在事件迴圈線程中呼叫。
+        final=True 表示最終結果：優先發送，且之後的進度編輯會被忽略。
+        reply_markup 為 inline keyboard（None 會移除訊息上的按鈕）。
+        Returns: Future，送出成功時結果為 True
+        """
+        future = asyncio.get_running_loop().create_future()
+        msg_key = (message.chat_id, message.message_id)
+        content = text if reply_markup is None else (text, reply_markup)
+
+        if not final and msg_key in self._finalized:
+            future.set_result(False)
+            return future
+
+        key = ('edit',) + msg_key
+        item = self._pending.get(key)
+        if item is None:
+            if self._last_text.get(msg_key) == content:
+                future.set_result(True)
+                return future
+            priority = self.PRIORITY_FINAL if final else self.PRIORITY_PROGRESS
+            item = self._add(key, 'edit', message, text, priority)
+            item.reply_markup = reply_markup
+        else:
+            # 以最新內容取代尚未送出的編輯
+            item.texts = [text]
+            item.reply_markup = reply_markup
+            if final:
+                item.priority = self.PRIORITY_FINAL
+
+        if final:
+            self._remember(self._finalized, msg_key, True)
+        item.futures.append(future)
+        self._wake()
+        return future
+
+    def notify(self, message, text):
+        """
+        排程一則回覆 message 的通知；尚未送出的通知會合併成一則。必須在事件迴圈線程中呼叫。
+        Returns: Future，送出成功時結果為 True
+        """
+        future = asyncio.get_running_loop().create_future()
+        base_key = ('notify', message.chat_id, message.message_id)
+        key = base_key
+        part = 0
+        while key in self._pending and len(self._pending[key].text) + len(text) + 1 > MAX_MESSAGE_LENGTH:
+            part += 1
+            key = base_key + (part,)
+
+        item = self._pending.get(key)
+        if item is None:
+            item = self._add(key, 'notify', message, text, self.PRIORITY_NOTIFY)
+        else:
+            item.texts.append(text)
+        item.futures.append(future)
+        self._wake()
+        return future
+
+    # ---------------------- scheduling ----------------------
+    def _add(self, key, kind, message, text, priority):
+        self._seq += 1
+        item = _Outbound(key, kind, message, text, priority, self._seq)
+        self._pending[key] = item
+        return item
+
+    def _wake(self):
+        # 尚未 start() 時只排入佇列，啟動後會一併送出
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.history_size:
+            cache.popitem(last=False)
+
+    def _chat_interval(self, chat_id):
+        # 群組與頻道的 chat_id 為負數，限速較嚴格
+        return self.group_chat_interval if chat_id < 0 else self.private_chat_interval
+
+    def _next_ready(self):
+        """回傳 (可發送的項目, None) 或 (None, 需等待秒數 / None 表示無待發送項目)"""
+        if not self._pending:
+            return None, None
+
+        now = time.monotonic()
+        while self._sent_times and now - self._sent_times[0] >= 1.0:
+            self._sent_times.popleft()
+
+        global_ready = self._global_next
+        if len(self._sent_times) >= self.global_rate:
+            global_ready = max(global_ready, self._sent_times[0] + 1.0)
+        if global_ready > now:
+            return None, global_ready - now
+
+        wait = None
+        for item in sorted(self._pending.values(), key=lambda i: (i.priority, i.seq)):
+            chat_ready = self._chat_next.get(item.chat_id, 0.0)
+            if chat_ready <= now:
+                return item, None
+            if wait is None or chat_ready - now < wait:
+                wait = chat_ready - now
+        return None, wait
+
+    async def _run(self):
+        while True:
+            item, wait = self._next_ready()
+            if item is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            await self._send(item)
+
+    async def _send(self, item):
+        del self._pending[item.key]
+        now = time.monotonic()
+        self._sent_times.append(now)
+        self._chat_next[item.chat_id] = now + self._chat_interval(item.chat_id)
+        text = item.text
+
+        try:
+            if item.kind == 'edit':
+                await item.message.edit_text(text, reply_markup=item.reply_markup)
+                content = text if item.reply_markup is None else (text, item.reply_markup)
+                self._remember(self._last_text, (item.chat_id, item.message.message_id), content)
+            else:
+                await item.message.reply_text(text)
+            self._resolve(item, True)
+
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"Bot API 限流，{retry_after} 秒後重試")
+            self._global_next = time.monotonic() + retry_after
+            self._requeue(item)
+
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                self._resolve(item, True)
+            else:
+                logger.warning(f"訊息發送失敗: {e}")
+                self._resolve(item, False)
+
+        except Exception as e:
+            logger.warning(f"訊息發送失敗: {e}")
+            self._resolve(item, False)
+
+    def _requeue(self, item):
+        """限流後放回佇列；若期間已有同一則訊息的新編輯，保留較新的內容"""
+        newer = self._pending.get(item.key)
+        if newer is None:
+            self._pending[item.key] = item
+        elif item.kind == 'edit':
+            newer.priority = min(newer.priority, item.priority)
+            newer.futures.extend(item.futures)
+        elif len(item.text) + len(newer.text) + 1 <= MAX_MESSAGE_LENGTH:
+            item.texts.extend(newer.texts)
+            item.futures.extend(newer.futures)
+            self._pending[item.key] = item
+        else:
+            item.key = item.key + ('retry', item.seq)
+            self._pending[item.key] = item
+
+    @staticmethod
+    def _resolve(item, success):
+        for future in item.futures:
+            if not future.done():
+                future.set_result(success)
@@ -0,0 +1,257 @@
+"""
+Prometheus / OpenMetrics 指標
+
+不依賴 prometheus_client：以少量程式碼實作 Counter、Gauge、Histogram，
+並在啟用時以 http.server 於背景線程提供 /metrics 端點。
+指標在未啟用端點時仍會累計（成本只有一次加法），不影響下載效能。
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def family_name(self, openmetrics):
+        return self.name
+
+    def render(self, openmetrics=False):
+        family = self.family_name(openmetrics)
+        lines = [f'# HELP {family} {self.documentation}', f'# TYPE {family} {self.type_name}']
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+            for key, value in self._values.items()
+        ]
+
+
+class Counter(_Metric):
+    """單調遞增計數器，名稱需以 _total 結尾"""
+
+    type_name = 'counter'
+
+    def family_name(self, openmetrics):
+        # OpenMetrics 的 family 名稱不含 _total 後綴
+        if openmetrics and self.name.endswith('_total'):
+            return self.name[:-len('_total')]
+        return self.name
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [每個 bucket 的計數..., sum, count]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels):
+        """計時 context manager：with histogram.time(operation='x'): ..."""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        lines = []
+        for key, state in self._values.items():
+            for i, bound in enumerate(self.buckets):
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {state[i]}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(state[-2])}')
+            lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, openmetrics=False):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(openmetrics))
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# ---------------------- 指標定義 ----------------------
+DOWNLOAD_BYTES = REGISTRY.register(Counter(
+    'tg_download_bytes_total', 'Bytes of media downloaded', ('file_type', 'chat')))
+DOWNLOAD_FILES = REGISTRY.register(Counter(
+    'tg_download_files_total', 'Media files processed by result', ('file_type', 'chat', 'status')))
+DOWNLOAD_DURATION = REGISTRY.register(Histogram(
+    'tg_download_duration_seconds', 'Wall time to download one file including retries', ('file_type',),
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)))
+DOWNLOAD_RETRIES = REGISTRY.register(Counter(
+    'tg_download_retries_total', 'Download retries by reason', ('reason',)))
+FLOOD_WAIT_SECONDS = REGISTRY.register(Counter(
+    'tg_flood_wait_seconds_total', 'Seconds spent waiting on Telegram FloodWait'))
+ACTIVE_DOWNLOADS = REGISTRY.register(Gauge(
+    'tg_active_downloads', 'Downloads currently transferring'))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'tg_download_queue_depth', 'Work waiting to be downloaded', ('queue',)))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    'tg_db_query_duration_seconds', 'SQLite query latency', ('operation',),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    'tg_event_loop_lag_seconds', 'Delay of asyncio timer callbacks beyond their schedule',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)))
+
+# 無標籤的指標預先輸出 0，讓 Prometheus 從啟動起就有序列
+ACTIVE_DOWNLOADS.set(0)
+FLOOD_WAIT_SECONDS.inc(0)
+
+
+def timed_query(operation):
+    """DatabaseManager 方法的延遲計時裝飾器"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                DB_QUERY_DURATION.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+
+async def monitor_event_loop_lag(interval=1.0):
+    """定期測量事件迴圈延遲：sleep 實際經過時間超出預期的部分"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - start - interval, 0.0))
+
+
+# ---------------------- HTTP 端點 ----------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = REGISTRY.render(openmetrics).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取請求不寫入日誌
+        pass
+
+
+def start_http_server(port, addr='127.0.0.1'):
+    """在背景線程啟動 /metrics 端點，回傳 server（呼叫 shutdown() 停止後以 server_close() 關閉 socket）"""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"指標端點已啟動: http://{addr}:{port}/metrics")
+    return server
@@ -1,7 +1,6 @@
 import asyncio
 import logging
 import time
-import threading
 import shutil
 import os
 
@@ -9,112 +8,159 @@ logger = logging.getLogger(__name__)
 
 
 class DownloadMonitor:
-    """監控下載進度和系統資源的類"""
-    
-    def __init__(self, loop):
-        self.loop = loop
-        self.monitoring_active = False
-        self.current_download_dir = None
-        self.download_stats = {
-            'total_files': 0,
-            'completed_files': 0,
-            'failed_files': 0,
-            'total_size': 0,
-            'downloaded_size': 0,
-            'start_time': None
-        }
-    
+    """
+    監控下載進度和系統資源的類
+
+    每個下載工作使用一個獨立的 DownloadMonitor。計數器全部是整數屬性，
+    只在事件迴圈線程中讀寫，因此不需要鎖。每個併發下載佔用一個固定的 slot，
+    進度回調只更新該 slot 的位元組數與總計，不產生任何物件。
+    速度與 ETA 使用最近 window_size 個取樣的滑動視窗計算。
+    """
+
+    def __init__(self, max_slots=5, window_size=6):
+        # 統計計數器
+        self.total_files = 0
+        self.completed_files = 0
+        self.failed_files = 0
+        self.total_size = 0
+        self.downloaded_size = 0      # 有效位元組（重試時會扣除失敗嘗試的部分）
+        self.transferred_bytes = 0    # 實際傳輸位元組（單調遞增，用於計算速度）
+        self.start_time = None
+
+        # 每個併發下載的固定 slot
+        self._slot_current = [0] * max_slots
+        self._slot_total = [0] * max_slots
+        self._slot_active = [False] * max_slots
+        self._free_slots = list(range(max_slots - 1, -1, -1))
+
+        # 取樣環形緩衝區 (時間, transferred_bytes)
+        self._window_size = window_size
+        self._sample_times = [0.0] * window_size
+        self._sample_bytes = [0] * window_size
+        self._sample_index = 0
+        self._sample_count = 0
+
+    # ---------------------- counters ----------------------
+    def reset(self):
+        """開始新的下載工作"""
+        self.total_files = 0
+        self.completed_files = 0
+        self.failed_files = 0
+        self.total_size = 0
+        self.downloaded_size = 0
+        self.transferred_bytes = 0
+        self.start_time = time.time()
+        self._sample_index = 0
+        self._sample_count = 0
+
+    def set_totals(self, total_files, total_size):
+        self.total_files = total_files
+        self.total_size = total_size
+
+    def add_completed(self, count=1):
+        self.completed_files += count
+
+    def add_failed(self, count=1):
+        self.failed_files += count
+
+    # ---------------------- per-task slots ----------------------
+    def acquire_slot(self, total=0):
+        """為一個下載中的文件分配 slot"""
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            # 併發數超過預設 slot 數時擴充（正常情況不會發生）
+            slot = len(self._slot_current)
+            self._slot_current.append(0)
+            self._slot_total.append(0)
+            self._slot_active.append(False)
+        self._slot_current[slot] = 0
+        self._slot_total[slot] = total
+        self._slot_active[slot] = True
+        return slot
+
+    def release_slot(self, slot):
+        self._slot_active[slot] = False
+        self._slot_current[slot] = 0
+        self._slot_total[slot] = 0
+        self._free_slots.append(slot)
+
+    def reset_slot(self, slot):
+        """重試前扣除失敗嘗試已計入的有效位元組"""
+        self.downloaded_size -= self._slot_current[slot]
+        self._slot_current[slot] = 0
+
+    def make_progress_callback(self, slot):
+        """建立綁定 slot 的 Telethon 進度回調（每個文件建立一次，而不是每個 chunk）"""
+        slot_current = self._slot_current
+        slot_total = self._slot_total
+
+        def progress_callback(current, total):
+            delta = current - slot_current[slot]
+            if delta > 0:
+                slot_current[slot] = current
+                self.downloaded_size += delta
+                self.transferred_bytes += delta
+            if total:
+                slot_total[slot] = total
+
+        return progress_callback
+
+    def get_file_progress(self):
+        """獲取每個下載中文件的 (已下載, 總大小)"""
+        return [
+            (self._slot_current[i], self._slot_total[i])
+            for i in range(len(self._slot_active)) if self._slot_active[i]
+        ]
+
+    # ---------------------- stats ----------------------
     def update_stats(self, stats_dict):
         """更新下載統計資料"""
-        self.download_stats.update(stats_dict)
-    
+        for key, value in stats_dict.items():
+            if key in ('total_files', 'completed_files', 'failed_files', 'total_size', 'downloaded_size', 'start_time'):
+                setattr(self, key, value)
+
     def get_stats(self):
         """獲取當前統計資料"""
-        return self.download_stats.copy()
-    
-    def start_monitoring_thread(self, download_dir, processing_msg):
-        """啟動監控線程"""
-        self.current_download_dir = download_dir
-        self.monitoring_active = True
-        
-        def monitor_downloads():
-            """監控下載進度和磁碟空間"""
-            last_update = time.time()
-            
-            while self.monitoring_active:
-                try:
-                    current_time = time.time()
-                    
-                    # 每5秒更新一次
-                    if current_time - last_update >= 5:
-                        # 獲取磁碟空間資訊
-                        if self.current_download_dir and os.path.exists(self.current_download_dir):
-                            total, used, free = shutil.disk_usage(self.current_download_dir)
-                            free_gb = free / (1024**3)
-                            
-                            # 計算下載速度
-                            elapsed = current_time - (self.download_stats.get('start_time', current_time))
-                            if elapsed > 0:
-                                speed_mbps = (self.download_stats['downloaded_size'] / (1024**2)) / elapsed
-                            else:
-                                speed_mbps = 0
-                            
-                            # 計算下載進度百分比
-                            if self.download_stats['total_size'] > 0:
-                                progress_percent = (self.download_stats['downloaded_size'] / self.download_stats['total_size']) * 100
-                            else:
-                                progress_percent = 0
-                            
-                            # 構建狀態訊息
-                            status_msg = (
-                                f"⬇️ 備份進行中...\n"
-                                f"已完成: {self.download_stats['completed_files']}/{self.download_stats['total_files']} 個文件\n"
-                                f"失敗: {self.download_stats['failed_files']} 個\n"
-                                f"進度: {self.download_stats['downloaded_size']/(1024**2):.1f}MB / {self.download_stats['total_size']/(1024**2):.1f}MB ({progress_percent:.1f}%)\n"
-                                f"速度: {speed_mbps:.1f}MB/s\n"
-                                f"剩餘空間: {free_gb:.1f}GB"
-                            )
-                            
-                            # 異步更新消息
-                            asyncio.run_coroutine_threadsafe(
-                                self.safe_update_message(processing_msg, status_msg),
-                                self.loop
-                            )
-                            
-                            # 記錄詳細日誌
-                            logger.info(
-                                f"下載狀態 - 完成: {self.download_stats['completed_files']}, "
-                                f"失敗: {self.download_stats['failed_files']}, "
-                                f"速度: {speed_mbps:.1f}MB/s, "
-                                f"剩餘空間: {free_gb:.1f}GB"
-                            )
-                            
-                            last_update = current_time
-                    
-                    time.sleep(1)  # 每秒檢查一次
-                    
-                except Exception as e:
-                    logger.error(f"監控線程錯誤: {e}")
-                    time.sleep(5)
-        
-        # 在後台線程中運行監控
-        monitor_thread = threading.Thread(target=monitor_downloads, daemon=True)
-        monitor_thread.start()
-        logger.info("監控線程已啟動")
-
-    async def safe_update_message(self, processing_msg, text):
-        """安全地更新消息，避免阻塞"""
-        try:
-            await processing_msg.edit_text(text)
-        except Exception as e:
-            # 忽略消息更新錯誤，不影響下載進程
-            logger.debug(f"消息更新失敗: {e}")
-
-    def stop_monitoring(self):
-        """停止監控線程"""
-        self.monitoring_active = False
-        logger.info("監控線程已停止")
-    
+        return {
+            'total_files': self.total_files,
+            'completed_files': self.completed_files,
+            'failed_files': self.failed_files,
+            'total_size': self.total_size,
+            'downloaded_size': self.downloaded_size,
+            'start_time': self.start_time
+        }
+
+    def sample(self, now=None):
+        """記錄一次 (時間, 傳輸位元組) 取樣到環形緩衝區"""
+        now = now if now is not None else time.time()
+        index = self._sample_index
+        self._sample_times[index] = now
+        self._sample_bytes[index] = self.transferred_bytes
+        self._sample_index = (index + 1) % self._window_size
+        if self._sample_count < self._window_size:
+            self._sample_count += 1
+
+    def format_status(self, free_gb):
+        """構建進度狀態訊息"""
+        if self.total_size > 0:
+            progress_percent = (self.downloaded_size / self.total_size) * 100
+        else:
+            progress_percent = 0
+
+        status_msg = (
+            f"⬇️ 備份進行中...\n"
+            f"已完成: {self.completed_files}/{self.total_files} 個文件\n"
+            f"失敗: {self.failed_files} 個\n"
+            f"進度: {self.downloaded_size/(1024**2):.1f}MB / {self.total_size/(1024**2):.1f}MB ({progress_percent:.1f}%)\n"
+            f"速度: {self.calculate_speed():.1f}MB/s\n"
+        )
+        eta = self.calculate_eta()
+        if eta > 0:
+            status_msg += f"預計剩餘: {eta:.0f}秒\n"
+        status_msg += f"剩餘空間: {free_gb:.1f}GB"
+        return status_msg
+
     def get_disk_usage(self, path):
         """獲取指定路徑的磁碟使用情況"""
         try:
@@ -127,24 +173,126 @@ class DownloadMonitor:
                 }
         except Exception as e:
             logger.error(f"獲取磁碟使用情況失敗: {e}")
-        
+
         return {'total_gb': 0, 'used_gb': 0, 'free_gb': 0}
-    
+
     def calculate_speed(self):
-        """計算當前下載速度"""
-        if not self.download_stats.get('start_time'):
+        """計算當前下載速度 (MB/s)，以滑動視窗內最舊的取樣為基準"""
+        if not self.start_time:
             return 0
-        
-        elapsed = time.time() - self.download_stats['start_time']
+
+        now = time.time()
+        if self._sample_count > 0:
+            # 環形緩衝區中最舊的取樣
+            oldest = (self._sample_index - self._sample_count) % self._window_size
+            base_time = self._sample_times[oldest]
+            base_bytes = self._sample_bytes[oldest]
+        else:
+            base_time = self.start_time
+            base_bytes = 0
+
+        elapsed = now - base_time
         if elapsed > 0:
-            return (self.download_stats['downloaded_size'] / (1024**2)) / elapsed
+            return ((self.transferred_bytes - base_bytes) / (1024**2)) / elapsed
         return 0
-    
+
     def calculate_eta(self):
-        """計算預估剩餘時間"""
+        """計算預估剩餘時間（秒）"""
         speed = self.calculate_speed()
-        if speed > 0 and self.download_stats['total_size'] > 0:
-            remaining_size = self.download_stats['total_size'] - self.download_stats['downloaded_size']
+        if speed > 0 and self.total_size > 0:
+            remaining_size = max(self.total_size - self.downloaded_size, 0)
             remaining_mb = remaining_size / (1024**2)
             return remaining_mb / speed
-        return 0
\ No newline at end of file
+        return 0
+
+
+class ProgressReporter:
+    """
+    單一事件迴圈任務，為所有進行中的下載工作定期更新進度訊息。
+    沒有工作時等待事件而不輪詢；每次更新對每個磁碟區只查詢一次剩餘空間。
+    """
+
+    def __init__(self, message_scheduler=None, interval=5.0):
+        self.message_scheduler = message_scheduler
+        self.interval = interval
+        # monitor -> (download_dir, processing_msg)
+        self.jobs = {}
+        self._jobs_changed = None
+        self._task = None
+
+    def start(self):
+        self._jobs_changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("進度回報任務已啟動")
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("進度回報任務已停止")
+
+    def register(self, monitor, download_dir, processing_msg):
+        """開始回報一個下載工作的進度"""
+        self.jobs[monitor] = (download_dir, processing_msg)
+        if self._jobs_changed is not None:
+            self._jobs_changed.set()
+
+    def unregister(self, monitor):
+        self.jobs.pop(monitor, None)
+
+    async def _run(self):
+        while True:
+            try:
+                if not self.jobs:
+                    # 沒有進行中的工作，等待 register 事件
+                    await self._jobs_changed.wait()
+                    self._jobs_changed.clear()
+                    continue
+
+                await asyncio.sleep(self.interval)
+                await self._report()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"進度回報錯誤: {e}")
+
+    async def _report(self):
+        now = time.time()
+        free_by_device = {}
+
+        for monitor, (download_dir, processing_msg) in list(self.jobs.items()):
+            try:
+                device = os.stat(download_dir).st_dev
+            except OSError:
+                continue
+            if device not in free_by_device:
+                # 網路磁碟上 statvfs 可能很慢，放到線程中執行
+                total, used, free = await asyncio.to_thread(shutil.disk_usage, download_dir)
+                free_by_device[device] = free / (1024**3)
+            free_gb = free_by_device[device]
+
+            # 等待期間工作可能已完成
+            if monitor not in self.jobs:
+                continue
+
+            status_msg = monitor.format_status(free_gb)
+            # 取樣在格式化之後，下次回報的速度視窗至少涵蓋一個間隔
+            monitor.sample(now)
+            if self.message_scheduler:
+                self.message_scheduler.edit(processing_msg, status_msg)
+            else:
+                try:
+                    await processing_msg.edit_text(status_msg)
+                except Exception as e:
+                    # 忽略消息更新錯誤，不影響下載進程
+                    logger.debug(f"消息更新失敗: {e}")
+
+            # 記錄詳細日誌
+            logger.info(
+                f"下載狀態 - 完成: {monitor.completed_files}, "
+                f"失敗: {monitor.failed_files}, "
+                f"速度: {monitor.calculate_speed():.1f}MB/s, "
+                f"剩餘空間: {free_gb:.1f}GB"
+            )
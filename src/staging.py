@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import secrets
+import shutil
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+from .database import STAGING_DIR_NAME
+from .downloader import MediaDownloader
+from .monitor import DownloadMonitor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StagedJob:
+    """一個使用者等待選擇資料夾期間先行下載的工作"""
+    user_id: int
+    directory: str
+    monitor: DownloadMonitor
+    task: Optional[asyncio.Task] = None
+    destination: Optional[str] = None
+
+
+class StagingArea:
+    """
+    預先下載：分析完工作後立即下載到暫存資料夾，使用者瀏覽資料夾的時間與傳輸重疊。
+    - commit：已完成的文件以 os.replace 移到選定的資料夾並更新資料庫路徑；
+      仍在下載的文件透過 MediaDownloader.redirect_directory 在完成時直接移過去
+    - discard：取消下載並刪除暫存文件與其下載記錄（取消、逾時或被新工作取代時）
+    暫存資料夾與下載資料夾在同一個磁碟上，rename 為原子操作。
+    """
+
+    def __init__(self, downloader: MediaDownloader, base_path: str):
+        self.downloader = downloader
+        self.async_db = downloader.async_db
+        self.root = os.path.join(base_path, STAGING_DIR_NAME)
+        self.jobs: Dict[int, StagedJob] = {}
+        # discard_later 建立的任務；事件迴圈只保留弱參照，需持有到完成為止
+        self._discard_tasks: Set[asyncio.Task] = set()
+
+    def set_base_path(self, base_path: str):
+        """下載路徑變更後，新的工作使用新的暫存資料夾"""
+        self.root = os.path.join(base_path, STAGING_DIR_NAME)
+
+    def get(self, user_id: int) -> Optional[StagedJob]:
+        return self.jobs.get(user_id)
+
+    async def start(self, user_id: int, messages: list) -> StagedJob:
+        """開始先行下載；使用者已有未確認的工作時先捨棄"""
+        await self.discard(user_id)
+        directory = os.path.join(self.root, f"{user_id}-{secrets.token_hex(4)}")
+        monitor = DownloadMonitor(max_slots=self.downloader.max_concurrent_downloads)
+        monitor.reset()
+        job = StagedJob(user_id=user_id, directory=directory, monitor=monitor)
+        job.task = asyncio.create_task(
+            self.downloader.download_multiple_messages_concurrent(messages, directory, monitor=monitor))
+        self.jobs[user_id] = job
+        logger.info(f"用戶 {user_id} 的 {len(messages)} 個媒體開始先行下載到暫存資料夾")
+        return job
+
+    async def commit(self, user_id: int, destination: str) -> Optional[StagedJob]:
+        """
+        將工作移到選定的資料夾，回傳 StagedJob（可 await job.task 等待剩餘文件）。
+        先設定重新導向再查詢已完成的記錄：資料庫請求依序執行，
+        重新導向前完成的文件一定已寫入記錄，之後完成的文件由下載器直接移動。
+        """
+        job = self.jobs.pop(user_id, None)
+        if job is None:
+            return None
+        os.makedirs(destination, exist_ok=True)
+        job.destination = destination
+        self.downloader.redirect_directory(job.directory, destination)
+
+        rows = await self.async_db.get_folder_files(job.directory)
+        moves = []
+        for download_id, file_path in rows:
+            target_path = os.path.join(destination, os.path.basename(file_path))
+            try:
+                try:
+                    os.replace(file_path, target_path)
+                except OSError:
+                    shutil.move(file_path, target_path)
+            except OSError as e:
+                logger.error(f"移動暫存文件 {file_path} 時出錯: {e}")
+                continue
+            moves.append((download_id, target_path))
+        if moves:
+            await self.async_db.update_download_paths(moves)
+        logger.info(f"用戶 {user_id} 確認資料夾，已移動 {len(moves)} 個先行下載的文件到: {destination}")
+
+        job.task.add_done_callback(lambda _: self._finish(job))
+        return job
+
+    def _finish(self, job: StagedJob):
+        """
+        工作結束後移除暫存資料夾。沒有被 commit 移走的文件（記錄已被其他工作以同一
+        file_unique_id 取代，或沒有 file_unique_id）也移到目標資料夾；移動失敗時保留，
+        由下次啟動的 cleanup 處理。
+        """
+        self.downloader.clear_redirect(job.directory)
+        try:
+            if not os.path.isdir(job.directory):
+                return
+            for name in os.listdir(job.directory):
+                os.replace(os.path.join(job.directory, name), os.path.join(job.destination, name))
+            os.rmdir(job.directory)
+        except OSError as e:
+            logger.warning(f"暫存資料夾 {job.directory} 未清空: {e}")
+
+    async def discard(self, user_id: int) -> bool:
+        """取消並刪除使用者未確認的先行下載"""
+        job = self.jobs.pop(user_id, None)
+        if job is None:
+            return False
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+        await self._remove(job.directory)
+        logger.info(f"已捨棄用戶 {user_id} 的先行下載")
+        return True
+
+    def discard_later(self, user_id: int):
+        """從同步的回調（例如導航狀態逾時）排程 discard"""
+        if user_id not in self.jobs:
+            return
+        task = asyncio.get_running_loop().create_task(self.discard(user_id))
+        self._discard_tasks.add(task)
+        task.add_done_callback(self._discard_tasks.discard)
+
+    async def stop(self):
+        """關閉時取消未確認的先行下載並等待進行中的 discard，暫存文件留待下次啟動的 cleanup 刪除"""
+        tasks = [job.task for job in self.jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *self._discard_tasks, return_exceptions=True)
+
+    async def _remove(self, directory: str):
+        await self.async_db.delete_folder_downloads(directory)
+        await asyncio.to_thread(shutil.rmtree, directory, True)
+
+    async def cleanup(self) -> int:
+        """刪除沒有對應工作的暫存資料夾（例如重新啟動前留下的），回傳刪除數"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            logger.error(f"讀取暫存資料夾時出錯: {e}")
+            return 0
+
+        # 尚未確認的工作與已確認但仍在下載（已重新導向）的工作都保留
+        active = {os.path.abspath(job.directory) for job in self.jobs.values()}
+        active.update(self.downloader.directory_redirects)
+        removed = 0
+        for name in names:
+            directory = os.path.join(self.root, name)
+            if os.path.abspath(directory) in active or not os.path.isdir(directory):
+                continue
+            await self._remove(directory)
+            removed += 1
+        if removed:
+            logger.info(f"已清除 {removed} 個遺留的暫存資料夾")
+        return removed
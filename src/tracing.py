@@ -0,0 +1,238 @@
+"""
+請求階段追蹤
+
+以 span 記錄每個請求各階段（get_entity、get_messages、回覆、媒體組收集、
+資料夾選擇、下載、寫入資料庫）的耗時，每個 span 一行 JSON 寫入可輪替的追蹤檔。
+寫檔在背景線程中進行（QueueHandler / QueueListener），不阻塞事件迴圈；
+未設定追蹤檔時 span 不做任何事。
+
+    with tracing.span('get_entity', chat_id=chat_id):
+        ...
+
+span 以 contextvars 傳遞父子關係，asyncio.gather 建立的子任務會繼承目前的 span。
+"""
+
+import atexit
+import contextvars
+import functools
+import glob
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import secrets
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 目前的 (trace_id, span_id)
+_current_span = contextvars.ContextVar('trace_span', default=None)
+
+
+def new_trace_id():
+    return secrets.token_hex(8)
+
+
+def _new_span_id():
+    return secrets.token_hex(4)
+
+
+class Tracer:
+    """將 span 以 JSONL 寫入輪替檔案"""
+
+    def __init__(self):
+        self.path = None
+        self._trace_logger = None
+        self._listener = None
+
+    @property
+    def enabled(self):
+        return self._trace_logger is not None
+
+    def configure(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        """啟用追蹤；重複呼叫時先關閉先前的檔案"""
+        self.shutdown()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            file_handler.setFormatter(logging.Formatter('%(message)s'))
+
+            record_queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(record_queue, file_handler)
+            self._listener.start()
+
+            trace_logger = logging.getLogger('telegram_auto_download.trace')
+            trace_logger.handlers = [logging.handlers.QueueHandler(record_queue)]
+            trace_logger.setLevel(logging.INFO)
+            # 不傳到 root logger，避免追蹤資料出現在 bot.log 與 GUI
+            trace_logger.propagate = False
+
+            self._trace_logger = trace_logger
+            self.path = path
+            logger.info(f"請求追蹤已啟用: {path}")
+        except Exception as e:
+            logger.error(f"啟用請求追蹤時出錯: {e}")
+            self.shutdown()
+
+    def shutdown(self):
+        """停止背景寫檔線程並寫出剩餘的 span"""
+        if self._listener:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+        self._trace_logger = None
+
+    def record(self, name, start, duration, trace_id=None, parent_id=None, span_id=None, status='ok', **attrs):
+        """直接寫入一個已結束的 span（用於跨越多個處理器的階段，例如等待使用者選擇資料夾）"""
+        if not self._trace_logger:
+            return
+        entry = {
+            'ts': round(start, 6),
+            'trace': trace_id or new_trace_id(),
+            'span': span_id or _new_span_id(),
+            'parent': parent_id,
+            'name': name,
+            'duration_ms': round(duration * 1000, 3),
+            'status': status,
+        }
+        if attrs:
+            entry['attrs'] = attrs
+        self._trace_logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    @contextmanager
+    def span(self, name, trace_id=None, **attrs):
+        """
+        計時一個階段。yield 出的 dict 可在區塊內補充屬性（例如下載的位元組數）。
+        指定 trace_id 時開始（或接續）該追蹤，否則沿用目前的追蹤或建立新的。
+        """
+        if not self._trace_logger:
+            yield attrs
+            return
+
+        parent = _current_span.get()
+        if trace_id is None:
+            trace_id = parent[0] if parent else new_trace_id()
+            parent_id = parent[1] if parent else None
+        else:
+            parent_id = parent[1] if parent and parent[0] == trace_id else None
+
+        span_id = _new_span_id()
+        token = _current_span.set((trace_id, span_id))
+        start = time.time()
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            yield attrs
+        except BaseException as e:
+            # CancelledError / KeyboardInterrupt 不是 Exception 子類
+            status = 'error' if isinstance(e, Exception) else 'cancelled'
+            attrs.setdefault('error', type(e).__name__)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.record(name, start, time.perf_counter() - started, trace_id, parent_id, span_id, status, **attrs)
+
+    def traced(self, name):
+        """將整個函數（同步或 async）包成一個 span 的裝飾器"""
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def current_trace_id(self):
+        current = _current_span.get()
+        return current[0] if current else None
+
+
+TRACER = Tracer()
+atexit.register(TRACER.shutdown)
+
+configure = TRACER.configure
+shutdown = TRACER.shutdown
+span = TRACER.span
+record = TRACER.record
+traced = TRACER.traced
+current_trace_id = TRACER.current_trace_id
+
+
+# ---------------------- summary ----------------------
+def _percentile(sorted_values, pct):
+    """最近秩百分位數"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(-(-pct * len(sorted_values) // 100)), 1)  # ceil(pct/100 * n)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def trace_files(path):
+    """追蹤檔及其輪替檔（舊到新）"""
+    files = [p for p in glob.glob(glob.escape(path) + '.*') if p.rsplit('.', 1)[1].isdigit()]
+    files.sort(key=lambda p: int(p.rsplit('.', 1)[1]), reverse=True)
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def summarize(paths):
+    """
+    讀取追蹤檔，回傳每個階段的統計：
+    {name: {'count', 'errors', 'p50_ms', 'p99_ms', 'max_ms', 'total_ms'}}
+    """
+    durations = {}
+    errors = {}
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        name = entry['name']
+                        durations.setdefault(name, []).append(float(entry['duration_ms']))
+                        if entry.get('status') != 'ok':
+                            errors[name] = errors.get(name, 0) + 1
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError as e:
+            logger.error(f"讀取追蹤檔 {path} 時出錯: {e}")
+
+    summary = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = {
+            'count': len(values),
+            'errors': errors.get(name, 0),
+            'p50_ms': _percentile(values, 50),
+            'p99_ms': _percentile(values, 99),
+            'max_ms': values[-1],
+            'total_ms': sum(values),
+        }
+    return summary
+
+
+def format_summary(summary):
+    """將 summarize() 的結果排成文字表格（依總耗時排序）"""
+    if not summary:
+        return 'No spans found.'
+    width = max(len('phase'), *(len(name) for name in summary))
+    lines = [f"{'phase':<{width}}  {'count':>7}  {'errors':>6}  {'p50 ms':>10}  {'p99 ms':>10}  {'max ms':>10}  {'total s':>9}"]
+    for name, s in sorted(summary.items(), key=lambda kv: kv[1]['total_ms'], reverse=True):
+        lines.append(
+            f"{name:<{width}}  {s['count']:>7}  {s['errors']:>6}  {s['p50_ms']:>10.1f}  "
+            f"{s['p99_ms']:>10.1f}  {s['max_ms']:>10.1f}  {s['total_ms'] / 1000:>9.1f}"
+        )
+    return '\n'.join(lines)
@@ -60,6 +60,10 @@ class TelegramBotGUI:
         self.tray_icon = None
         self.is_minimized_to_tray = False
         
+        # Performance aggregates scan download_performance; refresh them far less often than the 1s loop
+        self.perf_refresh_interval = 60
+        self.perf_refreshed_at = 0.0
+        
         # Setup GUI
         self.setup_gui()
         self.setup_logging()
@@ -219,10 +223,55 @@ class TelegramBotGUI:
         # Refresh stats button
         # ttk.Button(stats_frame, text="Refresh Statistics", command=self.refresh_statistics).pack(side=tk.LEFT, pady=5)
         
+        # Transfer performance section
+        perf_frame = ttk.LabelFrame(parent, text="Transfer Performance", padding="10")
+        perf_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        perf_controls = ttk.Frame(perf_frame)
+        perf_controls.pack(fill=tk.X, pady=(0, 5))
+        
+        ttk.Label(perf_controls, text="Group by:").pack(side=tk.LEFT)
+        self.perf_group_var = tk.StringVar(value="Hour of Day")
+        perf_group_combo = ttk.Combobox(perf_controls, textvariable=self.perf_group_var, state="readonly", width=15,
+                                        values=("Hour of Day", "Chat", "Size Class", "Data Center"))
+        perf_group_combo.pack(side=tk.LEFT, padx=5)
+        perf_group_combo.bind("<<ComboboxSelected>>", lambda e: self.refresh_performance())
+        
+        self.perf_columns = ("Group", "Files", "Size", "Avg Speed", "Avg Time", "Avg Wait", "Avg Retries", "Flood Wait")
+        self.perf_tree = ttk.Treeview(perf_frame, columns=self.perf_columns, show="headings", height=6)
+        for col in self.perf_columns:
+            self.perf_tree.heading(col, text=col)
+            self.perf_tree.column(col, width=90)
+        self.perf_tree.column("Group", width=110)
+        self.perf_tree.pack(fill=tk.X)
+        
         # Recent downloads section
         downloads_frame = ttk.LabelFrame(parent, text="Recent Downloads", padding="10")
         downloads_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
         
+        # Search box (full-text search over file names, source chats and captions)
+        search_frame = ttk.Frame(downloads_frame)
+        search_frame.pack(fill=tk.X, pady=(0, 5))
+        
+        ttk.Label(search_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=40)
+        search_entry.pack(side=tk.LEFT, padx=5)
+        search_entry.bind("<Return>", lambda e: self.search_downloads(page=1))
+        ttk.Button(search_frame, text="Search", command=lambda: self.search_downloads(page=1)).pack(side=tk.LEFT)
+        ttk.Button(search_frame, text="Clear", command=self.clear_search).pack(side=tk.LEFT, padx=5)
+        
+        self.search_next_button = ttk.Button(search_frame, text="Next ▶", state=tk.DISABLED,
+                                             command=lambda: self.search_downloads(page=self.search_page + 1))
+        self.search_next_button.pack(side=tk.RIGHT)
+        self.search_prev_button = ttk.Button(search_frame, text="◀ Prev", state=tk.DISABLED,
+                                             command=lambda: self.search_downloads(page=self.search_page - 1))
+        self.search_prev_button.pack(side=tk.RIGHT, padx=5)
+        self.search_status_label = ttk.Label(search_frame, text="")
+        self.search_status_label.pack(side=tk.RIGHT, padx=5)
+        self.search_page = 1
+        self.search_page_size = 100
+        
         tree_frame = tk.Frame(downloads_frame)
         tree_frame.pack(fill=tk.BOTH, expand=True)
 
@@ -503,7 +552,11 @@ class TelegramBotGUI:
             
     def refresh_database(self):
         self.refresh_statistics()
-        self.refresh_downloads()
+        # Keep search results and paging on screen while a query is active
+        if not self.search_var.get().strip():
+            self.refresh_downloads()
+        if time.monotonic() - self.perf_refreshed_at >= self.perf_refresh_interval:
+            self.refresh_performance()
         time.sleep(1)
         self.refresh_database()
 
@@ -538,56 +591,134 @@ class TelegramBotGUI:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to refresh statistics: {str(e)}")
 
+    def refresh_performance(self):
+        """Refresh transfer performance aggregates"""
+        self.perf_refreshed_at = time.monotonic()
+        try:
+            for item in self.perf_tree.get_children():
+                self.perf_tree.delete(item)
+            
+            db = DatabaseManager()
+            group = self.perf_group_var.get()
+            if group == "Chat":
+                rows = db.get_throughput_by_chat()
+            elif group == "Size Class":
+                rows = db.get_throughput_by_size_class()
+            elif group == "Data Center":
+                rows = db.get_throughput_by_dc()
+            else:
+                rows = db.get_throughput_by_hour()
+            
+            for row in rows:
+                label = row['grp']
+                if group == "Hour of Day":
+                    label = f"{label}:00"
+                elif group == "Data Center":
+                    label = f"DC {label}" if label is not None else "Unknown"
+                speed = row['bytes_per_sec'] or 0
+                self.perf_tree.insert("", "end", values=(
+                    label,
+                    row['files'],
+                    f"{row['total_bytes']/(1024**2):.1f} MB",
+                    f"{speed/(1024**2):.2f} MB/s",
+                    f"{row['avg_transfer_time'] or 0:.1f}s",
+                    f"{row['avg_queue_wait'] or 0:.1f}s",
+                    f"{row['avg_retries'] or 0:.2f}",
+                    f"{row['total_flood_wait']:.0f}s"
+                ))
+                
+        except Exception as e:
+            logging.error(f"Failed to refresh performance statistics: {e}")
+
     def refresh_downloads(self):
         """Refresh recent downloads list"""
         try:
-            # Clear existing items
-            for item in self.downloads_tree.get_children():
-                self.downloads_tree.delete(item)
+            self.clear_downloads_tree()
             
             # Get recent downloads
             db = DatabaseManager()
             downloads = db.get_recent_downloads(limit=100)  # Show last 100 downloads
             
-            # Populate treeview
             for download in downloads:
-                file_name = download.get('file_name', 'Unknown')
-                file_type = download.get('file_type', 'Unknown')
-                file_size = download.get('file_size', 0)
-                download_date = download.get('download_date', '')
-                file_path = download.get('file_path', '')
-                
-                # Format file size
-                if file_size:
-                    if file_size > 1024**2:
-                        size_str = f"{file_size/(1024**2):.1f} MB"
-                    elif file_size > 1024:
-                        size_str = f"{file_size/1024:.1f} KB"
-                    else:
-                        size_str = f"{file_size} B"
-                else:
-                    size_str = "Unknown"
-                
-                # Format date
-                if download_date:
-                    try:
-                        # Parse ISO format date
-                        from datetime import datetime
-                        dt = datetime.fromisoformat(download_date.replace('Z', '+00:00'))
-                        date_str = dt.strftime("%Y-%m-%d %H:%M")
-                    except:
-                        date_str = str(download_date)[:16]  # Truncate if parsing fails
-                else:
-                    date_str = "Unknown"
-                
-                # Insert into treeview
-                self.downloads_tree.insert("", "end", values=(
-                    file_name, file_type, size_str, date_str, file_path
-                ))
+                self.insert_download_row(download)
                 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to refresh downloads: {str(e)}")
 
+    def clear_downloads_tree(self):
+        for item in self.downloads_tree.get_children():
+            self.downloads_tree.delete(item)
+
+    def search_downloads(self, page=1):
+        """Full-text search downloads and show one page of results"""
+        query = self.search_var.get().strip()
+        if not query:
+            self.clear_search()
+            return
+        try:
+            page = max(page, 1)
+            db = DatabaseManager()
+            downloads, total = db.search_downloads(query, limit=self.search_page_size,
+                                                   offset=(page - 1) * self.search_page_size)
+            self.search_page = page
+            pages = max((total + self.search_page_size - 1) // self.search_page_size, 1)
+            
+            self.clear_downloads_tree()
+            for download in downloads:
+                self.insert_download_row(download)
+            
+            self.search_status_label.config(text=f"{total} results, page {page}/{pages}")
+            self.search_prev_button.config(state=tk.NORMAL if page > 1 else tk.DISABLED)
+            self.search_next_button.config(state=tk.NORMAL if page < pages else tk.DISABLED)
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to search downloads: {str(e)}")
+
+    def clear_search(self):
+        """Leave search mode and show recent downloads again"""
+        self.search_var.set("")
+        self.search_page = 1
+        self.search_status_label.config(text="")
+        self.search_prev_button.config(state=tk.DISABLED)
+        self.search_next_button.config(state=tk.DISABLED)
+        self.refresh_downloads()
+
+    def insert_download_row(self, download):
+        """Insert one download record into the downloads tree"""
+        file_name = download.get('file_name', 'Unknown')
+        file_type = download.get('file_type', 'Unknown')
+        file_size = download.get('file_size', 0)
+        download_date = download.get('download_date', '')
+        file_path = download.get('file_path', '')
+        
+        # Format file size
+        if file_size:
+            if file_size > 1024**2:
+                size_str = f"{file_size/(1024**2):.1f} MB"
+            elif file_size > 1024:
+                size_str = f"{file_size/1024:.1f} KB"
+            else:
+                size_str = f"{file_size} B"
+        else:
+            size_str = "Unknown"
+        
+        # Format date
+        if download_date:
+            try:
+                # Parse ISO format date
+                from datetime import datetime
+                dt = datetime.fromisoformat(download_date.replace('Z', '+00:00'))
+                date_str = dt.strftime("%Y-%m-%d %H:%M")
+            except:
+                date_str = str(download_date)[:16]  # Truncate if parsing fails
+        else:
+            date_str = "Unknown"
+        
+        # Insert into treeview
+        self.downloads_tree.insert("", "end", values=(
+            file_name, file_type, size_str, date_str, file_path
+        ))
+
     def open_file_location(self):
         """Open file location of selected download"""
         try:
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import logging
+from telethon import TelegramClient, events, utils
+
+from .downloader import MediaDownloader
+from .archiver import get_chat_folder_name
+from .metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+
+class ChatWatcher:
+    """即時監看已訂閱的頻道，新媒體自動下載到各頻道的資料夾"""
+
+    def __init__(self, client: TelegramClient, downloader: MediaDownloader, base_dir,
+                 queue_size=100, group_delay=2.0, enqueue_timeout=30.0):
+        self.client = client
+        self.downloader = downloader
+        self.db = downloader.db
+        self.async_db = downloader.async_db
+        self.base_dir = base_dir
+        self.group_delay = group_delay
+        self.enqueue_timeout = enqueue_timeout
+
+        # marked chat_id -> folder_name
+        self.subscriptions = {}
+        # media group handling (與 TelegramMediaBot 相同：以 grouped_id 聚合)
+        self.media_groups = {}
+        self.group_timers = {}
+
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = []
+
+    # ---------------------- lifecycle ----------------------
+    def start(self):
+        """載入訂閱清單、註冊事件處理器並啟動下載工作者"""
+        for sub in self.db.get_watch_subscriptions():
+            self.subscriptions[sub['chat_id']] = sub['folder_name']
+
+        self.client.add_event_handler(self._on_new_message, events.NewMessage())
+        # 工作者數量與下載併發數相同，實際併發仍由下載器的 semaphore 控制
+        for _ in range(self.downloader.max_concurrent_downloads):
+            self.workers.append(asyncio.create_task(self._worker()))
+        logger.info(f"即時監看已啟動，訂閱 {len(self.subscriptions)} 個頻道")
+
+    async def stop(self):
+        self.client.remove_event_handler(self._on_new_message)
+        for timer in self.group_timers.values():
+            timer.cancel()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        logger.info("即時監看已停止")
+
+    # ---------------------- subscriptions ----------------------
+    async def subscribe(self, chat):
+        """訂閱頻道，回傳頻道實體"""
+        entity = await self.client.get_entity(chat)
+        chat_id = utils.get_peer_id(entity)
+        folder_name = get_chat_folder_name(entity)
+        title = getattr(entity, 'title', None) or getattr(entity, 'username', None)
+
+        await self.async_db.add_watch_subscription(chat_id, title, folder_name)
+        self.subscriptions[chat_id] = folder_name
+        logger.info(f"新增即時監看: {title} ({chat_id})")
+        return entity
+
+    async def unsubscribe(self, chat):
+        """取消訂閱頻道，回傳是否有訂閱"""
+        entity = await self.client.get_entity(chat)
+        chat_id = utils.get_peer_id(entity)
+        self.subscriptions.pop(chat_id, None)
+        removed = await self.async_db.remove_watch_subscription(chat_id)
+        if removed:
+            logger.info(f"取消即時監看: {chat_id}")
+        return removed
+
+    async def get_subscriptions(self):
+        return await self.async_db.get_watch_subscriptions()
+
+    # ---------------------- events ----------------------
+    async def _on_new_message(self, event):
+        if event.chat_id not in self.subscriptions:
+            return
+        message = event.message
+        if not getattr(message, 'media', None):
+            return
+
+        gid = getattr(message, 'grouped_id', None)
+        if gid:
+            self.media_groups.setdefault(gid, []).append(message)
+            # reset timer
+            if gid in self.group_timers:
+                self.group_timers[gid].cancel()
+            self.group_timers[gid] = asyncio.create_task(self._process_media_group_delayed(event.chat_id, gid))
+        else:
+            await self._enqueue(event.chat_id, [message])
+
+    async def _process_media_group_delayed(self, chat_id, grouped_id):
+        await asyncio.sleep(self.group_delay)
+        self.group_timers.pop(grouped_id, None)
+        msgs = self.media_groups.pop(grouped_id, None)
+        if msgs:
+            msgs.sort(key=lambda m: m.id)
+            await self._enqueue(chat_id, msgs)
+
+    async def _enqueue(self, chat_id, messages):
+        """放入下載佇列；佇列已滿時等待（背壓），逾時則丟棄並記錄，可用 /archive 補回"""
+        item = (chat_id, messages)
+        try:
+            self.queue.put_nowait(item)
+            QUEUE_DEPTH.set(self.queue.qsize(), queue='watch')
+            return
+        except asyncio.QueueFull:
+            logger.warning(f"監看下載佇列已滿 ({self.queue.maxsize})，等待空位...")
+
+        try:
+            await asyncio.wait_for(self.queue.put(item), timeout=self.enqueue_timeout)
+            QUEUE_DEPTH.set(self.queue.qsize(), queue='watch')
+        except asyncio.TimeoutError:
+            ids = ', '.join(str(m.id) for m in messages)
+            logger.error(f"監看下載佇列持續滿載，丟棄頻道 {chat_id} 的訊息 {ids}（可使用 /archive 補回）")
+
+    async def _worker(self):
+        while True:
+            chat_id, messages = await self.queue.get()
+            QUEUE_DEPTH.set(self.queue.qsize(), queue='watch')
+            try:
+                folder_name = self.subscriptions.get(chat_id)
+                if folder_name is None:
+                    continue  # 已取消訂閱
+                download_dir = os.path.join(self.base_dir, folder_name)
+                files = await self.downloader.download_multiple_messages_concurrent(messages, download_dir)
+                if files:
+                    logger.info(f"即時監看下載 {len(files)} 個文件到 {download_dir}")
+            except Exception as e:
+                logger.error(f"即時監看下載出錯: {e}")
+            finally:
+                self.queue.task_done()